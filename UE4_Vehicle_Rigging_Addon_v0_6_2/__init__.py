@@ -29,19 +29,53 @@ import bpy
 from . rig_op import Rig_OT_Operator, Scale_Units_OT_Operator, Upscale_Objects_OT_Operator
 from . rig_op import Set_Bone_Head_Location_OT_Operator, Set_Bone_Tail_Location_OT_Operator, Add_Bone_To_Armature_OT_Operator
 from . rig_op import Add_Another_Wheel_OT_Operator, Remove_Chosen_Wheel_OT_Operator
+from . rig_op import Save_Rig_Template_OT_Operator, Apply_Rig_Template_OT_Operator
+from . rig_op import Rig_Vehicle_Collections_OT_Operator, Auto_Detect_Parts_OT_Operator, Auto_Skin_Loose_Parts_OT_Operator
+from . rig_op import Save_Weight_Cache_OT_Operator, Load_Weight_Cache_OT_Operator, Compact_Skin_Weights_OT_Operator
+from . rig_op import Generate_Collision_OT_Operator, Bake_Test_Drive_OT_Operator, Generate_LODs_OT_Operator
+from . rig_op import Queue_Bone_OT_Operator, Remove_Pending_Bone_OT_Operator, Add_Queued_Bones_OT_Operator
 
-from . ui_panel import UI_PT_Rig_Panel, UI_PT_Scene_Setup_Panel, UI_PT_Additional_Rigging_Panel
+from . ui_panel import UI_PT_Rig_Panel, UI_PT_Scene_Setup_Panel, UI_PT_Additional_Rigging_Panel, UI_UL_Wheel_List
+from . panel_state import rig_slot_update, register_handlers, unregister_handlers
 
 def object_search_poll(self, object):
     return object.type in ['MESH', 'CURVE']
 
 class WheelItem(bpy.types.PropertyGroup):
     wheel_name: bpy.props.StringProperty()
-    wheel_mesh: bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, description = "Wheel mesh")
+    wheel_mesh: bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, description = "Wheel mesh",
+        update = rig_slot_update)
+
+class PendingBoneItem(bpy.types.PropertyGroup):
+    bone_name: bpy.props.StringProperty()
+    parent_name: bpy.props.StringProperty()
+    head: bpy.props.FloatVectorProperty(subtype = 'XYZ', unit = 'LENGTH')
+    tail: bpy.props.FloatVectorProperty(subtype = 'XYZ', unit = 'LENGTH')
+    target_mesh: bpy.props.PointerProperty(type=bpy.types.Object, description = "Mesh whose selected vertices follow the bone")
+    #Selected vertex indices, compressed (see bone_queue.encode_indices)
+    vertex_indices: bpy.props.StringProperty()
+    vertex_count: bpy.props.IntProperty()
+
+class Vehicle_Rigger_Preferences(bpy.types.AddonPreferences):
+    bl_idname = __name__
+
+    report_directory: bpy.props.StringProperty(name = "Timing Reports", subtype = 'DIR_PATH',
+        description = "Folder for per stage JSON timing reports of Rig Vehicle and Upscale Objects, empty writes none. VEHICLE_RIG_REPORT_DIR overrides it")
+    use_cprofile: bpy.props.BoolProperty(name = "Profile With cProfile", default = False,
+        description = "Run cProfile during rig stages and store hotspots with the report. VEHICLE_RIG_CPROFILE overrides it")
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "report_directory")
+        layout.prop(self, "use_cprofile")
 
 def register():
     bpy.utils.register_class(WheelItem)
+    bpy.utils.register_class(PendingBoneItem)
+    bpy.utils.register_class(Vehicle_Rigger_Preferences)
     bpy.utils.register_class(Rig_OT_Operator)
+    bpy.utils.register_class(Rig_Vehicle_Collections_OT_Operator)
+    bpy.utils.register_class(Auto_Detect_Parts_OT_Operator)
     bpy.utils.register_class(Scale_Units_OT_Operator)
     bpy.utils.register_class(Upscale_Objects_OT_Operator)
     bpy.utils.register_class(Set_Bone_Head_Location_OT_Operator)
@@ -49,14 +83,27 @@ def register():
     bpy.utils.register_class(Add_Bone_To_Armature_OT_Operator)
     bpy.utils.register_class(Add_Another_Wheel_OT_Operator)
     bpy.utils.register_class(Remove_Chosen_Wheel_OT_Operator)
+    bpy.utils.register_class(Save_Rig_Template_OT_Operator)
+    bpy.utils.register_class(Apply_Rig_Template_OT_Operator)
+    bpy.utils.register_class(Queue_Bone_OT_Operator)
+    bpy.utils.register_class(Remove_Pending_Bone_OT_Operator)
+    bpy.utils.register_class(Add_Queued_Bones_OT_Operator)
+    bpy.utils.register_class(Auto_Skin_Loose_Parts_OT_Operator)
+    bpy.utils.register_class(Save_Weight_Cache_OT_Operator)
+    bpy.utils.register_class(Load_Weight_Cache_OT_Operator)
+    bpy.utils.register_class(Compact_Skin_Weights_OT_Operator)
+    bpy.utils.register_class(Generate_Collision_OT_Operator)
+    bpy.utils.register_class(Bake_Test_Drive_OT_Operator)
+    bpy.utils.register_class(Generate_LODs_OT_Operator)
+    bpy.utils.register_class(UI_UL_Wheel_List)
     bpy.utils.register_class(UI_PT_Rig_Panel)
     bpy.utils.register_class(UI_PT_Additional_Rigging_Panel)
     bpy.utils.register_class(UI_PT_Scene_Setup_Panel)
-    bpy.types.Scene.vehicle_base = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Vehicle base mesh", description = "Vehicle Base mesh")
-    bpy.types.Scene.wheel_FR = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel FR", description = "Front Right Vehicle Wheel mesh")
-    bpy.types.Scene.wheel_FL = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel FL", description = "Front Left Vehicle Wheel mesh")
-    bpy.types.Scene.wheel_RR = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel RR", description = "Rear Right Vehicle Wheel mesh")
-    bpy.types.Scene.wheel_RL = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel RL", description = "Rear Left Vehicle Wheel mesh")
+    bpy.types.Scene.vehicle_base = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Vehicle base mesh", description = "Vehicle Base mesh", update = rig_slot_update)
+    bpy.types.Scene.wheel_FR = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel FR", description = "Front Right Vehicle Wheel mesh", update = rig_slot_update)
+    bpy.types.Scene.wheel_FL = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel FL", description = "Front Left Vehicle Wheel mesh", update = rig_slot_update)
+    bpy.types.Scene.wheel_RR = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel RR", description = "Rear Right Vehicle Wheel mesh", update = rig_slot_update)
+    bpy.types.Scene.wheel_RL = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Wheel RL", description = "Rear Left Vehicle Wheel mesh", update = rig_slot_update)
     bpy.types.Scene.brake_caliper_FR = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Brake Caliper FR", description = "Front Right Brake Caliper mesh")
     bpy.types.Scene.brake_caliper_FL = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Brake Caliper FL", description = "Front Left Brake Caliper mesh")
     bpy.types.Scene.speedometer_needle = bpy.props.PointerProperty(type=bpy.types.Object, poll = object_search_poll, name= "Speedometer Needle", description = "Speedometer Needle mesh")
@@ -64,6 +111,11 @@ def register():
     bpy.types.Scene.bone_length = bpy.props.FloatProperty(name = "Bone Length", description = "How long will be bones which will be added", default =  100, unit = 'LENGTH')
     bpy.types.Scene.bone_head_location = bpy.props.FloatVectorProperty(subtype = 'XYZ', unit = 'LENGTH')
     bpy.types.Scene.bone_tail_location = bpy.props.FloatVectorProperty(subtype = 'XYZ', unit = 'LENGTH')
+    bpy.types.Scene.bone_pivot_mode = bpy.props.EnumProperty(name = "Pivot", default = 'MEDIAN',
+        description = "Point of the selected vertices used by Set Head Location and Set Tail Location",
+        items = [('MEDIAN', "Median", "Average position of the selected vertices"),
+            ('BOUNDS', "Bounds Center", "Center of the bounding box of the selected vertices"),
+            ('CYLINDER', "Cylinder Axis", "Center of a cylinder fitted to the selected vertices, for wheels and hinges")])
     bpy.types.Scene.armature_for_new_bone = bpy.props.PointerProperty(type=bpy.types.Armature, description = "Armature to which new bone will be added",   
         name="Bone armature")
     bpy.types.Scene.armature_parent_bone_name = bpy.props.StringProperty(description = "Parent bone of new bone", name="Parent bone name")
@@ -73,12 +125,53 @@ def register():
     bpy.types.Scene.end_in_pose_mode = bpy.props.BoolProperty(default = False, 
         description = "After adding bone you will end up in pose mode to check bone weights", name = "End In Pose Mode")
     bpy.types.Scene.multiple_wheels = bpy.props.CollectionProperty(type = WheelItem)
+    bpy.types.Scene.wheel_list_index = bpy.props.IntProperty(name = "Active Wheel", default = 0)
+    bpy.types.Scene.pending_bones = bpy.props.CollectionProperty(type = PendingBoneItem)
+    bpy.types.Scene.weight_cache_directory = bpy.props.StringProperty(name = "Weight Cache", subtype = 'DIR_PATH', default = "//weight_cache",
+        description = "Folder for weight caches, one file per mesh object named after it")
+    bpy.types.Scene.weight_transfer_distance = bpy.props.FloatProperty(name = "Max Distance", default = 0.1, min = 0, unit = 'LENGTH',
+        description = "Vertices further than this from every cached vertex get no weights when loading a weight cache")
+    bpy.types.Scene.vehicles_collection = bpy.props.PointerProperty(type=bpy.types.Collection, name = "Vehicles",
+        description = "Every child collection is rigged as one vehicle, base, wheels, calipers and needles are found by object name")
+    bpy.types.Scene.upscale_vehicle_collection = bpy.props.BoolProperty(default = False,
+        description = "Upscale Objects only scales objects in the collection of the vehicle base", name = "Only Vehicle Collection")
     bpy.types.Scene.dynamic_wheel_count = bpy.props.BoolProperty(default = False, 
-        description = "Allows to rig vehicles with more or less than 4 wheels", name = "N-Wheeled vehicle")
+        description = "Allows to rig vehicles with more or less than 4 wheels", name = "N-Wheeled vehicle", update = rig_slot_update)
+    bpy.types.Scene.keep_mesh_instances = bpy.props.BoolProperty(default = False, 
+        description = "Parts sharing mesh data keep sharing it and get parented to their bones instead of being copied and skinned", 
+        name = "Keep Instanced Meshes")
+    bpy.types.Scene.armature_cleanup = bpy.props.EnumProperty(name = "Unused Armatures", 
+        description = "Which armatures without objects get removed before rigging", 
+        items = [('NONE', "Keep", "Keep all unused armatures"),
+            ('COLLECTION', "Vehicle Collection", "Remove unused armatures previously rigged into this collection"),
+            ('ALL', "Whole File", "Remove every unused armature in the file")],
+        default = 'COLLECTION')
+    bpy.types.Scene.join_rig_meshes = bpy.props.BoolProperty(default = False,
+        description = "Join the skinned parts into the vehicle base mesh and merge duplicate material slots, so UE draws the vehicle in fewer calls",
+        name = "Single Skinned Mesh")
+    bpy.types.Scene.rig_collision_proxies = bpy.props.BoolProperty(default = False,
+        description = "Build simplified collision proxies for every bone after rigging", name = "Collision Proxies")
+    bpy.types.Scene.collision_shape = bpy.props.EnumProperty(name = "Collision Shape", default = 'AUTO',
+        description = "Shape of the collision proxies",
+        items = [('AUTO', "Auto", "Convex hull for the body, boxes for wheels and other parts"),
+            ('CONVEX', "Convex Hull", "UCX_ convex hull of every part"),
+            ('BOX', "Box", "UBX_ bounding box of every part"),
+            ('CAPSULE', "Capsule", "UCP_ capsule along the longest direction of every part")])
+    bpy.types.Scene.collision_vertex_budget = bpy.props.IntProperty(name = "Vertex Budget", default = 32, min = 8, max = 255,
+        description = "Most vertices a convex hull or capsule proxy gets")
+    bpy.types.Scene.incremental_rig = bpy.props.BoolProperty(default = False, 
+        description = "Update the existing rig of the vehicle base where meshes, transforms or slots changed instead of building a new armature", 
+        name = "Incremental Re-Rig")
+    register_handlers()
 
 def unregister():
+    unregister_handlers()
     bpy.utils.unregister_class(WheelItem)
+    bpy.utils.unregister_class(PendingBoneItem)
+    bpy.utils.unregister_class(Vehicle_Rigger_Preferences)
     bpy.utils.unregister_class(Rig_OT_Operator)
+    bpy.utils.unregister_class(Rig_Vehicle_Collections_OT_Operator)
+    bpy.utils.unregister_class(Auto_Detect_Parts_OT_Operator)
     bpy.utils.unregister_class(Scale_Units_OT_Operator)
     bpy.utils.unregister_class(Upscale_Objects_OT_Operator)
     bpy.utils.unregister_class(Set_Bone_Head_Location_OT_Operator)
@@ -86,7 +179,20 @@ def unregister():
     bpy.utils.unregister_class(Add_Bone_To_Armature_OT_Operator)
     bpy.utils.unregister_class(Add_Another_Wheel_OT_Operator)
     bpy.utils.unregister_class(Remove_Chosen_Wheel_OT_Operator)
+    bpy.utils.unregister_class(Save_Rig_Template_OT_Operator)
+    bpy.utils.unregister_class(Apply_Rig_Template_OT_Operator)
+    bpy.utils.unregister_class(Queue_Bone_OT_Operator)
+    bpy.utils.unregister_class(Remove_Pending_Bone_OT_Operator)
+    bpy.utils.unregister_class(Add_Queued_Bones_OT_Operator)
+    bpy.utils.unregister_class(Auto_Skin_Loose_Parts_OT_Operator)
+    bpy.utils.unregister_class(Save_Weight_Cache_OT_Operator)
+    bpy.utils.unregister_class(Load_Weight_Cache_OT_Operator)
+    bpy.utils.unregister_class(Compact_Skin_Weights_OT_Operator)
+    bpy.utils.unregister_class(Generate_Collision_OT_Operator)
+    bpy.utils.unregister_class(Bake_Test_Drive_OT_Operator)
+    bpy.utils.unregister_class(Generate_LODs_OT_Operator)
     bpy.utils.unregister_class(UI_PT_Rig_Panel)
+    bpy.utils.unregister_class(UI_UL_Wheel_List)
     bpy.utils.unregister_class(UI_PT_Additional_Rigging_Panel)
     bpy.utils.unregister_class(UI_PT_Scene_Setup_Panel)
     del bpy.types.Scene.vehicle_base
@@ -101,13 +207,27 @@ def unregister():
     del bpy.types.Scene.bone_length
     del bpy.types.Scene.bone_head_location
     del bpy.types.Scene.bone_tail_location
+    del bpy.types.Scene.bone_pivot_mode
     del bpy.types.Scene.armature_for_new_bone
     del bpy.types.Scene.armature_parent_bone_name
     del bpy.types.Scene.new_bone_name
     del bpy.types.Scene.set_vertext_groups_to_selected
     del bpy.types.Scene.end_in_pose_mode
     del bpy.types.Scene.multiple_wheels
+    del bpy.types.Scene.wheel_list_index
+    del bpy.types.Scene.pending_bones
+    del bpy.types.Scene.weight_cache_directory
+    del bpy.types.Scene.weight_transfer_distance
+    del bpy.types.Scene.vehicles_collection
+    del bpy.types.Scene.upscale_vehicle_collection
     del bpy.types.Scene.dynamic_wheel_count
+    del bpy.types.Scene.keep_mesh_instances
+    del bpy.types.Scene.armature_cleanup
+    del bpy.types.Scene.join_rig_meshes
+    del bpy.types.Scene.rig_collision_proxies
+    del bpy.types.Scene.collision_shape
+    del bpy.types.Scene.collision_vertex_budget
+    del bpy.types.Scene.incremental_rig
     
 
 
@@ -0,0 +1,305 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Headless batch rigging. Usage:
+#   blender --background --python batch_cli.py -- manifest.json --jobs 8 --output-dir out --report report.json
+#The manifest is either a text file with one .blend/.fbx path per line or a JSON file:
+#   {"files": [...], "naming_rules": {"wheel_FR": "..."}, "bone_length": 100, "set_unit_scale": true, "keep_instances": false,
+#    "join_meshes": false, "template": "rig_template.json"}
+
+import argparse, json, os, subprocess, sys, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == "__main__" and not __package__:
+    #Started with --python, so re-import this file as part of the add-on package and run from there
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(addon_dir))
+    import importlib
+    cli = importlib.import_module(os.path.basename(addon_dir) + ".batch_cli")
+    sys.exit(cli.main(cli.blender_argv()))
+
+import bpy
+
+from . naming import apply_slots, resolve_slots
+from . rig_core import gather_rig_inputs, resolve_template, rig_vehicle
+from . panel_state import ue_units_set
+from . rig_spec import load_rig_spec
+
+
+def blender_argv():
+    #Blender keeps its own arguments in sys.argv, script arguments come after "--"
+    argv = sys.argv
+    return argv[argv.index('--') + 1:] if '--' in argv else []
+
+
+def read_manifest(path):
+    with open(path) as manifest_file:
+        text = manifest_file.read()
+
+    if path.lower().endswith('.json'):
+        manifest = json.loads(text)
+        if isinstance(manifest, list):
+            manifest = {'files': manifest}
+    else:
+        files = [line.strip() for line in text.splitlines()]
+        manifest = {'files': [line for line in files if line and not line.startswith('#')]}
+
+    #Paths in the manifest are relative to the manifest itself
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    manifest['files'] = [os.path.normpath(os.path.join(manifest_dir, f)) for f in manifest['files']]
+    if manifest.get('template'):
+        manifest['template'] = os.path.normpath(os.path.join(manifest_dir, manifest['template']))
+    return manifest
+
+
+def reset_file():
+    #Empty file with factory settings, so unit settings, rig slots, wheel lists, collections and armatures of an
+    #earlier job in the same process can't change the next one. Workers register the add-on by hand instead of
+    #enabling it, so it is registered again should the reset have dropped it
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    ensure_registered()
+
+
+def load_file(path):
+    if path.lower().endswith('.blend'):
+        bpy.ops.wm.open_mainfile(filepath=path)
+    elif path.lower().endswith('.fbx'):
+        reset_file()
+        bpy.ops.import_scene.fbx(filepath=path)
+    else:
+        raise ValueError("Unsupported file type: " + path)
+
+
+def output_names(files):
+    #Output file names from the paths below the folder all files share, so car_a/body.blend and car_b/body.blend
+    #become car_a_body and car_b_body. Raises ValueError for files that would still write the same outputs
+    common = os.path.commonpath([os.path.dirname(path) for path in files]) if files else ''
+    names = [os.path.splitext(os.path.relpath(path, common))[0].replace(os.sep, '_') for path in files]
+
+    by_name = {}
+    for path, name in zip(files, names):
+        by_name.setdefault(name.lower(), []).append(path)
+    clashes = [paths for paths in by_name.values() if len(paths) > 1]
+    if clashes:
+        raise ValueError("Files would overwrite each other's outputs: " + "; ".join(", ".join(paths) for paths in clashes))
+    return names
+
+
+def rig_file(path, options, output_name=None):
+    #output_name defaults to the file name without extension
+    result = {'file': path, 'success': False, 'error': None, 'slots': {}, 'timings': {},
+        'bone_count': 0, 'vertex_count': 0, 'outputs': []}
+    start = time.perf_counter()
+
+    try:
+        load_file(path)
+        result['timings']['load'] = time.perf_counter() - start
+
+        scene = bpy.context.scene
+        if options.get('set_unit_scale'):
+            scene.unit_settings.system = 'METRIC'
+            scene.unit_settings.scale_length = 0.01
+        if 'bone_length' in options:
+            scene.bone_length = options['bone_length']
+
+        step = time.perf_counter()
+        keep_instances = options.get('keep_instances', False)
+        spec = None
+        if options.get('template'):
+            #Rig templates carry their own bone layout and name patterns
+            spec = load_rig_spec(options['template'])
+            vehicle_base, parts, template_instances, missing = resolve_template(spec, scene.objects)
+            keep_instances = keep_instances or template_instances
+            bone_length = spec['bone_length']
+            if vehicle_base is None:
+                raise RuntimeError("No vehicle base matches the rig template")
+            result['slots'] = {'vehicle_base': vehicle_base.name, 'parts': {bone_name: obj.name for bone_name, obj in parts},
+                'missing': missing}
+        else:
+            slots = resolve_slots(scene.objects, options.get('naming_rules'))
+            apply_slots(scene, slots)
+            result['slots'] = {slot: (obj.name if obj is not None else None) for slot, obj in slots.items() if slot != 'multiple_wheels'}
+            result['slots']['multiple_wheels'] = [wheel.name for wheel in slots['multiple_wheels']]
+            if not bpy.ops.view3d.rig_vehicle.poll():
+                raise RuntimeError("Vehicle can't be rigged, check resolved slots and that scene units are set for UE (set_unit_scale)")
+            vehicle_base, parts = gather_rig_inputs(scene)
+            bone_length = scene.bone_length
+        result['timings']['resolve'] = time.perf_counter() - step
+
+        if not ue_units_set(scene):
+            raise RuntimeError("Scene units are not set for UE (set_unit_scale)")
+
+        step = time.perf_counter()
+        rig = rig_vehicle(bpy.context, vehicle_base, parts, bone_length, collection=scene.collection,
+            keep_instances=keep_instances, join_meshes=options.get('join_meshes', False), template=spec)
+        result['timings']['rig'] = time.perf_counter() - step
+
+        armature_object = rig['armature']
+        result['bone_count'] = len(armature_object.data.bones)
+        result['removed_armatures'] = rig['removed_armatures']
+        result['stages'] = rig['stages']
+        result['sections'] = rig['sections']
+        result['vertex_count'] = sum(len(obj.data.vertices) for obj in [vehicle_base] + [obj for bone_name, obj in parts]
+            if obj.type == 'MESH')
+
+        step = time.perf_counter()
+        output_dir = options.get('output_dir')
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            name = output_name or os.path.splitext(os.path.basename(path))[0]
+            blend_path = os.path.join(output_dir, name + '.blend')
+            bpy.ops.wm.save_as_mainfile(filepath=blend_path, copy=True)
+            result['outputs'].append(blend_path)
+            if options.get('export_fbx'):
+                fbx_path = os.path.join(output_dir, name + '.fbx')
+                bpy.ops.export_scene.fbx(filepath=fbx_path, add_leaf_bones=False, bake_anim=False)
+                result['outputs'].append(fbx_path)
+        result['timings']['save'] = time.perf_counter() - step
+
+        result['success'] = True
+    except Exception as error:
+        result['error'] = "{}: {}".format(type(error).__name__, error)
+
+    result['timings']['total'] = time.perf_counter() - start
+    return result
+
+
+def ensure_registered():
+    #Workers run with --factory-startup, so the add-on isn't enabled yet
+    if not hasattr(bpy.types.Scene, 'vehicle_base'):
+        from . import register
+        register()
+
+
+def run_worker(path, options_path, result_path, output_name=None):
+    ensure_registered()
+    with open(options_path) as options_file:
+        options = json.load(options_file)
+
+    result = rig_file(path, options, output_name)
+
+    with open(result_path, 'w') as result_file:
+        json.dump(result, result_file, indent=2)
+    return 0 if result['success'] else 1
+
+
+def run_job(blender, path, options_path, result_path, timeout, output_name=None):
+    command = [blender, '--background', '--factory-startup', '--python', os.path.abspath(__file__),
+        '--', '--worker', path, '--options', options_path, '--result', result_path]
+    if output_name:
+        command += ['--output-name', output_name]
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=timeout)
+        output = process.stdout
+    except subprocess.TimeoutExpired:
+        output = "Timed out after {} seconds".format(timeout)
+
+    if os.path.exists(result_path):
+        with open(result_path) as result_file:
+            result = json.load(result_file)
+    else:
+        #Worker crashed before it could write a result
+        result = {'file': path, 'success': False, 'error': output[-2000:], 'slots': {}, 'timings': {},
+            'bone_count': 0, 'vertex_count': 0, 'outputs': []}
+    result['timings']['process'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(manifest, args):
+    options = {
+        'naming_rules': manifest.get('naming_rules', {}),
+        'set_unit_scale': manifest.get('set_unit_scale', args.set_unit_scale),
+        'output_dir': os.path.abspath(args.output_dir) if args.output_dir else None,
+        'export_fbx': args.export_fbx,
+        'keep_instances': manifest.get('keep_instances', args.keep_instances),
+        'join_meshes': manifest.get('join_meshes', args.join_meshes),
+        'template': manifest.get('template') or (os.path.abspath(args.template) if args.template else None),
+    }
+    if 'bone_length' in manifest:
+        options['bone_length'] = manifest['bone_length']
+
+    blender = args.blender or bpy.app.binary_path
+    files = manifest['files']
+    #Checked before any worker starts, parallel workers writing one file would also race
+    names = output_names(files) if options['output_dir'] else [None] * len(files)
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(prefix='vehicle_rig_') as temp_dir:
+        options_path = os.path.join(temp_dir, 'options.json')
+        with open(options_path, 'w') as options_file:
+            json.dump(options, options_file)
+
+        #Threads only wait on the worker Blender processes, the rigging itself runs in parallel processes
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(run_job, blender, path, options_path,
+                os.path.join(temp_dir, '{}.json'.format(index)), args.timeout, name) for index, (path, name) in enumerate(zip(files, names))]
+            results = [future.result() for future in futures]
+
+    report = {
+        'files': len(results),
+        'succeeded': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success']),
+        'jobs': args.jobs,
+        'wall_time': time.perf_counter() - start,
+        'results': results,
+    }
+    return report
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='batch_cli.py', description="Rig a library of vehicles headlessly")
+    parser.add_argument('manifest', nargs='?', help="Text or JSON manifest of .blend/.fbx files")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Number of worker Blender processes")
+    parser.add_argument('--output-dir', help="Directory for rigged .blend files")
+    parser.add_argument('--export-fbx', action='store_true', help="Also export an .fbx next to each rigged .blend")
+    parser.add_argument('--template', help="JSON rig template used instead of the naming rules")
+    parser.add_argument('--keep-instances', action='store_true', help="Keep wheels sharing mesh data instanced")
+    parser.add_argument('--join-meshes', action='store_true', help="Join the skinned parts of each vehicle into one mesh")
+    parser.add_argument('--set-unit-scale', action='store_true', help="Set metric 0.01 unit scale before rigging")
+    parser.add_argument('--report', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--blender', help="Blender executable for workers, defaults to the running one")
+    parser.add_argument('--timeout', type=float, default=None, help="Seconds before a worker is killed")
+    parser.add_argument('--worker', metavar='FILE', help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    parser.add_argument('--output-name', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(args.worker, args.options, args.result, args.output_name)
+
+    if not args.manifest:
+        parser.error("manifest is required")
+
+    try:
+        report = run_batch(read_manifest(args.manifest), args)
+    except ValueError as error:
+        parser.error(str(error))
+
+    for result in report['results']:
+        status = "OK  " if result['success'] else "FAIL"
+        print("{} {} bones={} time={:.2f}s {}".format(status, result['file'], result['bone_count'],
+            result['timings'].get('total', 0.0), result['error'] or ''))
+    print("{} of {} files rigged in {:.2f}s".format(report['succeeded'], report['files'], report['wall_time']))
+
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return 0 if report['failed'] == 0 else 1
@@ -0,0 +1,132 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Extra bones (doors, hood, wipers, suspension arms) added in batches: all bones in one armature edit session,
+#then the weights of every mesh in one pass. Pending bones are plain dicts:
+#   {'name': str, 'head': xyz, 'tail': xyz, 'parent': bone name, 'mesh': object or None, 'indices': int32 array}
+
+import base64, zlib
+
+import bpy
+import numpy as np
+
+
+def selected_vertex_indices(obj):
+    #Indices of selected vertices, synced from edit mode only when something is selected
+    mesh = obj.data
+    if mesh.total_vert_sel == 0:
+        return np.empty(0, dtype=np.int32)
+    if obj.mode == 'EDIT':
+        obj.update_from_editmode()
+    select = np.empty(len(mesh.vertices), dtype=bool)
+    mesh.vertices.foreach_get('select', select)
+    return np.flatnonzero(select).astype(np.int32)
+
+
+def encode_indices(indices):
+    #Compact string for a StringProperty, selections are mostly runs so the deltas compress well
+    deltas = np.diff(np.asarray(indices, dtype=np.int32), prepend=np.int32(0)).astype(np.int32)
+    return base64.b64encode(zlib.compress(deltas.tobytes())).decode('ascii')
+
+
+def decode_indices(text):
+    if not text:
+        return np.empty(0, dtype=np.int32)
+    deltas = np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=np.int32)
+    return np.cumsum(deltas, dtype=np.int64).astype(np.int32)
+
+
+def missing_parents(armature_data, pending):
+    #Pending bones whose parent is neither in the armature nor queued before them, as (bone, parent) name pairs
+    known = {bone.name for bone in armature_data.bones}
+    missing = []
+    for bone_spec in pending:
+        if bone_spec['parent'] not in known:
+            missing.append((bone_spec['name'], bone_spec['parent']))
+        known.add(bone_spec['name'])
+    return missing
+
+
+def create_bones(context, armature_object, pending):
+    #One edit mode session for all bones. Parents can be existing bones or earlier pending ones.
+    #Returns the created bone names, Blender may rename bones on creation
+    context.view_layer.objects.active = armature_object
+    armature_object.select_set(True)
+    bpy.ops.object.mode_set(mode='EDIT')
+
+    edit_bones = armature_object.data.edit_bones
+    created = {}
+    bone_names = []
+    for bone_spec in pending:
+        bone = edit_bones.new(bone_spec['name'])
+        bone.head = bone_spec['head']
+        bone.tail = bone_spec['tail']
+        bone.parent = edit_bones[created.get(bone_spec['parent'], bone_spec['parent'])]
+        created[bone_spec['name']] = bone.name
+        bone_names.append(bone.name)
+
+    bpy.ops.object.mode_set(mode='OBJECT')
+    return bone_names
+
+
+def assign_selection_weights(mesh_object, bone_selections):
+    #bone_selections are (group name, vertex indices) pairs in queue order. Every listed vertex leaves all
+    #other groups and gets weight 1 in its group, a vertex listed twice goes to the last bone like
+    #adding the bones one by one would. Returns the number of weighted vertices
+    vertex_count = len(mesh_object.data.vertices)
+    owner = np.full(vertex_count, -1, dtype=np.int32)
+    for bone_index, (group_name, indices) in enumerate(bone_selections):
+        owner[indices[indices < vertex_count]] = bone_index
+
+    weighted = np.flatnonzero(owner >= 0).astype(np.int32)
+    if len(weighted) == 0:
+        return 0
+
+    vertex_groups = mesh_object.vertex_groups
+    #One remove per existing group instead of one subtract per group and bone
+    for group in vertex_groups:
+        group.remove(weighted)
+
+    for bone_index, (group_name, indices) in enumerate(bone_selections):
+        group = vertex_groups.get(group_name)
+        if group is None:
+            group = vertex_groups.new(name=group_name)
+        bone_indices = np.flatnonzero(owner == bone_index).astype(np.int32)
+        if len(bone_indices):
+            group.add(bone_indices, 1.0, 'REPLACE')
+
+    return len(weighted)
+
+
+def commit_bones(context, armature_object, pending, weight_selected=True):
+    #Creates all pending bones and their vertex groups, meshes have to be in object mode.
+    #Returns {'bone_names': [...], 'weighted_vertex_count': int}, check missing_parents first
+    bone_names = create_bones(context, armature_object, pending)
+
+    by_mesh = {}
+    for bone_spec, bone_name in zip(pending, bone_names):
+        if bone_spec['mesh'] is not None:
+            by_mesh.setdefault(bone_spec['mesh'], []).append((bone_name, bone_spec['indices']))
+
+    weighted_vertex_count = 0
+    for mesh_object, bone_selections in by_mesh.items():
+        if weight_selected:
+            weighted_vertex_count += assign_selection_weights(mesh_object, bone_selections)
+        else:
+            for bone_name, indices in bone_selections:
+                if mesh_object.vertex_groups.get(bone_name) is None:
+                    mesh_object.vertex_groups.new(name=bone_name)
+
+    return {'bone_names': bone_names, 'weighted_vertex_count': weighted_vertex_count}
@@ -0,0 +1,219 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Simplified collision bodies per bone, so UE doesn't build the physics of a vehicle from its render geometry.
+#Proxies follow UE's naming (UCX_ convex, UBX_ box, UCP_ capsule), are parented to their bone and export
+#with the rig. Points come from the vertices each bone drives, shapes are fitted with numpy and only the
+#final hull of at most the vertex budget goes through bmesh
+
+import bmesh
+import bpy
+import numpy as np
+
+from . rig_core import LOD_LEVEL_KEY, parent_to_bone
+from . transforms import world_coordinates
+from . weights import read_vertex_weights
+
+
+PROXY_PREFIXES = {'CONVEX': 'UCX', 'BOX': 'UBX', 'CAPSULE': 'UCP'}
+
+#Custom property on proxy objects holding the bone they belong to, proxies with it are replaced on every run
+COLLISION_PROXY_KEY = "vehicle_collision_proxy"
+
+#Projections computed at once when searching extreme points
+PROJECTION_CHUNK = 4 * 1024 * 1024
+
+#A vertex belongs to a bone's body from this weight on, so blended vertices count for their main bone only
+BODY_WEIGHT = 0.5
+
+
+def sphere_directions(count):
+    #Evenly spread unit vectors on a Fibonacci spiral
+    index = np.arange(count) + 0.5
+    z = 1 - 2 * index / count
+    angle = np.pi * (1 + 5 ** 0.5) * index
+    ring = np.sqrt(1 - z * z)
+    return np.column_stack([ring * np.cos(angle), ring * np.sin(angle), z])
+
+
+def extreme_points(points, budget):
+    #Points furthest along many directions are all on the convex hull. Where more than budget of them
+    #come up, the ones extreme for the most directions (the most pronounced corners) are kept
+    directions = sphere_directions(4 * budget)
+    #Projections go chunk by chunk, a dense body times a thousand directions would not fit in memory
+    best = np.full(len(directions), -np.inf)
+    best_index = np.zeros(len(directions), dtype=np.int64)
+    chunk = max(PROJECTION_CHUNK // len(directions), 1)
+    for start in range(0, len(points), chunk):
+        projections = points[start:start + chunk] @ directions.T
+        chunk_best = projections.argmax(axis=0)
+        values = projections[chunk_best, np.arange(len(directions))]
+        better = values > best
+        best[better] = values[better]
+        best_index[better] = chunk_best[better] + start
+    picked, hits = np.unique(best_index, return_counts=True)
+    if len(picked) > budget:
+        picked = picked[np.argsort(-hits, kind='stable')[:budget]]
+    return points[picked]
+
+
+def box_points(points):
+    #Flat parts like needles get some thickness, a box with no volume has no hull
+    low, high = points.min(axis=0), points.max(axis=0)
+    pad = np.maximum(0.02 * (high - low).max() - (high - low), 0) / 2
+    low, high = low - pad, high + pad
+    return np.array([(x, y, z) for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2])])
+
+
+def capsule_points(points, budget):
+    #Capsule around the principal axis of the points holding all of them, sampled as two hemispheres
+    center = points.mean(axis=0)
+    centered = points - center
+    values, vectors = np.linalg.eigh(centered.T @ centered)
+    axis = vectors[:, 2]
+    along = centered @ axis
+    radius = np.linalg.norm(centered - np.outer(along, axis), axis=1).max()
+    half_length = max((along.max() - along.min()) / 2 - radius, 0.0)
+    middle = center + axis * (along.max() + along.min()) / 2
+
+    #Directions on a sphere, the upper half is pushed to one end and the lower half to the other
+    directions = np.concatenate([sphere_directions(max(budget - 2, 6)), [axis, -axis]])
+    side = np.where(directions @ axis >= 0, 1.0, -1.0)
+    return middle + directions * radius + np.outer(side * half_length, axis)
+
+
+def shape_points(points, shape, budget):
+    if shape == 'BOX':
+        return box_points(points)
+    if shape == 'CAPSULE':
+        return capsule_points(points, budget)
+    return extreme_points(points, budget)
+
+
+def hull_mesh(name, points):
+    #Convex hull mesh of the points, None when they are flat or a line
+    bm = bmesh.new()
+    for co in points:
+        bm.verts.new(co)
+    result = bmesh.ops.convex_hull(bm, input=bm.verts)
+    unused = result['geom_interior'] + result['geom_unused']
+    if unused:
+        bmesh.ops.delete(bm, geom=[element for element in unused if isinstance(element, bmesh.types.BMVert)], context='VERTS')
+    if len(bm.faces) < 4:
+        bm.free()
+        return None
+    mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(mesh)
+    bm.free()
+    return mesh
+
+
+def rig_meshes(armature_object):
+    #Meshes the armature deforms or carries on its bones, proxies and LOD copies left out
+    meshes = []
+    for obj in bpy.data.objects:
+        if obj.type != 'MESH' or COLLISION_PROXY_KEY in obj or LOD_LEVEL_KEY in obj:
+            continue
+        skinned = any(modifier.type == 'ARMATURE' and modifier.object == armature_object for modifier in obj.modifiers)
+        if skinned or (obj.parent == armature_object and obj.parent_type == 'BONE'):
+            meshes.append(obj)
+    return meshes
+
+
+def bone_point_clouds(armature_object, meshes):
+    #World space points per bone and the mesh most of them come from: {bone name: (points, mesh name)}.
+    #Skinned meshes give every bone the vertices it mostly drives, which also splits a joined vehicle mesh
+    #into its parts. Bone parented meshes give all their vertices to the parent bone
+    bone_names = set(bone.name for bone in armature_object.data.bones)
+    chunks = {}
+    for obj in meshes:
+        co = world_coordinates(obj)
+        if obj.parent == armature_object and obj.parent_type == 'BONE':
+            chunks.setdefault(obj.parent_bone, []).append((co, obj.name))
+            continue
+
+        vertices, groups, weights = read_vertex_weights(obj.data)
+        body = weights >= BODY_WEIGHT
+        vertices, groups = vertices[body], groups[body]
+        for group_index in np.unique(groups):
+            group_name = obj.vertex_groups[int(group_index)].name
+            if group_name in bone_names:
+                chunks.setdefault(group_name, []).append((co[vertices[groups == group_index]], obj.name))
+
+    clouds = {}
+    for bone_name, parts in chunks.items():
+        owner = max(parts, key=lambda part: len(part[0]))[1]
+        clouds[bone_name] = (np.concatenate([points for points, name in parts]), owner)
+    return clouds
+
+
+def bone_shapes(armature_object, shape='AUTO'):
+    #'AUTO' gives the body (Root) a convex hull and every other part a box
+    if shape == 'AUTO':
+        return {bone.name: ('CONVEX' if bone.name == 'Root' else 'BOX') for bone in armature_object.data.bones}
+    return {bone.name: shape for bone in armature_object.data.bones}
+
+
+def remove_collision_proxies(armature_object):
+    removed = 0
+    for obj in [obj for obj in armature_object.children if COLLISION_PROXY_KEY in obj]:
+        mesh = obj.data
+        bpy.data.objects.remove(obj)
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+        removed += 1
+    return removed
+
+
+def build_collision_proxies(armature_object, bone_shapes, budget=32, collection=None):
+    #bone_shapes maps bone names to 'CONVEX', 'BOX' or 'CAPSULE', bones missing from it get no proxy.
+    #Earlier proxies of the armature are replaced. Returns {'proxies': [names], 'vertices': int, 'source_vertices': int}
+    remove_collision_proxies(armature_object)
+    if collection is None:
+        collection = armature_object.users_collection[0]
+
+    clouds = bone_point_clouds(armature_object, rig_meshes(armature_object))
+    proxies = []
+    vertex_count = 0
+    source_vertex_count = 0
+    numbers = {}
+    for bone_name, (points, owner) in clouds.items():
+        shape = bone_shapes.get(bone_name)
+        if shape is None or len(points) < 4:
+            continue
+
+        #UE pairs collision with its render mesh by name and numbers bodies of one mesh
+        number = numbers.get((shape, owner), 0)
+        numbers[(shape, owner)] = number + 1
+        name = "{}_{}_{:02d}".format(PROXY_PREFIXES[shape], owner, number)
+
+        mesh = hull_mesh(name, shape_points(points, shape, budget))
+        if mesh is None:
+            #Flat parts have no convex hull, their box still works
+            mesh = hull_mesh(name, box_points(points))
+        if mesh is None:
+            continue
+
+        proxy = bpy.data.objects.new(name, mesh)
+        collection.objects.link(proxy)
+        proxy.display_type = 'WIRE'
+        proxy[COLLISION_PROXY_KEY] = bone_name
+        parent_to_bone(proxy, armature_object, bone_name)
+
+        proxies.append(proxy.name)
+        vertex_count += len(mesh.vertices)
+        source_vertex_count += len(points)
+
+    return {'proxies': proxies, 'vertices': vertex_count, 'source_vertices': source_vertex_count}
@@ -0,0 +1,228 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Finding wheels, brake calipers and needles by shape and position instead of by name, for imported
+#assets with many loose objects. Object bounds are read once into numpy arrays, neighbours come from a
+#KD-tree over object centers. Results are slot dicts like naming.resolve_slots returns
+
+import re
+
+import numpy as np
+from mathutils import Vector
+from mathutils.kdtree import KDTree
+
+from . naming import DEFAULT_NAMING_RULES, FIXED_WHEEL_SLOTS, OPTIONAL_SLOTS
+
+
+FORWARD_AXES = {
+    '+X': (1, 0, 0),
+    '-X': (-1, 0, 0),
+    '+Y': (0, 1, 0),
+    '-Y': (0, -1, 0),
+}
+
+#A wheel's two largest extents are within this ratio of each other and its width is clearly smaller
+ROUND_RATIO = 0.9
+WIDTH_RATIO = 0.85
+
+
+def object_bounds(objects):
+    #World centers, oriented extents (local bounds times object scale) and world axes of every object
+    local = np.array([obj.bound_box[:] for obj in objects], dtype=np.float64).reshape(-1, 8, 3)
+    matrices = np.array([obj.matrix_world for obj in objects], dtype=np.float64).reshape(-1, 4, 4)
+
+    low = local.min(axis=1)
+    high = local.max(axis=1)
+    rotation_scale = matrices[:, :3, :3]
+    scales = np.linalg.norm(rotation_scale, axis=1)
+
+    centers = np.einsum('nij,nj->ni', rotation_scale, (low + high) / 2) + matrices[:, :3, 3]
+    extents = (high - low) * scales
+    axes = rotation_scale / np.maximum(scales[:, None, :], 1e-12)
+    return centers, extents, axes
+
+
+def vehicle_frame(center, extents, forward):
+    #Vehicle length, width and height along forward, right and up
+    up = np.array((0.0, 0.0, 1.0))
+    right = np.cross(forward, up)
+    return {'center': center, 'forward': forward, 'right': right, 'up': up,
+        'length': abs(extents @ forward), 'width': abs(extents @ right), 'height': extents[2]}
+
+
+def world_bounds(obj):
+    corners = np.array([obj.matrix_world @ Vector(corner) for corner in obj.bound_box])
+    return corners.min(axis=0), corners.max(axis=0)
+
+
+def detect_wheels(base_index, centers, extents, axes, frame, kd_tree):
+    #Round objects of wheel size low in the vehicle, rims and hubs inside a tyre are dropped for the tyre.
+    #Returns (index, radius) per wheel
+    order = np.sort(extents, axis=1)[:, ::-1]
+    diameters = order[:, 0]
+    round_mask = (order[:, 1] >= ROUND_RATIO * order[:, 0]) & (order[:, 2] <= WIDTH_RATIO * order[:, 0])
+
+    #The flat axis of a wheel points sideways
+    flat_axes = axes[np.arange(len(axes)), :, np.argmin(extents, axis=1)]
+    sideways = np.abs(flat_axes @ frame['right']) > 0.7
+
+    offset = centers - frame['center']
+    mask = (round_mask & sideways
+        & (diameters > 0.08 * frame['length']) & (diameters < 0.5 * frame['length'])
+        & (offset @ frame['up'] < 0.1 * frame['height'])
+        & (np.abs(offset @ frame['forward']) < 0.6 * frame['length'])
+        & (np.abs(offset @ frame['right']) < 0.75 * frame['width']))
+    mask[base_index] = False
+
+    wheels = []
+    absorbed = set()
+    for index in sorted(np.flatnonzero(mask), key=lambda i: -diameters[i]):
+        if index in absorbed:
+            continue
+        radius = diameters[index] / 2
+        wheels.append((int(index), radius))
+        #Everything round around the same center is part of this wheel
+        for co, other, distance in kd_tree.find_range(centers[index], 0.5 * radius):
+            if mask[other]:
+                absorbed.add(other)
+    return wheels, absorbed
+
+
+def group_axles(wheels, centers, frame):
+    #Front axle first, wheels on an axle ordered left to right
+    wheels = sorted(wheels, key=lambda wheel: -(centers[wheel[0]] @ frame['forward']))
+    axles = []
+    for wheel in wheels:
+        position = centers[wheel[0]] @ frame['forward']
+        if axles and abs(axles[-1][-1][1] - position) < wheel[1]:
+            axles[-1].append((wheel, position))
+        else:
+            axles.append([(wheel, position)])
+    return [sorted((wheel for wheel, position in axle), key=lambda wheel: centers[wheel[0]] @ frame['right']) for axle in axles]
+
+
+def side_name(center, frame):
+    lateral = (center - frame['center']) @ frame['right']
+    if abs(lateral) < 0.1 * frame['width']:
+        return 'C'
+    return 'R' if lateral > 0 else 'L'
+
+
+def detect_caliper(wheel, candidates, centers, extents, kd_tree, names):
+    #Largest off-axis object inside the wheel that is smaller than it, a name containing "caliper" wins
+    index, radius = wheel
+    found = []
+    for co, other, distance in kd_tree.find_range(centers[index], radius):
+        if other not in candidates or extents[other].max() > 1.6 * radius or distance < 0.2 * radius:
+            continue
+        found.append(other)
+    if not found:
+        return None
+    named = [other for other in found if 'caliper' in names[other].lower()]
+    return max(named or found, key=lambda other: np.prod(extents[other]))
+
+
+def detect_needles(candidates, centers, extents, frame, names):
+    #Small long objects in the upper front half. Names decide when they can, otherwise two needles next to
+    #each other are taken as tachometer (left) and speedometer (right), which is a guess
+    speed_pattern = re.compile(DEFAULT_NAMING_RULES['speedometer_needle'])
+    tach_pattern = re.compile(DEFAULT_NAMING_RULES['tachometer_needle'])
+
+    needles = []
+    for index in candidates:
+        order = np.sort(extents[index])[::-1]
+        offset = centers[index] - frame['center']
+        if (order[0] > 3 * max(order[1], 1e-9) and order[0] < 0.05 * frame['length']
+                and offset @ frame['up'] > 0 and offset @ frame['forward'] > 0
+                and abs(offset @ frame['right']) < 0.5 * frame['width']):
+            needles.append(index)
+
+    speedometer = next((i for i in needles if speed_pattern.search(names[i])), None)
+    tachometer = next((i for i in needles if tach_pattern.search(names[i])), None)
+    guessed = False
+    if speedometer is None and tachometer is None and len(needles) == 2:
+        tachometer, speedometer = sorted(needles, key=lambda i: centers[i] @ frame['right'])
+        guessed = True
+    return speedometer, tachometer, guessed
+
+
+def detect_parts(objects, vehicle_base=None, forward_axis='-Y'):
+    #Returns a slot dict (see naming.resolve_slots) plus 'wheel_names' and 'guessed' (slots filled by a guess)
+    objects = [obj for obj in objects if obj.type in ('MESH', 'CURVE')]
+    slots = {slot: None for slot in ('vehicle_base',) + FIXED_WHEEL_SLOTS + OPTIONAL_SLOTS}
+    slots.update({'multiple_wheels': [], 'wheel_names': [], 'guessed': []})
+    if not objects:
+        return slots
+
+    centers, extents, axes = object_bounds(objects)
+    names = [obj.name for obj in objects]
+
+    if vehicle_base is None or vehicle_base not in objects:
+        #Biggest bounding box is the body
+        vehicle_base = objects[int(np.argmax(np.prod(extents, axis=1)))]
+        slots['guessed'].append('vehicle_base')
+    slots['vehicle_base'] = vehicle_base
+    base_index = objects.index(vehicle_base)
+
+    #Body bounds in world space, since body objects often keep an identity transform
+    low, high = world_bounds(vehicle_base)
+    frame = vehicle_frame((low + high) / 2, high - low, np.array(FORWARD_AXES[forward_axis], dtype=np.float64))
+
+    kd_tree = KDTree(len(objects))
+    for index, center in enumerate(centers):
+        kd_tree.insert(center, index)
+    kd_tree.balance()
+
+    wheels, absorbed = detect_wheels(base_index, centers, extents, axes, frame, kd_tree)
+    wheel_indices = set(index for index, radius in wheels)
+    remaining = set(range(len(objects))) - {base_index} - wheel_indices - absorbed
+
+    axles = group_axles(wheels, centers, frame)
+    if len(axles) == 2 and all(len(axle) == 2 for axle in axles):
+        (front_left, front_right), (rear_left, rear_right) = axles
+        slots['wheel_FL'], slots['wheel_FR'] = objects[front_left[0]], objects[front_right[0]]
+        slots['wheel_RL'], slots['wheel_RR'] = objects[rear_left[0]], objects[rear_right[0]]
+    else:
+        used_names = set()
+        for axle_index, axle in enumerate(axles):
+            for wheel in axle:
+                name = "Wheel_{}_{}".format(axle_index + 1, side_name(centers[wheel[0]], frame))
+                #Twin wheels on one side get numbered
+                unique_name, count = name, 1
+                while unique_name in used_names:
+                    count += 1
+                    unique_name = "{}{}".format(name, count)
+                used_names.add(unique_name)
+                slots['multiple_wheels'].append(objects[wheel[0]])
+                slots['wheel_names'].append(unique_name)
+
+    if axles:
+        front = axles[0]
+        for slot, wheel in (('brake_caliper_FL', front[0]), ('brake_caliper_FR', front[-1])):
+            if len(front) > 1 or side_name(centers[wheel[0]], frame) == slot[-1]:
+                caliper = detect_caliper(wheel, remaining, centers, extents, kd_tree, names)
+                if caliper is not None:
+                    slots[slot] = objects[caliper]
+                    remaining.discard(caliper)
+
+    speedometer, tachometer, guessed = detect_needles(remaining, centers, extents, frame, names)
+    if speedometer is not None:
+        slots['speedometer_needle'] = objects[speedometer]
+    if tachometer is not None:
+        slots['tachometer_needle'] = objects[tachometer]
+    if guessed:
+        slots['guessed'] += ['speedometer_needle', 'tachometer_needle']
+
+    return slots
@@ -0,0 +1,137 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#LOD chain of a rigged vehicle. Every mesh of the rig gets decimated copies that keep their vertex groups,
+#armature modifier and parent, one collection per level so each level exports as its own FBX for UE's LOD
+#import. All copies of a level get their Decimate modifier first and are evaluated in one depsgraph update,
+#which Blender spreads over its threads, then each result is baked into a new mesh
+
+import bpy
+import numpy as np
+
+from . collision import rig_meshes
+from . rig_core import LOD_LEVEL_KEY
+from . transforms import unique_data_objects
+
+
+def triangle_count(mesh):
+    #Triangles UE gets after triangulation, n - 2 per polygon of n corners
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    return int((loop_totals - 2).sum())
+
+
+def evaluated_triangle_count(obj, depsgraph):
+    #Triangles with modifiers applied, Mirror, Subdivision and the like are baked into every LOD level too
+    evaluated = obj.evaluated_get(depsgraph)
+    mesh = evaluated.to_mesh()
+    try:
+        return triangle_count(mesh)
+    finally:
+        evaluated.to_mesh_clear()
+
+
+def parse_levels(text):
+    #"0.5, 0.25, 0.1" to a list of floats
+    return [float(value) for value in text.replace(';', ',').split(',') if value.strip()]
+
+
+def level_ratios(base_triangles, ratios=(), triangle_budgets=()):
+    #Decimate ratio per LOD level, triangle budgets for the whole vehicle win over ratios
+    if triangle_budgets:
+        return [min(budget / max(base_triangles, 1), 1.0) for budget in triangle_budgets]
+    return [min(max(ratio, 0.0), 1.0) for ratio in ratios]
+
+
+def lod_collection(armature_object, level):
+    #Child collection of the rig's collection holding one LOD level
+    parent = armature_object.users_collection[0]
+    name = "{}_LOD{}".format(armature_object.name, level)
+    collection = bpy.data.collections.get(name)
+    if collection is None:
+        collection = bpy.data.collections.new(name)
+    if collection.name not in parent.children:
+        parent.children.link(collection)
+    return collection
+
+
+def remove_lods(armature_object):
+    removed = 0
+    for obj in [obj for obj in armature_object.children if LOD_LEVEL_KEY in obj]:
+        mesh = obj.data
+        bpy.data.objects.remove(obj)
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+        removed += 1
+    return removed
+
+
+def bake_level(context, sources, ratio, level, collection):
+    #Decimated copy of every source, all evaluated in a single depsgraph update. Returns {source data: new mesh}
+    copies = []
+    for obj in sources:
+        copy = obj.copy()
+        collection.objects.link(copy)
+        #Deforming by the armature would bake the current pose into the mesh
+        for modifier in copy.modifiers:
+            if modifier.type == 'ARMATURE':
+                modifier.show_viewport = False
+        decimate = copy.modifiers.new(name="LOD Decimate", type='DECIMATE')
+        decimate.ratio = ratio
+        copies.append((obj, copy))
+
+    depsgraph = context.evaluated_depsgraph_get()
+    depsgraph.update()
+
+    meshes = {}
+    for obj, copy in copies:
+        mesh = bpy.data.meshes.new_from_object(copy.evaluated_get(depsgraph), preserve_all_data_layers=True, depsgraph=depsgraph)
+        mesh.name = "{}_LOD{}".format(obj.data.name, level)
+        meshes[obj.data] = mesh
+        bpy.data.objects.remove(copy)
+    return meshes
+
+
+def build_lods(context, armature_object, ratios=(0.5, 0.25, 0.1), triangle_budgets=()):
+    #LOD0 is the rig itself, levels 1.. are decimated copies named <object>_LOD<n>, parented and skinned like
+    #their source. Earlier LODs of the armature are replaced. Parts sharing mesh data share their LOD meshes too.
+    #Returns {'levels': [{'level', 'ratio', 'triangles', 'objects'}]}
+    remove_lods(armature_object)
+    meshes = rig_meshes(armature_object)
+    #Counted per object, instanced parts are drawn once per object
+    depsgraph = context.evaluated_depsgraph_get()
+    base_triangles = sum(evaluated_triangle_count(obj, depsgraph) for obj in meshes)
+    levels = [{'level': 0, 'ratio': 1.0, 'triangles': base_triangles, 'objects': len(meshes)}]
+
+    sources = unique_data_objects(meshes)
+    for level, ratio in enumerate(level_ratios(base_triangles, ratios, triangle_budgets), 1):
+        collection = lod_collection(armature_object, level)
+        lod_meshes = bake_level(context, sources, ratio, level, collection)
+
+        #Objects are copied after baking, so every user of a data block gets the same LOD mesh
+        for obj in meshes:
+            lod = obj.copy()
+            lod.data = lod_meshes[obj.data]
+            lod.name = "{}_LOD{}".format(obj.name, level)
+            lod[LOD_LEVEL_KEY] = level
+            #Other modifiers are baked into the LOD mesh already
+            for modifier in [modifier for modifier in lod.modifiers if modifier.type != 'ARMATURE']:
+                lod.modifiers.remove(modifier)
+            collection.objects.link(lod)
+
+        levels.append({'level': level, 'ratio': ratio, 'objects': len(meshes),
+            'triangles': sum(triangle_count(lod_meshes[obj.data]) for obj in meshes)})
+
+    return {'levels': levels}
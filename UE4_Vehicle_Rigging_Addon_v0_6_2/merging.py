@@ -0,0 +1,99 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Joining the skinned parts of a rig into one mesh. UE makes a mesh section, and so a draw call, per material of
+#every mesh, so one mesh with duplicate material slots collapsed draws a vehicle in as few calls as possible
+
+import bpy
+import numpy as np
+
+
+def polygon_material_indices(mesh):
+    indices = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get('material_index', indices)
+    return indices
+
+
+def slot_materials(mesh):
+    #Material of every slot, None for empty slots, at least one slot since polygons always have an index
+    return list(mesh.materials) or [None]
+
+
+def mesh_sections(objects):
+    #Sections UE creates for the given meshes: one per distinct material each mesh's polygons use
+    sections = 0
+    for obj in objects:
+        mesh = obj.data
+        materials = slot_materials(mesh)
+        used = np.unique(np.minimum(polygon_material_indices(mesh), len(materials) - 1))
+        sections += len(set(materials[index] for index in used))
+    return sections
+
+
+def merge_material_slots(mesh):
+    #Slots holding the same material become one and unused slots go, polygon indices are remapped in one
+    #foreach_set after the slots are rebuilt, since clearing the slots resets every polygon to index 0.
+    #Returns the number of slots removed
+    materials = slot_materials(mesh)
+    polygon_indices = np.minimum(polygon_material_indices(mesh), len(materials) - 1)
+    used = np.zeros(len(materials), dtype=bool)
+    used[polygon_indices] = True
+
+    kept = []
+    remap = np.zeros(len(materials), dtype=np.int32)
+    for index, material in enumerate(materials):
+        if not used[index]:
+            continue
+        if material not in kept:
+            kept.append(material)
+        remap[index] = kept.index(material)
+
+    removed = len(mesh.materials) - len(kept)
+    if removed <= 0:
+        return 0
+
+    mesh.materials.clear()
+    for material in kept:
+        mesh.materials.append(material)
+    mesh.polygons.foreach_set('material_index', remap[polygon_indices])
+    mesh.update()
+    return removed
+
+
+def join_meshes(context, active, objects):
+    #Same as selecting objects with active last and pressing Ctrl+J. Vertex groups with the same name merge,
+    #so rigid per-bone weights carry over, and only the active object's armature modifier is kept
+    others = [obj for obj in objects if obj != active]
+    if not others:
+        return active
+    with context.temp_override(active_object=active, object=active, selected_objects=[active] + others,
+            selected_editable_objects=[active] + others):
+        bpy.ops.object.join()
+    return active
+
+
+def join_rig_meshes(context, vehicle_base, objects):
+    #Joins the skinned meshes into vehicle_base and collapses its material slots.
+    #Returns {'joined': int, 'sections_before': int, 'sections_after': int, 'removed_slots': int}
+    objects = [obj for obj in objects if obj.type == 'MESH']
+    if vehicle_base not in objects:
+        objects = [vehicle_base] + objects
+    sections_before = mesh_sections(objects)
+
+    join_meshes(context, vehicle_base, objects)
+    removed_slots = merge_material_slots(vehicle_base.data)
+
+    return {'joined': len(objects), 'sections_before': sections_before, 'sections_after': mesh_sections([vehicle_base]),
+        'removed_slots': removed_slots}
@@ -0,0 +1,95 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Rig slots found from object names, used by the batch CLI and the collection rigging pass
+
+import re
+
+
+#Case insensitive regular expressions searched in object names to fill the rig slots
+DEFAULT_NAMING_RULES = {
+    'vehicle_base': r'(?i)^(body|base|chassis|vehicle)',
+    'wheel_FR': r'(?i)^(?!.*caliper)(?=.*wheel).*(?<![a-z0-9])(fr|front[\W_]*right)(?![a-z0-9])',
+    'wheel_FL': r'(?i)^(?!.*caliper)(?=.*wheel).*(?<![a-z0-9])(fl|front[\W_]*left)(?![a-z0-9])',
+    'wheel_RR': r'(?i)^(?!.*caliper)(?=.*wheel).*(?<![a-z0-9])(rr|rear[\W_]*right)(?![a-z0-9])',
+    'wheel_RL': r'(?i)^(?!.*caliper)(?=.*wheel).*(?<![a-z0-9])(rl|rear[\W_]*left)(?![a-z0-9])',
+    'brake_caliper_FR': r'(?i)caliper.*(?<![a-z0-9])(fr|front[\W_]*right)(?![a-z0-9])',
+    'brake_caliper_FL': r'(?i)caliper.*(?<![a-z0-9])(fl|front[\W_]*left)(?![a-z0-9])',
+    'speedometer_needle': r'(?i)(speed.*needle|needle.*speed)',
+    'tachometer_needle': r'(?i)((tach|rpm).*needle|needle.*(tach|rpm))',
+    #Used for N-wheeled vehicles when the four fixed wheel slots can't all be resolved
+    'wheel': r'(?i)^(?!.*caliper).*wheel',
+}
+
+FIXED_WHEEL_SLOTS = ('wheel_FR', 'wheel_FL', 'wheel_RR', 'wheel_RL')
+OPTIONAL_SLOTS = ('brake_caliper_FR', 'brake_caliper_FL', 'speedometer_needle', 'tachometer_needle')
+
+
+def resolve_slots(objects, naming_rules):
+    #Match rig slots against object names, every object fills at most one slot
+    rules = dict(DEFAULT_NAMING_RULES)
+    rules.update(naming_rules or {})
+
+    meshes = sorted((o for o in objects if o.type == 'MESH'), key=lambda o: o.name)
+    used = set()
+    slots = {}
+
+    def first_match(slot):
+        pattern = re.compile(rules[slot])
+        for obj in meshes:
+            if obj.name not in used and pattern.search(obj.name):
+                used.add(obj.name)
+                return obj
+        return None
+
+    for slot in FIXED_WHEEL_SLOTS + OPTIONAL_SLOTS:
+        slots[slot] = first_match(slot)
+
+    #Fall back to N-wheel mode with every remaining wheel-like object
+    slots['multiple_wheels'] = []
+    if any(slots[slot] is None for slot in FIXED_WHEEL_SLOTS):
+        for slot in FIXED_WHEEL_SLOTS:
+            if slots[slot] is not None:
+                used.discard(slots[slot].name)
+                slots[slot] = None
+        wheel = first_match('wheel')
+        while wheel is not None:
+            slots['multiple_wheels'].append(wheel)
+            wheel = first_match('wheel')
+
+    slots['vehicle_base'] = first_match('vehicle_base')
+    if slots['vehicle_base'] is None:
+        #No base by name, take the densest unassigned mesh
+        candidates = [o for o in meshes if o.name not in used]
+        if candidates:
+            slots['vehicle_base'] = max(candidates, key=lambda o: len(o.data.vertices))
+
+    return slots
+
+
+def apply_slots(scene, slots):
+    scene.vehicle_base = slots['vehicle_base']
+    for slot in FIXED_WHEEL_SLOTS + OPTIONAL_SLOTS:
+        setattr(scene, slot, slots[slot])
+
+    scene.multiple_wheels.clear()
+    scene.wheel_list_index = 0
+    scene.dynamic_wheel_count = len(slots['multiple_wheels']) > 0
+    #Bone names default to the wheel object names
+    wheel_names = slots.get('wheel_names') or [wheel.name for wheel in slots['multiple_wheels']]
+    for wheel, wheel_name in zip(slots['multiple_wheels'], wheel_names):
+        item = scene.multiple_wheels.add()
+        item.wheel_name = wheel_name
+        item.wheel_mesh = wheel
@@ -0,0 +1,110 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Rig readiness cached per scene, so polls and panel redraws don't walk every wheel item and unit setting.
+#The cache is dropped by update callbacks of the rig slot properties, a message bus subscription on the
+#unit settings, and depsgraph, undo and file load handlers for deleted objects, undo and new files
+
+import math
+
+import bpy
+from bpy.app.handlers import persistent
+
+
+#scene pointer to {'ready', 'units', 'wheels', 'missing_wheels'}
+_rig_states = {}
+
+#Owner of the message bus subscriptions, cleared with it on unregister
+_msgbus_owner = object()
+
+
+def ue_units_set(scene):
+    unit_length = scene.unit_settings.scale_length
+    return math.isclose(unit_length, 0.01, abs_tol=0.001) and scene.unit_settings.system == 'METRIC'
+
+
+def compute_rig_state(scene):
+    units = ue_units_set(scene)
+    if scene.dynamic_wheel_count:
+        wheels = len(scene.multiple_wheels)
+        missing_wheels = sum(1 for item in scene.multiple_wheels if item.wheel_mesh is None)
+    else:
+        fixed_wheels = (scene.wheel_FR, scene.wheel_FL, scene.wheel_RR, scene.wheel_RL)
+        wheels = len(fixed_wheels)
+        missing_wheels = sum(1 for wheel in fixed_wheels if wheel is None)
+    ready = scene.vehicle_base is not None and missing_wheels == 0 and units
+    return {'ready': ready, 'units': units, 'wheels': wheels, 'missing_wheels': missing_wheels}
+
+
+def rig_state(scene):
+    key = scene.as_pointer()
+    state = _rig_states.get(key)
+    if state is None:
+        state = compute_rig_state(scene)
+        _rig_states[key] = state
+    return state
+
+
+def invalidate_rig_state(*args):
+    #Usable as property update callback, message bus notify and handler
+    _rig_states.clear()
+
+
+def rig_slot_update(self, context):
+    invalidate_rig_state()
+
+
+@persistent
+def depsgraph_changed(scene, depsgraph):
+    #Transforms and edits come in as object updates and keep the cache, deleting or linking objects updates
+    #the scene or a collection
+    if _rig_states and any(isinstance(update.id, (bpy.types.Scene, bpy.types.Collection)) for update in depsgraph.updates):
+        invalidate_rig_state()
+
+
+@persistent
+def invalidate_rig_state_handler(*args):
+    invalidate_rig_state()
+
+
+@persistent
+def file_loaded(*args):
+    #Message bus subscriptions don't survive loading a file, and scene pointers may be reused by the new one
+    invalidate_rig_state()
+    subscribe_unit_settings()
+
+
+def subscribe_unit_settings():
+    for setting in ('scale_length', 'system'):
+        bpy.msgbus.subscribe_rna(key=(bpy.types.UnitSettings, setting), owner=_msgbus_owner, args=(),
+            notify=invalidate_rig_state)
+
+
+def register_handlers():
+    subscribe_unit_settings()
+    bpy.app.handlers.depsgraph_update_post.append(depsgraph_changed)
+    bpy.app.handlers.undo_post.append(invalidate_rig_state_handler)
+    bpy.app.handlers.redo_post.append(invalidate_rig_state_handler)
+    bpy.app.handlers.load_post.append(file_loaded)
+
+
+def unregister_handlers():
+    bpy.msgbus.clear_by_owner(_msgbus_owner)
+    for handlers, handler in ((bpy.app.handlers.depsgraph_update_post, depsgraph_changed),
+            (bpy.app.handlers.undo_post, invalidate_rig_state_handler), (bpy.app.handlers.redo_post, invalidate_rig_state_handler),
+            (bpy.app.handlers.load_post, file_loaded)):
+        if handler in handlers:
+            handlers.remove(handler)
+    invalidate_rig_state()
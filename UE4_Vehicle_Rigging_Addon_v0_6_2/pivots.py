@@ -0,0 +1,101 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Pivot points of selected vertices for bone placement, read in bulk with foreach_get
+
+import numpy as np
+from mathutils import Vector
+
+from . transforms import read_coordinates, world_space
+
+
+#'MEDIAN' is the mean of the selection, 'BOUNDS' its bounding box center,
+#'CYLINDER' the center of a cylinder fitted to it, such as a wheel or a hinge
+PIVOT_MODES = ('MEDIAN', 'BOUNDS', 'CYLINDER')
+
+
+def selected_world_coordinates(objects):
+    #Selected vertices of all given meshes in world space, as an (n, 3) array
+    chunks = []
+    for obj in objects:
+        mesh = obj.data
+        #total_vert_sel stays up to date in edit mode, so meshes without a selection are never synced
+        if mesh.total_vert_sel == 0:
+            continue
+        if obj.mode == 'EDIT':
+            obj.update_from_editmode()
+
+        select = np.empty(len(mesh.vertices), dtype=bool)
+        mesh.vertices.foreach_get('select', select)
+        chunks.append(world_space(read_coordinates(mesh.vertices)[select], obj))
+
+    if not chunks:
+        return np.empty((0, 3))
+    return np.concatenate(chunks)
+
+
+def fit_circle(x, y):
+    #Least squares circle through 2D points, returns center, radius and relative error or None for a line
+    system = np.column_stack([2 * x, 2 * y, np.ones(len(x))])
+    (a, b, c), residuals, rank, singular = np.linalg.lstsq(system, x * x + y * y, rcond=None)
+    radius_squared = c + a * a + b * b
+    if rank < 3 or radius_squared <= 0:
+        return None
+    radius = np.sqrt(radius_squared)
+    error = np.mean((np.hypot(x - a, y - b) - radius) ** 2) / radius_squared
+    return a, b, radius, error
+
+
+def fit_cylinder(co):
+    #The axis is one of the principal directions of the points. Each one is tried with a circle fit in
+    #the plane across it and the roundest wins, so a partial arc of a tyre works as well as a full ring
+    center = co.mean(axis=0)
+    centered = co - center
+    values, vectors = np.linalg.eigh(centered.T @ centered / len(co))
+
+    best = None
+    for index in range(3):
+        axis = vectors[:, index]
+        u = vectors[:, (index + 1) % 3]
+        v = vectors[:, (index + 2) % 3]
+        circle = fit_circle(centered @ u, centered @ v)
+        if circle is not None and (best is None or circle[3] < best[0]):
+            a, b, radius, error = circle
+            best = (error, center + a * u + b * v, axis, float(radius))
+
+    if best is None:
+        #Points on a line, nothing to fit
+        return center, vectors[:, 2], 0.0
+    return best[1], best[2], best[3]
+
+
+def selection_pivot(objects, mode='MEDIAN'):
+    #Returns {'point': Vector, 'count': int, 'axis': Vector or None, 'radius': float or None},
+    #None when no vertex is selected
+    co = selected_world_coordinates(objects)
+    if len(co) == 0:
+        return None
+
+    pivot = {'point': None, 'count': len(co), 'axis': None, 'radius': None}
+    if mode == 'BOUNDS':
+        pivot['point'] = Vector(((co.min(axis=0) + co.max(axis=0)) / 2).tolist())
+    elif mode == 'CYLINDER' and len(co) >= 3:
+        point, axis, radius = fit_cylinder(co)
+        pivot['point'] = Vector(point.tolist())
+        pivot['axis'] = Vector(axis.tolist())
+        pivot['radius'] = radius
+    else:
+        pivot['point'] = Vector(co.mean(axis=0).tolist())
+    return pivot
@@ -0,0 +1,160 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Per stage timing of the rig pipeline. Reports are written as JSON when a report directory is set in the
+#add-on preferences or in VEHICLE_RIG_REPORT_DIR, cProfile runs when enabled there or with VEHICLE_RIG_CPROFILE=1
+
+import cProfile, io, json, os, pstats, sys, time
+from contextlib import contextmanager
+
+import bpy
+
+
+REPORT_DIR_ENV = "VEHICLE_RIG_REPORT_DIR"
+CPROFILE_ENV = "VEHICLE_RIG_CPROFILE"
+
+
+def _windows_memory_counters():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+    return counters
+
+
+def process_memory():
+    #Resident memory of the whole process in bytes, so Blender's own allocations are included
+    if sys.platform == 'win32':
+        return _windows_memory_counters().WorkingSetSize
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        #No current resident size on macOS, fall back to the peak
+        return peak_process_memory()
+
+
+def peak_process_memory():
+    if sys.platform == 'win32':
+        return _windows_memory_counters().PeakWorkingSetSize
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageProfiler:
+    #Collects time, object and vertex counts and memory deltas per named stage. A stage can be entered
+    #many times (once per chunk), only the time inside it counts so modal idle time is left out
+    def __init__(self, operation, use_cprofile=False):
+        self.operation = operation
+        self.stages = {}
+        self.profile = cProfile.Profile() if use_cprofile else None
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = {'name': name, 'time': 0.0, 'calls': 0, 'objects': 0, 'vertices': 0, 'memory_delta': 0}
+        counts = {'objects': 0, 'vertices': 0}
+
+        memory = process_memory()
+        if self.profile is not None:
+            self.profile.enable()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            record['time'] += time.perf_counter() - start
+            if self.profile is not None:
+                self.profile.disable()
+            record['calls'] += 1
+            record['objects'] += counts['objects']
+            record['vertices'] += counts['vertices']
+            record['memory_delta'] += process_memory() - memory
+
+    def report(self):
+        stages = list(self.stages.values())
+        report = {
+            'operation': self.operation,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'blender': bpy.app.version_string,
+            'file': bpy.data.filepath,
+            'wall_time': time.perf_counter() - self.start,
+            'stage_time': sum(stage['time'] for stage in stages),
+            'peak_memory': peak_process_memory(),
+            'stages': stages,
+        }
+        if self.profile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(25)
+            report['cprofile'] = stream.getvalue()
+        return report
+
+    def summary(self, limit=4):
+        stages = sorted(self.stages.values(), key=lambda stage: stage['time'], reverse=True)
+        total = sum(stage['time'] for stage in stages)
+        parts = ["{} {:.2f}s".format(stage['name'], stage['time']) for stage in stages[:limit]]
+        return "{:.2f}s ({})".format(total, ", ".join(parts))
+
+    def write(self, directory):
+        #Writes <operation>_<time>.json and, with cProfile, a .prof file for snakeviz/pstats next to it
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "{}_{}".format(self.operation, time.strftime('%Y%m%d_%H%M%S')))
+        with open(path + '.json', 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        if self.profile is not None:
+            self.profile.dump_stats(path + '.prof')
+        return path + '.json'
+
+
+def profiling_settings():
+    #Report directory and cProfile switch from add-on preferences, environment variables win
+    report_directory = ""
+    use_cprofile = False
+
+    addon = bpy.context.preferences.addons.get(__package__)
+    if addon is not None:
+        report_directory = bpy.path.abspath(addon.preferences.report_directory)
+        use_cprofile = addon.preferences.use_cprofile
+
+    report_directory = os.environ.get(REPORT_DIR_ENV, report_directory)
+    if CPROFILE_ENV in os.environ:
+        use_cprofile = os.environ[CPROFILE_ENV].lower() in ('1', 'true', 'yes', 'on')
+    return report_directory, use_cprofile
+
+
+def create_profiler(operation):
+    report_directory, use_cprofile = profiling_settings()
+    return StageProfiler(operation, use_cprofile)
+
+
+def finish_profiler(profiler):
+    #Writes the report if a report directory is set, returns the operator summary line
+    report_directory, use_cprofile = profiling_settings()
+    summary = profiler.summary()
+    if report_directory:
+        summary += ", report: " + profiler.write(report_directory)
+    return summary
@@ -0,0 +1,571 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Vehicle rigging done through the data API only, so it doesn't depend on selection,
+#the active object or operator context and runs the same in background mode
+
+import json
+
+import bpy
+from mathutils import Vector, Matrix
+
+from . naming import resolve_slots
+from . merging import join_rig_meshes
+from . profiling import StageProfiler
+from . rig_spec import plan_rig, match_template, template_bones
+from . transforms import baked_world_matrix, data_users, recenter_and_bake, unique_data_objects
+from . weights import assign_rigid_weights
+
+
+def group_by_data(object_array):
+    #Objects keyed on their data block, linked objects end up in the same list
+    groups = {}
+    for obj in object_array:
+        groups.setdefault(obj.data, []).append(obj)
+    return groups
+
+def linked_objects(object_array):
+    return set(obj for objects in group_by_data(object_array).values() if len(objects) > 1 for obj in objects)
+
+def check_and_unlink_objects(object_array):
+    #First object keeps the data, every other user gets its own copy
+    for objects in group_by_data(object_array).values():
+        for other_mesh in objects[1:]:
+            other_mesh.data = other_mesh.data.copy()
+
+def clear_old_armature_modifiers(mesh):
+    #Copy of the list, removing while iterating the collection skips the modifier after each removed one
+    for modifier in list(mesh.modifiers):
+        if modifier.type == 'ARMATURE':
+            mesh.modifiers.remove(modifier)
+
+
+def gather_rig_inputs(scene):
+    #Returns vehicle base and (bone name, object) pairs for every filled rig slot, wheels first
+    if scene.dynamic_wheel_count is True:
+        parts = [(wheel_item.wheel_name, wheel_item.wheel_mesh) for wheel_item in scene.multiple_wheels]
+    else:
+        parts = [('RL', scene.wheel_RL), ('RR', scene.wheel_RR), ('FL', scene.wheel_FL), ('FR', scene.wheel_FR)]
+
+    #Brake calipers and dashboard instruments are optional
+    optional_parts = [(bone_name, getattr(scene, slot)) for bone_name, slot in OPTIONAL_PART_BONES]
+    parts += [(bone_name, obj) for bone_name, obj in optional_parts if obj is not None]
+
+    return scene.vehicle_base, parts
+
+
+#Bone names of the optional parts and the scene properties / naming slots holding them
+OPTIONAL_PART_BONES = (
+    ('Brake_Caliper_FR', 'brake_caliper_FR'),
+    ('Brake_Caliper_FL', 'brake_caliper_FL'),
+    ('Speedometer_Needle', 'speedometer_needle'),
+    ('Tachometer_Needle', 'tachometer_needle'),
+)
+
+
+def slot_rig_inputs(slots):
+    #Same as gather_rig_inputs for slots from naming.resolve_slots, N-wheel bones are named after their meshes.
+    #Returns None for the vehicle base when the slots can't make a vehicle
+    if slots['multiple_wheels']:
+        parts = [(wheel.name, wheel) for wheel in slots['multiple_wheels']]
+    else:
+        parts = [('RL', slots['wheel_RL']), ('RR', slots['wheel_RR']), ('FL', slots['wheel_FL']), ('FR', slots['wheel_FR'])]
+        if any(obj is None for bone_name, obj in parts):
+            return None, []
+    parts += [(bone_name, slots[slot]) for bone_name, slot in OPTIONAL_PART_BONES if slots[slot] is not None]
+
+    return slots['vehicle_base'], parts
+
+
+def collection_vehicles(parent_collection, naming_rules=None):
+    #Every child collection of parent_collection is one vehicle, its parts are found by object name.
+    #Returns (collection, vehicle base, parts) for every vehicle and (collection name, reason) for skipped ones
+    vehicles = []
+    skipped = []
+    for collection in parent_collection.children:
+        vehicle_base, parts = slot_rig_inputs(resolve_slots(collection.all_objects, naming_rules))
+        if vehicle_base is None:
+            skipped.append((collection.name, "no vehicle base or wheels found"))
+        else:
+            vehicles.append((collection, vehicle_base, parts))
+    return vehicles, skipped
+
+
+#Custom property on armatures created by the rig, holds the collection they were linked to
+RIG_COLLECTION_KEY = "vehicle_rig_collection"
+
+ARMATURE_CLEANUP_MODES = ('NONE', 'COLLECTION', 'ALL')
+
+
+def remove_orphan_armatures(mode='COLLECTION', collection=None):
+    #Removes armatures no object uses. 'COLLECTION' limits it to armatures rigged into the given
+    #collection, 'ALL' cleans the whole file. Returns names of removed armatures
+    if mode not in ARMATURE_CLEANUP_MODES:
+        raise ValueError("Unknown armature cleanup mode: " + str(mode))
+    if mode == 'NONE':
+        return []
+
+    #Referenced armatures are collected once instead of scanning all objects for every armature
+    referenced = set(obj.data for obj in bpy.data.objects if obj.type == 'ARMATURE')
+
+    removed = []
+    for armature in bpy.data.armatures[:]:
+        if armature in referenced or armature.use_fake_user:
+            continue
+        if mode == 'COLLECTION' and (collection is None or armature.get(RIG_COLLECTION_KEY) != collection.name):
+            continue
+        removed.append(armature.name)
+        bpy.data.armatures.remove(armature)
+
+    return removed
+
+
+def ensure_object_mode(context):
+    #Mesh data edited below would be overwritten when leaving edit mode
+    if context.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+
+def place_bone(bone, wheel_mesh, bone_length, to_armature=Matrix.Identity(4)):
+    #Set bone's position and rotation to match mesh transform, to_armature maps world into armature space
+    mesh_matrix = to_armature @ wheel_mesh.matrix_world
+    bone.head = mesh_matrix.translation
+    # Apply mesh rotation to bone tail direction
+    tail_offset = mesh_matrix.to_3x3() @ Vector((0, bone_length, 0))
+    bone.tail = mesh_matrix.translation + tail_offset
+
+
+def place_root_bone(root_bone, vehicle_base, bone_length, to_armature=Matrix.Identity(4)):
+    #Set its orientation and size
+    root_bone.head = (0,0,0)
+    root_bone.tail = (0,bone_length,0)
+    #Set its location to vehicle base mesh
+    root_bone.matrix = to_armature @ vehicle_base.matrix_world
+
+
+def describe_rig_inputs(vehicle_base, parts, instanced_objects=(), matrices=None):
+    #Plain data planning input for rig_spec.plan_rig, matrices replaces the world matrices of the objects in it
+    object_bones = [('Root', vehicle_base)] + list(parts)
+    matrices = matrices or {}
+    return [{
+        'bone': bone_name,
+        'object': obj.name,
+        'matrix': [list(row) for row in matrices.get(obj, obj.matrix_world)],
+        'mode': 'BONE' if obj in instanced_objects else 'SKIN',
+    } for bone_name, obj in object_bones]
+
+
+def baked_rig_matrices(rig_objects, instanced_objects):
+    #World matrices the rig objects get from unlinking and recenter_and_bake in rig_vehicle_steps, so a rig
+    #planned without changing the scene has the bones rigging builds
+    users = data_users()
+    rig_set = set(rig_objects)
+    matrices = {obj: baked_world_matrix(obj, users[obj.data]) for obj in instanced_objects}
+    for objects in group_by_data([obj for obj in rig_objects if obj not in instanced_objects]).values():
+        #First object keeps the data and its users outside the rig, the others bake their own copy
+        keeper = objects[0]
+        matrices[keeper] = baked_world_matrix(keeper, [user for user in users.get(keeper.data, [keeper]) if user == keeper or user not in rig_set])
+        for obj in objects[1:]:
+            matrices[obj] = baked_world_matrix(obj, [obj])
+    return matrices
+
+
+def plan_vehicle_rig(vehicle_base, parts, bone_length, instanced_objects=()):
+    #Rig spec of the vehicle as rigging would build it, the scene stays untouched
+    rig_objects = [vehicle_base] + [obj for bone_name, obj in parts]
+    matrices = baked_rig_matrices(rig_objects, set(instanced_objects))
+    return plan_rig(describe_rig_inputs(vehicle_base, parts, instanced_objects, matrices), bone_length)
+
+
+def apply_bones(context, armature_object, spec):
+    #The only mode switch of the rig, all bones of the spec are created in one edit mode session.
+    #Returns spec bone name to created bone name, Blender may rename bones on creation
+    context.view_layer.objects.active = armature_object
+    bpy.ops.object.mode_set(mode='EDIT')
+
+    edit_bones = armature_object.data.edit_bones
+    bone_names = {}
+
+    for bone_spec in spec['bones']:
+        bone = edit_bones.get(bone_spec['name'])
+        if bone is None:
+            bone = edit_bones.new(bone_spec['name'])
+        bone.head = bone_spec['head']
+        bone.tail = bone_spec['tail']
+        if bone_spec['matrix'] is not None:
+            bone.matrix = Matrix(bone_spec['matrix'])
+        if bone_spec['parent'] is not None:
+            bone.parent = edit_bones[bone_names[bone_spec['parent']]]
+        bone_names[bone_spec['name']] = bone.name
+
+    bpy.ops.object.mode_set(mode='OBJECT')
+    return bone_names
+
+
+def update_bones(context, armature_object, vehicle_base, changed_parts, removed_bone_names, root_changed, bone_length):
+    #Same single edit mode session as apply_bones, but only touching bones whose inputs changed
+    context.view_layer.objects.active = armature_object
+    bpy.ops.object.mode_set(mode='EDIT')
+
+    edit_bones = armature_object.data.edit_bones
+    root_bone = edit_bones['Root']
+    #The rig may have been moved since it was built, edit bones are in its space
+    to_armature = armature_object.matrix_world.inverted()
+    if root_changed:
+        place_root_bone(root_bone, vehicle_base, bone_length, to_armature)
+
+    for bone_name in removed_bone_names:
+        if bone_name in edit_bones:
+            edit_bones.remove(edit_bones[bone_name])
+
+    bone_names = []
+    for bone_name, obj in changed_parts:
+        bone = edit_bones.get(bone_name)
+        if bone is None:
+            bone = edit_bones.new(bone_name)
+            bone.parent = root_bone
+        place_bone(bone, obj, bone_length, to_armature)
+        bone_names.append(bone.name)
+
+    bpy.ops.object.mode_set(mode='OBJECT')
+    return bone_names
+
+
+def parent_to_armature(obj, armature_object, bone_names):
+    #Same as parent_set(type='ARMATURE_NAME'). The world matrix is kept, parts re-attached to a rig that was
+    #moved since it was built would otherwise jump
+    matrix_world = obj.matrix_world.copy()
+    obj.parent = armature_object
+    obj.parent_type = 'OBJECT'
+    obj.matrix_parent_inverse = armature_object.matrix_world.inverted()
+    #Parent matrix times its inverse leaves the basis as the world matrix
+    obj.matrix_basis = matrix_world
+
+    modifier = obj.modifiers.new(name=armature_object.name, type='ARMATURE')
+    modifier.object = armature_object
+
+    #Curves have no vertex groups
+    if obj.type == 'MESH':
+        for bone_name in bone_names:
+            if obj.vertex_groups.get(bone_name) is None:
+                obj.vertex_groups.new(name=bone_name)
+
+
+def parent_to_bone(obj, armature_object, bone_name):
+    #Vertex groups live on the mesh data, so parts sharing data follow their bone rigidly instead of
+    #being skinned. UE imports them as rigid parts with "Import Meshes In Bone Hierarchy"
+    matrix_world = obj.matrix_world.copy()
+    obj.parent = armature_object
+    obj.parent_type = 'BONE'
+    obj.parent_bone = bone_name
+
+    #Bone parenting is relative to the bone tail in rest pose
+    bone = armature_object.data.bones[bone_name]
+    bone_matrix = armature_object.matrix_world @ bone.matrix_local @ Matrix.Translation((0, bone.length, 0))
+    obj.matrix_parent_inverse = bone_matrix.inverted()
+    obj.matrix_basis = matrix_world
+
+
+#Custom property on rig armature objects holding the inputs of the last rig run
+RIG_FINGERPRINTS_KEY = "vehicle_rig_fingerprints"
+
+#Custom property on generated LOD copies of rig meshes, their LOD level
+LOD_LEVEL_KEY = "vehicle_lod_level"
+
+
+def rig_fingerprint(bone_name, obj, bone_length, keep_instances):
+    #Everything a part's bone, modifier and vertex groups are built from
+    vertex_count = len(obj.data.vertices) if obj.type == 'MESH' else 0
+    matrix = [round(value, 5) for row in obj.matrix_world for value in row]
+    return [bone_name, obj.name, obj.data.name, vertex_count, bone_length, keep_instances] + matrix
+
+
+def store_fingerprints(armature_object, object_bones, bone_length, keep_instances):
+    fingerprints = {bone_name: rig_fingerprint(bone_name, obj, bone_length, keep_instances) for obj, bone_name in object_bones}
+    armature_object[RIG_FINGERPRINTS_KEY] = json.dumps(fingerprints)
+
+
+def find_existing_rig(vehicle_base):
+    #Rig from an earlier run, the vehicle base stays parented to it
+    armature_object = vehicle_base.parent
+    if (armature_object is None or armature_object.type != 'ARMATURE'
+            or RIG_FINGERPRINTS_KEY not in armature_object or 'Root' not in armature_object.data.bones):
+        return None
+    return armature_object
+
+
+def parent_objects(armature_object, object_bones, instanced_objects):
+    #Parent meshes to armature with empty groups
+    all_bone_names = [bone.name for bone in armature_object.data.bones]
+    for obj, bone_name in object_bones:
+        if obj in instanced_objects:
+            parent_to_bone(obj, armature_object, bone_name)
+        else:
+            parent_to_armature(obj, armature_object, all_bone_names)
+
+
+def weight_assignments(object_bones, instanced_objects):
+    return [(obj, bone_name) for obj, bone_name in object_bones if obj.type == 'MESH' and obj not in instanced_objects]
+
+
+def attach_objects(armature_object, object_bones, instanced_objects):
+    parent_objects(armature_object, object_bones, instanced_objects)
+    #Weight the whole vehicle in a single pass
+    assign_rigid_weights(weight_assignments(object_bones, instanced_objects))
+
+
+def run_steps(steps):
+    #Drive a step generator to the end and return its result
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def rig_vehicle(context, vehicle_base, parts, bone_length, collection=None, keep_instances=False, armature_cleanup='COLLECTION',
+        incremental=False, profiler=None, join_meshes=False, template=None):
+    return run_steps(rig_vehicle_steps(context, vehicle_base, parts, bone_length, collection, keep_instances, armature_cleanup,
+        incremental, profiler, join_meshes, template))
+
+
+def rig_vehicle_steps(context, vehicle_base, parts, bone_length, collection=None, keep_instances=False, armature_cleanup='COLLECTION',
+        incremental=False, profiler=None, join_meshes=False, template=None):
+    #parts are (bone name, object) pairs, every part gets a bone parented to Root.
+    #With keep_instances parts sharing mesh data keep sharing it and get parented to their bones.
+    #With incremental an existing rig of this vehicle is updated where its inputs changed instead of rebuilt.
+    #With join_meshes the skinned meshes are joined into the vehicle base after weighting.
+    #With a template rig spec its bones are built as saved instead of planned from the meshes.
+    #Yields (progress, message) between chunks of work so callers can time slice it, returns the rig result.
+    #Stage timings go to profiler, stages are timed between yields only
+    if profiler is None:
+        profiler = StageProfiler('rig_vehicle')
+    ensure_object_mode(context)
+
+    if incremental:
+        armature_object = find_existing_rig(vehicle_base)
+        if armature_object is not None:
+            yield 0.0, "Updating rig"
+            with profiler.stage('update_rig') as counts:
+                result = update_rig(context, armature_object, vehicle_base, parts, bone_length, keep_instances,
+                    collection, armature_cleanup)
+                counts['objects'] = len(result['updated_bones'])
+            result['stages'] = list(profiler.stages.values())
+            return result
+
+    part_objects = [obj for bone_name, obj in parts]
+    rig_objects = [vehicle_base] + part_objects
+
+    instanced_objects = linked_objects(part_objects) if keep_instances else set()
+
+    yield 0.0, "Unlinking shared meshes"
+
+    with profiler.stage('unlink_shared_data') as counts:
+        #checking for linked meshes and unlinking them
+        unlink_objects = [obj for obj in rig_objects if obj not in instanced_objects]
+        check_and_unlink_objects(unlink_objects)
+        counts['objects'] = len(unlink_objects)
+
+    with profiler.stage('clear_modifiers') as counts:
+        #remove old armature modifiers from meshes
+        for obj in rig_objects:
+            clear_old_armature_modifiers(obj)
+        counts['objects'] = len(rig_objects)
+
+    if collection is None:
+        collection = context.collection
+
+    with profiler.stage('remove_orphan_armatures') as counts:
+        removed_armatures = remove_orphan_armatures(armature_cleanup, collection)
+        counts['objects'] = len(removed_armatures)
+
+    #Set all object origins to geometry center and apply object rotation and scale in one pass,
+    #one data block per chunk
+    users = data_users()
+    bake_objects = unique_data_objects(rig_objects)
+    for index, obj in enumerate(bake_objects):
+        yield 0.05 + 0.55 * index / len(bake_objects), "Applying transform of " + obj.name
+        with profiler.stage('recenter_and_bake') as counts:
+            counts['vertices'] = recenter_and_bake([obj], users=users)
+            counts['objects'] = len(users.get(obj.data, ()))
+
+    yield 0.6, "Building bones"
+
+    with profiler.stage('build_bones') as counts:
+        #Create armature object
+        armature = bpy.data.armatures.new('Armature')
+        armature_object = bpy.data.objects.new('Armature', armature)
+
+        #Link armature object to our scene
+        collection.objects.link(armature_object)
+        armature[RIG_COLLECTION_KEY] = collection.name
+
+        #Set bones In front and show axis
+        armature_object.show_in_front = True
+        armature.show_axes = True
+
+        #Plan on plain data, then build the whole spec at once
+        if template is None:
+            spec = plan_rig(describe_rig_inputs(vehicle_base, parts, instanced_objects), bone_length)
+        else:
+            spec = dict(template, bones=template_bones(template, [bone_name for bone_name, obj in parts]))
+        spec_bone_names = apply_bones(context, armature_object, spec)
+        bone_names = [spec_bone_names[bone_name] for bone_name, obj in parts]
+        counts['objects'] = len(spec['bones'])
+
+    with profiler.stage('parent_objects') as counts:
+        object_bones = [(vehicle_base, 'Root')] + list(zip(part_objects, bone_names))
+        parent_objects(armature_object, object_bones, instanced_objects)
+        counts['objects'] = len(object_bones)
+
+    assignments = weight_assignments(object_bones, instanced_objects)
+    for index, assignment in enumerate(assignments):
+        yield 0.7 + 0.3 * index / len(assignments), "Weighting " + assignment[0].name
+        with profiler.stage('assign_weights') as counts:
+            counts['vertices'] = assign_rigid_weights([assignment])
+            counts['objects'] = 1
+
+    sections = None
+    if join_meshes and vehicle_base.type == 'MESH':
+        yield 0.95, "Joining meshes"
+        with profiler.stage('join_meshes') as counts:
+            sections = join_rig_meshes(context, vehicle_base, [obj for obj, bone_name in assignments])
+            counts['objects'] = sections['joined']
+            counts['vertices'] = len(vehicle_base.data.vertices)
+    else:
+        #Joined parts are gone, so there is nothing an incremental re-rig could update
+        store_fingerprints(armature_object, object_bones, bone_length, keep_instances)
+
+    return {'armature': armature_object, 'bone_names': bone_names, 'removed_armatures': removed_armatures,
+        'updated_bones': ['Root'] + bone_names, 'spec': spec, 'sections': sections, 'stages': list(profiler.stages.values())}
+
+
+def rig_vehicles_steps(context, vehicles, bone_length, keep_instances=False, armature_cleanup='COLLECTION', profiler=None,
+        join_meshes=False):
+    #Rigs (collection, vehicle base, parts) vehicles one after another in a single pass, every vehicle gets its
+    #own armature in its collection. A failing vehicle doesn't stop the others.
+    #Returns one {'collection', 'success', 'error', 'armature', 'bone_names', 'sections'} dict per vehicle
+    if profiler is None:
+        profiler = StageProfiler('rig_vehicles')
+    results = []
+
+    for index, (collection, vehicle_base, parts) in enumerate(vehicles):
+        result = {'collection': collection.name, 'success': False, 'error': None, 'armature': None, 'bone_names': [],
+            'sections': None}
+        steps = rig_vehicle_steps(context, vehicle_base, parts, bone_length, collection, keep_instances, armature_cleanup,
+            profiler=profiler, join_meshes=join_meshes)
+        try:
+            while True:
+                try:
+                    progress, message = next(steps)
+                except StopIteration as stop:
+                    rig = stop.value
+                    break
+                yield (index + progress) / len(vehicles), collection.name + ": " + message
+            result['success'] = True
+            result['armature'] = rig['armature']
+            result['bone_names'] = ['Root'] + rig['bone_names']
+            result['sections'] = rig['sections']
+        except Exception as error:
+            result['error'] = "{}: {}".format(type(error).__name__, error)
+            #A vehicle failing in the middle of the bone session would leave the armature in edit mode
+            ensure_object_mode(context)
+        results.append(result)
+
+    return results
+
+
+def update_rig(context, armature_object, vehicle_base, parts, bone_length, keep_instances, collection=None,
+        armature_cleanup='COLLECTION'):
+    #Diff the parts against the fingerprints stored by the last run and redo only what changed.
+    #The rig is linked to collection too when it isn't in it yet, and armature cleanup runs like on a full rig
+    stored = json.loads(armature_object[RIG_FINGERPRINTS_KEY])
+
+    if collection is None:
+        collection = context.collection
+    if collection.objects.get(armature_object.name) is None:
+        collection.objects.link(armature_object)
+    armature_object.data[RIG_COLLECTION_KEY] = collection.name
+    removed_armatures = remove_orphan_armatures(armature_cleanup, collection)
+
+    object_bones = [(vehicle_base, 'Root')] + [(obj, bone_name) for bone_name, obj in parts]
+    changed = [(obj, bone_name) for obj, bone_name in object_bones
+        if stored.get(bone_name) != rig_fingerprint(bone_name, obj, bone_length, keep_instances)]
+    current_bone_names = set(bone_name for obj, bone_name in object_bones)
+    removed_bone_names = [bone_name for bone_name in stored if bone_name not in current_bone_names]
+
+    part_objects = [obj for bone_name, obj in parts]
+    bone_names = [bone_name for bone_name, obj in parts]
+    result = {'armature': armature_object, 'bone_names': bone_names, 'removed_armatures': removed_armatures, 'updated_bones': [],
+        'spec': None, 'sections': None}
+    if not changed and not removed_bone_names:
+        return result
+
+    changed_objects = [obj for obj, bone_name in changed]
+    instanced_objects = linked_objects(part_objects) if keep_instances else set()
+
+    #Unchanged objects come first so they keep their data when linked to a changed one
+    changed_set = set(changed_objects)
+    unchanged_objects = [obj for obj, bone_name in object_bones if obj not in changed_set]
+    check_and_unlink_objects([obj for obj in unchanged_objects + changed_objects if obj not in instanced_objects])
+
+    for obj in changed_objects:
+        clear_old_armature_modifiers(obj)
+
+    recenter_and_bake(changed_objects)
+
+    root_changed = any(bone_name == 'Root' for obj, bone_name in changed)
+    changed_parts = [(bone_name, obj) for obj, bone_name in changed if bone_name != 'Root']
+    updated_names = update_bones(context, armature_object, vehicle_base, changed_parts, removed_bone_names, root_changed, bone_length)
+
+    #Groups of removed bones would keep deforming nothing, and be exported as empty influences
+    for obj in [obj for obj, bone_name in object_bones if obj.type == 'MESH']:
+        for removed_name in removed_bone_names:
+            group = obj.vertex_groups.get(removed_name)
+            if group is not None:
+                obj.vertex_groups.remove(group)
+
+    #Bones can get renamed on creation
+    renamed = dict(zip([bone_name for bone_name, obj in changed_parts], updated_names))
+    bone_names = [renamed.get(bone_name, bone_name) for bone_name in bone_names]
+
+    changed_object_bones = [(obj, renamed.get(bone_name, bone_name)) for obj, bone_name in changed]
+    attach_objects(armature_object, changed_object_bones, instanced_objects)
+    store_fingerprints(armature_object, [(vehicle_base, 'Root')] + list(zip(part_objects, bone_names)), bone_length, keep_instances)
+
+    result['bone_names'] = bone_names
+    result['updated_bones'] = [bone_name for obj, bone_name in changed_object_bones] + removed_bone_names
+    return result
+
+
+def resolve_template(spec, objects):
+    #Find the vehicle base and parts of a rig template among objects by name pattern.
+    #Returns vehicle base, (bone name, object) parts, keep_instances and mesh entries that matched nothing
+    objects_by_name = {obj.name: obj for obj in objects if obj.type in ('MESH', 'CURVE')}
+    matches = match_template(spec, objects_by_name)
+
+    vehicle_base = None
+    parts = []
+    missing = []
+    for mesh, name in zip(spec['meshes'], matches):
+        if name is None:
+            missing.append(mesh['object'])
+        elif mesh['bone'] == 'Root':
+            vehicle_base = objects_by_name[name]
+        else:
+            parts.append((mesh['bone'], objects_by_name[name]))
+
+    keep_instances = any(mesh['mode'] == 'BONE' for mesh in spec['meshes'])
+    return vehicle_base, parts, keep_instances, missing
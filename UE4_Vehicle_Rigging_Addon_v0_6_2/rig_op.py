@@ -13,277 +13,320 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import bpy, math
-from mathutils import Vector, Matrix
+import bpy, math, time
+from bpy_extras.io_utils import ExportHelper, ImportHelper
+
+from . rig_core import gather_rig_inputs, rig_vehicle, rig_vehicle_steps, run_steps, ensure_object_mode
+from . rig_core import plan_vehicle_rig, linked_objects, resolve_template, collection_vehicles, rig_vehicles_steps
+from . rig_core import parent_to_armature
+from . collision import bone_shapes, build_collision_proxies
+from . bone_queue import selected_vertex_indices, encode_indices, decode_indices, missing_parents, commit_bones
+from . detection import detect_parts
+from . naming import apply_slots
+from . panel_state import invalidate_rig_state, rig_state
+from . pivots import selection_pivot
+from . profiling import create_profiler, finish_profiler
+from . rig_spec import save_rig_spec, load_rig_spec
+from . scaling import upscale_steps
+from . skinning import skin_loose_parts
+from . lods import build_lods, parse_levels
+from . test_drive import bake_test_drive
+from . weight_cache import save_weight_cache, load_weight_cache, remap_weights
+from . weights import compact_weights
+
+
+def report_profile(operator, profiler):
+    #Stage summary in the info log, JSON report when a report directory is set
+    try:
+        operator.report({'INFO'}, operator.bl_label + " " + finish_profiler(profiler))
+    except OSError as error:
+        operator.report({'WARNING'}, "Can't write timing report: " + str(error))
+
+
+def report_sections(operator, sections):
+    #Mesh sections are what UE draws per material, so they are the draw calls of the vehicle
+    if sections is not None:
+        operator.report({'INFO'}, "Joined {} meshes: {} mesh sections (draw calls) before, {} after".format(
+            sections['joined'], sections['sections_before'], sections['sections_after']))
+
+
+def report_collision(operator, collision):
+    operator.report({'INFO'}, "{} collision proxies with {} vertices built from {} vertices".format(
+        len(collision['proxies']), collision['vertices'], collision['source_vertices']))
+
+
+def finish_in_pose_mode(context, armature_object):
+    #Deselect all objects
+    for obj in context.selected_objects:
+        obj.select_set(state=False)
+    #Set pose mode
+    context.view_layer.objects.active = armature_object
+    bpy.ops.object.mode_set(mode='POSE')
+
+
+class Chunked_Modal_Operator:
+    #Mixin for operators whose work is a steps(context) generator yielding (progress, message).
+    #From the UI it runs in time slices with a progress bar and Esc cancels and rolls back,
+    #execute() runs all steps at once for scripts and background mode. finished(context, result) wraps up
+    time_slice = 0.05
 
-
-def check_and_unlink_objects(object_array):
-    for index, mesh in enumerate(object_array):
-        for other_mesh in object_array[index+1:]:
-            if mesh.data == other_mesh.data:
-                other_mesh.data = mesh.data.copy()
-
-def clear_old_armature_modifiers(mesh):
-        for modifier in mesh.modifiers:
-            if modifier.type == 'ARMATURE':
-                mesh.modifiers.remove(modifier)
-
-class Rig_OT_Operator(bpy.types.Operator):
+    def execute(self, context):
+        return self.finished(context, run_steps(self.steps(context)))
+
+    def invoke(self, context, event):
+        #Undo step to roll back to when cancelled
+        bpy.ops.ed.undo_push(message="Before " + self.bl_label)
+
+        self._steps = self.steps(context)
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.001, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.cancel(context)
+            self.rollback(context)
+            self.report({'WARNING'}, self.bl_label + " cancelled")
+            return {'CANCELLED'}
+
+        #Keep viewport navigation working while the steps run
+        if event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
+            return {'PASS_THROUGH'}
+        if event.type != 'TIMER':
+            return {'RUNNING_MODAL'}
+
+        deadline = time.perf_counter() + self.time_slice
+        try:
+            progress, message = next(self._steps)
+            while time.perf_counter() < deadline:
+                progress, message = next(self._steps)
+        except StopIteration as stop:
+            self.cancel(context)
+            return self.finished(context, stop.value)
+        except Exception as error:
+            self.cancel(context)
+            self.rollback(context)
+            self.report({'ERROR'}, "{} failed: {}".format(self.bl_label, error))
+            return {'CANCELLED'}
+
+        context.window_manager.progress_update(int(progress * 100))
+        context.workspace.status_text_set("{}: {} ({:.0%}), Esc to cancel".format(self.bl_label, message, progress))
+        return {'RUNNING_MODAL'}
+
+    def cancel(self, context):
+        #Also called by Blender when the modal operator gets stopped from outside
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        self._steps.close()
+
+    def rollback(self, context):
+        #Undo from inside a running modal operator can crash or land on the wrong step, so it runs from a timer
+        #once this operator has returned. Cancelled operators push no undo step of their own, so storing the
+        #partial result as a step and undoing it goes back to the step pushed in invoke
+        window = context.window
+        message = self.bl_label + " cancelled"
+
+        def undo_partial_result():
+            if window in bpy.context.window_manager.windows[:]:
+                with bpy.context.temp_override(window=window):
+                    bpy.ops.ed.undo_push(message=message)
+                    bpy.ops.ed.undo()
+            return None
+
+        bpy.app.timers.register(undo_partial_result, first_interval=0.0)
+
+
+class Rig_OT_Operator(Chunked_Modal_Operator, bpy.types.Operator):
     bl_idname = "view3d.rig_vehicle"
     bl_label = "Rig Vehicle"
     bl_description = "Rigs Vehicle for UE4"
     bl_options = {'REGISTER', 'UNDO'}
 
-    def set_vertex_group(self, mesh, vertex_group):
-        #Make a new list for all vertice indexes
-        index_list = [0]*len(mesh.data.vertices)
-        #Populate index list with vertice indexes
-        mesh.data.vertices.foreach_get('index', index_list)   
-        #Set mesh vertex group
-        mesh.vertex_groups[vertex_group].add(index_list, 1, 'REPLACE')
-        #Make all vertex group array
-        all_vertex_groups = mesh.vertex_groups.keys()
-        #Remove group which will not be removed
-        all_vertex_groups.remove(vertex_group)
-        #Remove unneeded vertex groups
-        for group in all_vertex_groups:
-            mesh.vertex_groups[group].add(index_list, 1, 'SUBTRACT')
+    @classmethod
+    def poll(cls, context):
+        #Cached, polls run on every redraw and the wheel list can be long
+        return rig_state(context.scene)['ready']
 
-    
-    def add_child_bone(self, bone_name, parent_bone, wheel_mesh, armature_data, bone_length):
-        #Check if bone already exists
-        if bone_name in armature_data.data.edit_bones:
-            return armature_data.data.edit_bones[bone_name]
-            
-        #Create a new bone
-        new_bone = armature_data.data.edit_bones.new(bone_name)
-        #Set bone's parent
-        new_bone.parent = parent_bone
-        #Set bone's position and rotation to match mesh transform
-        mesh_matrix = wheel_mesh.matrix_world
-        new_bone.head = mesh_matrix.translation
-        # Apply mesh rotation to bone tail direction
-        tail_offset = mesh_matrix.to_3x3() @ Vector((0, bone_length, 0))
-        new_bone.tail = mesh_matrix.translation + tail_offset
-        return new_bone
+    def steps(self, context):
+        scene = context.scene
+
+        vehicle_base, parts = gather_rig_inputs(scene)
+        self.profiler = create_profiler('rig_vehicle')
+
+        return rig_vehicle_steps(context, vehicle_base, parts, scene.bone_length, keep_instances=scene.keep_mesh_instances,
+            armature_cleanup=scene.armature_cleanup, incremental=scene.incremental_rig, profiler=self.profiler,
+            join_meshes=scene.join_rig_meshes)
+
+    def finished(self, context, result):
+        scene = context.scene
+        armature_object = result['armature']
+
+        #Bones can get renamed on creation, keep wheel names in sync with them
+        if scene.dynamic_wheel_count is True:
+            for wheel_item, bone_name in zip(scene.multiple_wheels, result['bone_names']):
+                wheel_item.wheel_name = bone_name
+
+        if scene.incremental_rig:
+            self.report({'INFO'}, "Updated bones: " + (", ".join(result['updated_bones']) or "none"))
+
+        if result['removed_armatures']:
+            self.report({'INFO'}, "Removed unused armatures: " + ", ".join(result['removed_armatures']))
+
+        report_sections(self, result['sections'])
+
+        if scene.rig_collision_proxies:
+            with self.profiler.stage('collision_proxies') as counts:
+                collision = build_collision_proxies(armature_object, bone_shapes(armature_object, scene.collision_shape),
+                    scene.collision_vertex_budget)
+                counts['objects'] = len(collision['proxies'])
+                counts['vertices'] = collision['source_vertices']
+            report_collision(self, collision)
+
+        report_profile(self, self.profiler)
+
+        finish_in_pose_mode(context, armature_object)
+
+        return {'FINISHED'}
+
+
+class Rig_Vehicle_Collections_OT_Operator(Chunked_Modal_Operator, bpy.types.Operator):
+    bl_idname = "view3d.rig_vehicle_collections"
+    bl_label = "Rig Vehicle Collections"
+    bl_description = "Rig every child collection of the Vehicles collection as its own vehicle, parts are found by object name"
+    bl_options = {'REGISTER', 'UNDO'}
 
     @classmethod
     def poll(cls, context):
-        unit_length = bpy.context.scene.unit_settings.scale_length
-        unit_system = bpy.context.scene.unit_settings.system
-        return (((context.scene.vehicle_base is not None 
-            and context.scene.wheel_FR is not None 
-            and context.scene.wheel_FL is not None 
-            and context.scene.wheel_RR is not None 
-            and context.scene.wheel_RL is not None 
-            and context.scene.dynamic_wheel_count is False) or (
-            context.scene.vehicle_base is not None 
-            and context.scene.dynamic_wheel_count is True and 
-            all(item.wheel_mesh is not None for item in context.scene.multiple_wheels))) 
-            and math.isclose(unit_length, 0.01, abs_tol=0.001)
-            and unit_system == 'METRIC')
+        return context.scene.vehicles_collection is not None and rig_state(context.scene)['units']
+
+    def steps(self, context):
+        scene = context.scene
+
+        vehicles, self.skipped = collection_vehicles(scene.vehicles_collection)
+        self.profiler = create_profiler('rig_vehicles')
+
+        return rig_vehicles_steps(context, vehicles, scene.bone_length, keep_instances=scene.keep_mesh_instances,
+            armature_cleanup=scene.armature_cleanup, profiler=self.profiler, join_meshes=scene.join_rig_meshes)
+
+    def finished(self, context, results):
+        for name, reason in self.skipped:
+            self.report({'WARNING'}, "Skipped {}: {}".format(name, reason))
+        for result in results:
+            if result['success']:
+                self.report({'INFO'}, "{}: {} bones".format(result['collection'], len(result['bone_names'])))
+                report_sections(self, result['sections'])
+            else:
+                self.report({'WARNING'}, "{} failed: {}".format(result['collection'], result['error']))
+
+        rigged = sum(1 for result in results if result['success'])
+        self.report({'INFO'}, "Rigged {} of {} vehicles".format(rigged, len(results) + len(self.skipped)))
+        report_profile(self, self.profiler)
+
+        return {'FINISHED'}
+
+
+class Auto_Detect_Parts_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.auto_detect_parts"
+    bl_label = "Auto Detect Parts"
+    bl_description = "Find wheels, brake calipers and needles by shape and position around the vehicle base and fill the rig slots"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    forward_axis: bpy.props.EnumProperty(name = "Forward", default = '-Y', description = "Direction the vehicle faces",
+        items = [('-Y', "-Y", "Facing Blender's front view"), ('+Y', "+Y", ""), ('+X', "+X", "Facing UE forward"), ('-X', "-X", "")])
 
     def execute(self, context):
         scene = context.scene
+        start = time.perf_counter()
 
-        C = bpy.context 
-        D = bpy.data
-        O = bpy.ops
-
-        #Set variables for vehicle base and wheel meshes
-        vehicle_base = scene.vehicle_base
-        wheel_RL = scene.wheel_RL
-        wheel_RR = scene.wheel_RR
-        wheel_FL = scene.wheel_FL
-        wheel_FR = scene.wheel_FR
-        
-        #Set variables for brake calipers and dashboard instruments
-        brake_caliper_FR = scene.brake_caliper_FR
-        brake_caliper_FL = scene.brake_caliper_FL
-        speedometer_needle = scene.speedometer_needle
-        tachometer_needle = scene.tachometer_needle
-
-        #Set vehicle base as active
-        C.view_layer.objects.active = vehicle_base
-
-        #Select all vehicle meshes
-        vehicle_base.select_set(state=True)
-        
-        if scene.dynamic_wheel_count is True:
-            for wheel_item in scene.multiple_wheels:
-                wheel_item.wheel_mesh.select_set(state=True)
-        else:
-            wheel_RL.select_set(state=True)
-            wheel_RR.select_set(state=True)
-            wheel_FL.select_set(state=True)
-            wheel_FR.select_set(state=True)
-
-        #Select brake calipers if they exist
-        if brake_caliper_FR is not None:
-            brake_caliper_FR.select_set(state=True)
-        if brake_caliper_FL is not None:
-            brake_caliper_FL.select_set(state=True)
-            
-        #Select dashboard instruments if they exist
-        if speedometer_needle is not None:
-            speedometer_needle.select_set(state=True)
-        if tachometer_needle is not None:
-            tachometer_needle.select_set(state=True)
-
-        #Set object mode
-        O.object.mode_set(mode='OBJECT', toggle=True)
-
-        #Set all object origins to geometry center
-        O.object.origin_set(type='ORIGIN_GEOMETRY', center = 'BOUNDS')
-
-        #making wheel mesh array
-        wheel_mesh_array = []
+        objects = [obj for obj in context.view_layer.objects if obj.visible_get()]
+        slots = detect_parts(objects, scene.vehicle_base, self.forward_axis)
+        if slots['vehicle_base'] is None:
+            self.report({'WARNING'}, "No meshes to detect parts in")
+            return {'CANCELLED'}
 
-        if scene.dynamic_wheel_count is True:
-            wheel_mesh_array = [wheel_item.wheel_mesh for wheel_item in scene.multiple_wheels]
-        else:
-            wheel_mesh_array = [wheel_RL, wheel_FL, wheel_RR, wheel_FR]
-
-        #making additional mesh array for brake calipers and instruments
-        additional_mesh_array = []
-        if speedometer_needle is not None:
-            additional_mesh_array.append(speedometer_needle)
-        if tachometer_needle is not None:
-            additional_mesh_array.append(tachometer_needle)
-
-        #checking for linked meshes and unlinking them
-        check_and_unlink_objects(wheel_mesh_array + additional_mesh_array)
-        
-        #remove old armature modifiers from meshes
-        clear_old_armature_modifiers(vehicle_base)
-        for wheel in wheel_mesh_array:
-            clear_old_armature_modifiers(wheel)
-        for mesh in additional_mesh_array:
-            clear_old_armature_modifiers(mesh)
-
-        #get all armature type objects
-        armature_objects = list(filter(lambda o: o.type == 'ARMATURE', D.objects))
-
-        #remove armature if there's no armature object linked to it
-        for armature in D.armatures[:]:
-            if not any(x.data == armature for x in armature_objects):
-                D.armatures.remove(armature)
-
-        #Apply object transform
-        O.object.transform_apply(location = False, rotation = True, scale = True)
-
-        #Create armature object
-        armature = D.armatures.new('Armature')
-        armature_object = D.objects.new('Armature', armature)
-
-        #Link armature object to our scene
-        C.collection.objects.link(armature_object)
-
-        #Make armature variable
-        armature_data = D.objects[armature_object.name]
-
-        #Set armature active
-        C.view_layer.objects.active = armature_data
-
-        #Set armature selceted
-        armature_data.select_set(state=True)
-
-        #Set edit mode
-        O.object.mode_set(mode='EDIT', toggle=False)
-
-        #Set bones In front and show axis
-        armature_data.show_in_front = True
-        armature_data.data.show_axes = True
-
-        #Add root bone
-        root_bone = armature_data.data.edit_bones.new('Root')
-        #Set its orientation and size
-        root_bone.head = (0,0,0)
-        root_bone.tail = (0,scene.bone_length,0)
-        #Set its location to vehicle base mesh
-        root_bone.matrix = vehicle_base.matrix_world
-
-        #Add wheel bones to armature
-        if scene.dynamic_wheel_count is True:
-            for wheel_item in scene.multiple_wheels:
-                wheel_item.wheel_name = self.add_child_bone(wheel_item.wheel_name, root_bone, wheel_item.wheel_mesh, armature_data, scene.bone_length).name
-        else:
-            wheel_RL_bone = self.add_child_bone('RL', root_bone, wheel_RL, armature_data, scene.bone_length)
-            wheel_RR_bone = self.add_child_bone('RR', root_bone, wheel_RR, armature_data, scene.bone_length)
-            wheel_FL_bone = self.add_child_bone('FL', root_bone, wheel_FL, armature_data, scene.bone_length)
-            wheel_FR_bone = self.add_child_bone('FR', root_bone, wheel_FR, armature_data, scene.bone_length)
-                
-        #Add brake caliper bones as children of root bone (not wheels)
-        if brake_caliper_FR is not None:
-            self.add_child_bone('Brake_Caliper_FR', root_bone, brake_caliper_FR, armature_data, scene.bone_length)
-        if brake_caliper_FL is not None:
-            self.add_child_bone('Brake_Caliper_FL', root_bone, brake_caliper_FL, armature_data, scene.bone_length)
-                
-        #Add dashboard instrument bones as children of root bone
-        if speedometer_needle is not None:
-            self.add_child_bone('Speedometer_Needle', root_bone, speedometer_needle, armature_data, scene.bone_length)
-        if tachometer_needle is not None:
-            self.add_child_bone('Tachometer_Needle', root_bone, tachometer_needle, armature_data, scene.bone_length)
-
-        #Set object mode
-        O.object.mode_set(mode='OBJECT', toggle=True)
-
-        #Select vehicle meshes
-        vehicle_base.select_set(state=True)
+        apply_slots(scene, slots)
 
-        if scene.dynamic_wheel_count is True:
-            for wheel_item in scene.multiple_wheels:
-                wheel_item.wheel_mesh.select_set(state=True)
-        else:
-            wheel_RL.select_set(state=True)
-            wheel_RR.select_set(state=True)
-            wheel_FL.select_set(state=True)
-            wheel_FR.select_set(state=True)
-
-        #Select additional meshes for parenting
-        for mesh in additional_mesh_array:
-            mesh.select_set(state=True)
-            
-        #Select brake caliper meshes for parenting  
-        if brake_caliper_FR is not None:
-            brake_caliper_FR.select_set(state=True)
-        if brake_caliper_FL is not None:
-            brake_caliper_FL.select_set(state=True)
-
-        #Set armature active
-        C.view_layer.objects.active = armature_data
-
-        #Parent meshes to armature with empty groups
-        O.object.parent_set(type='ARMATURE_NAME')
-
-        #Set mesh vertex groups/weightpaint mesh
-        self.set_vertex_group(vehicle_base, 'Root')
+        wheel_count = len(slots['multiple_wheels']) or sum(1 for slot in ('wheel_FR', 'wheel_FL', 'wheel_RR', 'wheel_RL') if slots[slot])
+        found = [slot for slot in ('brake_caliper_FR', 'brake_caliper_FL', 'speedometer_needle', 'tachometer_needle') if slots[slot]]
+        self.report({'INFO'}, "Found {} wheels{} in {:.0f} ms".format(wheel_count, "".join(", " + slot for slot in found),
+            (time.perf_counter() - start) * 1000))
+        if slots['guessed']:
+            self.report({'WARNING'}, "Guessed, please check: " + ", ".join(slots['guessed']))
 
-        if scene.dynamic_wheel_count is True:
-            for wheel_item in scene.multiple_wheels:
-                self.set_vertex_group(wheel_item.wheel_mesh, wheel_item.wheel_name)
-        else:
-            self.set_vertex_group(wheel_RL, 'RL')
-            self.set_vertex_group(wheel_RR, 'RR')
-            self.set_vertex_group(wheel_FL, 'FL')
-            self.set_vertex_group(wheel_FR, 'FR')
-                
-        #Set vertex groups for brake calipers (always, regardless of wheel mode)
-        if brake_caliper_FR is not None:
-            self.set_vertex_group(brake_caliper_FR, 'Brake_Caliper_FR')
-        if brake_caliper_FL is not None:
-            self.set_vertex_group(brake_caliper_FL, 'Brake_Caliper_FL')
-            
-        #Set vertex groups for dashboard instruments
-        if speedometer_needle is not None:
-            self.set_vertex_group(speedometer_needle, 'Speedometer_Needle')
-        if tachometer_needle is not None:
-            self.set_vertex_group(tachometer_needle, 'Tachometer_Needle')
-
-        #Deselect all objects
-        O.object.select_all(action='DESELECT')
-        #Set pose mode
-        O.object.mode_set(mode='POSE', toggle=True)
+        return {'FINISHED'}
+
+
+class Save_Rig_Template_OT_Operator(bpy.types.Operator, ExportHelper):
+    bl_idname = "view3d.save_rig_template"
+    bl_label = "Save Rig Template"
+    bl_description = "Save bone layout and mesh name patterns of this vehicle as a JSON rig template"
+
+    filename_ext = ".json"
+    filter_glob: bpy.props.StringProperty(default = "*.json", options = {'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.vehicle_base is not None
+
+    def execute(self, context):
+        scene = context.scene
+
+        vehicle_base, parts = gather_rig_inputs(scene)
+        parts = [(bone_name, obj) for bone_name, obj in parts if obj is not None]
+        instanced_objects = linked_objects([obj for bone_name, obj in parts]) if scene.keep_mesh_instances else set()
+
+        #Planned from the transforms rigging bakes, so the template holds the bones Rig Vehicle builds
+        spec = plan_vehicle_rig(vehicle_base, parts, scene.bone_length, instanced_objects)
+        save_rig_spec(spec, self.filepath)
+
+        self.report({'INFO'}, "Saved rig template with {} bones".format(len(spec['bones'])))
+        return {'FINISHED'}
+
+
+class Apply_Rig_Template_OT_Operator(bpy.types.Operator, ImportHelper):
+    bl_idname = "view3d.apply_rig_template"
+    bl_label = "Apply Rig Template"
+    bl_description = "Rig the vehicle in this scene from a JSON rig template, meshes are found by name pattern"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filename_ext = ".json"
+    filter_glob: bpy.props.StringProperty(default = "*.json", options = {'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return rig_state(context.scene)['units']
+
+    def execute(self, context):
+        scene = context.scene
+
+        try:
+            spec = load_rig_spec(self.filepath)
+        except (OSError, ValueError, KeyError) as error:
+            self.report({'ERROR'}, "Can't read rig template: " + str(error))
+            return {'CANCELLED'}
+
+        vehicle_base, parts, keep_instances, missing = resolve_template(spec, scene.objects)
+        if vehicle_base is None:
+            self.report({'ERROR'}, "No vehicle base matching '{}' found".format(spec['meshes'][0]['object']))
+            return {'CANCELLED'}
+        if missing:
+            self.report({'WARNING'}, "No meshes found for: " + ", ".join(missing))
+
+        profiler = create_profiler('apply_rig_template')
+        #The template's bone layout is built as saved, the meshes only pick their bones
+        result = rig_vehicle(context, vehicle_base, parts, spec['bone_length'], keep_instances=keep_instances,
+            armature_cleanup=scene.armature_cleanup, profiler=profiler, join_meshes=scene.join_rig_meshes, template=spec)
+
+        report_sections(self, result['sections'])
+
+        report_profile(self, profiler)
+
+        finish_in_pose_mode(context, result['armature'])
 
         return {'FINISHED'}
 
@@ -296,162 +339,473 @@ class Scale_Units_OT_Operator(bpy.types.Operator):
     
     @classmethod
     def poll(cls, context):
-        unit_length = bpy.context.scene.unit_settings.scale_length
-        return not math.isclose(unit_length, 0.01, abs_tol=0.001) or bpy.context.scene.unit_settings.system != 'METRIC'
+        return not rig_state(context.scene)['units']
 
     def execute(self, context):
         bpy.context.scene.unit_settings.system = 'METRIC'
         bpy.context.scene.unit_settings.scale_length = 0.01
         bpy.context.space_data.clip_end = 100000
+        #The message bus only reports unit changes made in the UI
+        invalidate_rig_state()
 
         return {'FINISHED'}
 
 
-class Upscale_Objects_OT_Operator(bpy.types.Operator):
+class Upscale_Objects_OT_Operator(Chunked_Modal_Operator, bpy.types.Operator):
     bl_idname = "view3d.upscale_objects"
-    bl_label = "Rig Vehicle"
+    bl_label = "Upscale Objects"
     bl_description = "Set Scene Unit Scale for UE4"
     bl_options = {'REGISTER', 'UNDO'}
 
-    def execute(self, context):
-        bpy.ops.object.mode_set(mode='OBJECT', toggle=True)
+    def steps(self, context):
+        scene = context.scene
+        ensure_object_mode(context)
 
-        bpy.ops.view3d.snap_cursor_to_center()
-        bpy.ops.object.select_all(action='SELECT')
+        if scene.upscale_vehicle_collection and scene.vehicle_base is not None:
+            #Everything in the collections holding the vehicle base, nested ones included
+            objects = list({obj for collection in scene.vehicle_base.users_collection for obj in collection.all_objects})
+        else:
+            #Same objects select_all would select
+            objects = [obj for obj in context.view_layer.objects if obj.visible_get() and not obj.hide_select]
+        self.profiler = create_profiler('upscale_objects')
+
+        return upscale_steps(objects, profiler=self.profiler)
 
-        bpy.context.scene.tool_settings.transform_pivot_point = 'CURSOR'
+    def finished(self, context, result):
+        self.report({'INFO'}, "Scaled {} objects and {} data blocks".format(result['objects'], result['data']))
+        if result['copied']:
+            self.report({'INFO'}, "Copied {} data blocks also used by objects that weren't scaled".format(result['copied']))
+        report_profile(self, self.profiler)
+        return {'FINISHED'}
 
-        bpy.ops.transform.resize(value=(100, 100, 100), orient_type='GLOBAL', 
-            orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), 
-            orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=False, 
-            proportional_edit_falloff='SMOOTH', proportional_size=1, 
-            use_proportional_connected=False, use_proportional_projected=False)
+class Set_Bone_Location_Operator:
+    #Shared by the head and tail operators, target is the scene property the pivot goes to
+    target = None
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'EDIT_MESH'
+
+    def execute(self, context):
+        scene = context.scene
 
-        check_and_unlink_objects(bpy.context.selected_objects)
+        #Every mesh in edit mode counts, like the median point pivot of the viewport
+        objects = [obj for obj in context.objects_in_mode if obj.type == 'MESH']
+        pivot = selection_pivot(objects, scene.bone_pivot_mode)
+        if pivot is None:
+            self.report({'WARNING'}, "No vertices selected")
+            return {'CANCELLED'}
 
-        bpy.ops.object.transform_apply(location = False, rotation = True, scale = True)
+        setattr(scene, self.target, pivot['point'])
+
+        if pivot['axis'] is not None:
+            axis = pivot['axis']
+            self.report({'INFO'}, "Cylinder axis ({:.3f}, {:.3f}, {:.3f}), radius {:.2f}".format(axis.x, axis.y, axis.z, pivot['radius']))
 
-        bpy.context.scene.tool_settings.transform_pivot_point = 'MEDIAN_POINT'
-        
         return {'FINISHED'}
 
-class Set_Bone_Head_Location_OT_Operator(bpy.types.Operator):
+
+class Set_Bone_Head_Location_OT_Operator(Set_Bone_Location_Operator, bpy.types.Operator):
     bl_idname = "view3d.set_bone_head_location"
     bl_label = "Set Head Location"
-    bl_description = "Set Bone Head Location"
+    bl_description = "Set Bone Head Location to the pivot of selected vertices"
     bl_options = {'REGISTER', 'UNDO'}
-    
+
+    target = 'bone_head_location'
+
+
+class Set_Bone_Tail_Location_OT_Operator(Set_Bone_Location_Operator, bpy.types.Operator):
+    bl_idname = "view3d.set_bone_tail_location"
+    bl_label = "Set Tail Location"
+    bl_description = "Set Bone Tail Location to the pivot of selected vertices"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    target = 'bone_tail_location'
+
+
+def add_bones_to_armature(operator, context, pending):
+    #Bones go to the armature using the chosen armature data, then back to mesh edit mode or into pose mode.
+    #Returns None without adding anything when a parent bone doesn't exist
+    scene = context.scene
+    armature_data = scene.armature_for_new_bone
+    missing = missing_parents(armature_data, pending)
+    if missing:
+        operator.report({'ERROR'}, "Parent bone not found: " + ", ".join("{} for {}".format(parent, bone) for bone, parent in missing))
+        return None
+
+    arm_obj = next(filter(lambda o: o.type == 'ARMATURE' and o.data == armature_data, bpy.data.objects))
+    edit_object = context.edit_object
+
+    #Leaving edit mode writes selections to the meshes, vertex groups can only be changed in object mode
+    ensure_object_mode(context)
+    result = commit_bones(context, arm_obj, pending, scene.set_vertext_groups_to_selected)
+
+    if scene.end_in_pose_mode or edit_object is None or edit_object.type != 'MESH':
+        finish_in_pose_mode(context, arm_obj)
+    else:
+        arm_obj.select_set(state=False)
+        edit_object.select_set(state=True)
+        context.view_layer.objects.active = edit_object
+        bpy.ops.object.mode_set(mode='EDIT')
+
+    return result
+
+
+def new_bone_poll(context):
+    scene = context.scene
+    return (len(scene.armature_parent_bone_name) > 0 and scene.armature_for_new_bone is not None
+        and context.object is not None and context.object.mode == "EDIT" and context.object.type == "MESH")
+
+
+class Add_Bone_To_Armature_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.add_bone_to_armature"
+    bl_label = "Add Bone To Armature"
+    bl_description = "Add Bone To Selected Armature. Only usable in edit mode."
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return new_bone_poll(context)
+
     def execute(self, context):
         scene = context.scene
-        #TODO check if selected mesh not armature
-        if context.active_object.mode == 'EDIT':
-            obj = bpy.context.edit_object
-            obj.update_from_editmode()
-            me = obj.data
+        mesh_object = context.edit_object
 
-            mat = obj.matrix_world
+        pending = [{'name': scene.new_bone_name, 'head': scene.bone_head_location, 'tail': scene.bone_tail_location,
+            'parent': scene.armature_parent_bone_name, 'mesh': mesh_object, 'indices': selected_vertex_indices(mesh_object)}]
+        if add_bones_to_armature(self, context, pending) is None:
+            return {'CANCELLED'}
 
-            verts_sel = [v.co for v in me.vertices if v.select]
+        return {'FINISHED'}
+
+
+class Queue_Bone_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.queue_bone"
+    bl_label = "Queue Bone"
+    bl_description = "Remember the new bone with the selected vertices, queued bones are added all at once"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return new_bone_poll(context)
+
+    def execute(self, context):
+        scene = context.scene
+        mesh_object = context.edit_object
+        indices = selected_vertex_indices(mesh_object)
+
+        item = scene.pending_bones.add()
+        item.bone_name = scene.new_bone_name
+        item.parent_name = scene.armature_parent_bone_name
+        item.head = scene.bone_head_location
+        item.tail = scene.bone_tail_location
+        item.target_mesh = mesh_object
+        item.vertex_indices = encode_indices(indices)
+        item.vertex_count = len(indices)
 
-            loc = mat @ (sum(verts_sel, Vector()) / len(verts_sel))
-            scene.bone_head_location = loc
-    
         return {'FINISHED'}
 
 
-class Set_Bone_Tail_Location_OT_Operator(bpy.types.Operator):
-    bl_idname = "view3d.set_bone_tail_location"
-    bl_label = "Set Tail Location"
-    bl_description = "Set Bone Tail Location"
+class Remove_Pending_Bone_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.remove_pending_bone"
+    bl_label = "Remove Queued Bone"
+    bl_description = "Remove Bone From The Queue"
     bl_options = {'REGISTER', 'UNDO'}
 
+    id: bpy.props.IntProperty()
+
+    def execute(self, context):
+        context.scene.pending_bones.remove(self.id)
+
+        return {'FINISHED'}
+
+
+class Add_Queued_Bones_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.add_queued_bones"
+    bl_label = "Add Queued Bones"
+    bl_description = "Add all queued bones to the armature in one go and weight their vertices"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return len(context.scene.pending_bones) > 0 and context.scene.armature_for_new_bone is not None
+
     def execute(self, context):
         scene = context.scene
-        #TODO check if selected mesh not armature
-        if context.active_object.mode == 'EDIT':
-            obj = bpy.context.edit_object
-            obj.update_from_editmode()
-            me = obj.data
 
-            mat = obj.matrix_world
+        pending = [{'name': item.bone_name, 'head': item.head, 'tail': item.tail, 'parent': item.parent_name,
+            'mesh': item.target_mesh, 'indices': decode_indices(item.vertex_indices)} for item in scene.pending_bones]
+        result = add_bones_to_armature(self, context, pending)
+        if result is None:
+            return {'CANCELLED'}
+        scene.pending_bones.clear()
 
-            verts_sel = [v.co for v in me.vertices if v.select]
+        self.report({'INFO'}, "Added {} bones, weighted {} vertices".format(len(result['bone_names']), result['weighted_vertex_count']))
+        return {'FINISHED'}
 
-            loc = mat @ (sum(verts_sel, Vector()) / len(verts_sel))
-            scene.bone_tail_location = loc
-    
+
+def mesh_armature(obj, fallback_armature_data):
+    #Armature a mesh is skinned to: its armature modifier, its parent, or the object using fallback_armature_data
+    for modifier in obj.modifiers:
+        if modifier.type == 'ARMATURE' and modifier.object is not None:
+            return modifier.object
+    if obj.parent is not None and obj.parent.type == 'ARMATURE':
+        return obj.parent
+    if fallback_armature_data is not None:
+        return next((o for o in bpy.data.objects if o.type == 'ARMATURE' and o.data == fallback_armature_data), None)
+    return None
+
+
+class Auto_Skin_Loose_Parts_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.auto_skin_loose_parts"
+    bl_label = "Auto Skin Loose Parts"
+    bl_description = "Weight every loose part of the selected meshes fully to the deform bone nearest to it"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return any(obj.type == 'MESH' for obj in context.selected_objects)
+
+    def execute(self, context):
+        scene = context.scene
+        start = time.perf_counter()
+        ensure_object_mode(context)
+
+        for obj in [obj for obj in context.selected_objects if obj.type == 'MESH']:
+            armature_object = mesh_armature(obj, scene.armature_for_new_bone)
+            if armature_object is None:
+                self.report({'WARNING'}, "{}: no armature found, set Bone armature or rig it first".format(obj.name))
+                continue
+            if not any(modifier.type == 'ARMATURE' for modifier in obj.modifiers):
+                parent_to_armature(obj, armature_object, [])
+
+            result = skin_loose_parts(obj, armature_object)
+            self.report({'INFO'}, "{}: {} loose parts to {} bones".format(obj.name, result['components'], len(result['bones'])))
+
+        self.report({'INFO'}, "Skinned in {:.2f}s".format(time.perf_counter() - start))
         return {'FINISHED'}
 
 
-class Add_Bone_To_Armature_OT_Operator(bpy.types.Operator):
-    bl_idname = "view3d.add_bone_to_armature"
-    bl_label = "Add Bone To Armature"
-    bl_description = "Add Bone To Selected Armature. Only usable in edit mode."
+def weight_cache_directory(operator, scene):
+    #Absolute cache directory, None with an error report when a relative path has no saved file to start from
+    directory = scene.weight_cache_directory
+    if directory.startswith("//") and not bpy.data.filepath:
+        operator.report({'ERROR'}, "Save the file first or set an absolute weight cache directory")
+        return None
+    return bpy.path.abspath(directory)
+
+
+class Save_Weight_Cache_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.save_weight_cache"
+    bl_label = "Save Weight Cache"
+    bl_description = "Store the vertex weights of the selected meshes, to bring them back onto a re-imported revision"
+
+    @classmethod
+    def poll(cls, context):
+        return any(obj.type == 'MESH' for obj in context.selected_objects)
+
+    def execute(self, context):
+        directory = weight_cache_directory(self, context.scene)
+        if directory is None:
+            return {'CANCELLED'}
+        ensure_object_mode(context)
+
+        for obj in [obj for obj in context.selected_objects if obj.type == 'MESH']:
+            try:
+                result = save_weight_cache(obj, directory)
+            except OSError as error:
+                self.report({'ERROR'}, "Could not save weight cache: " + str(error))
+                return {'CANCELLED'}
+            self.report({'INFO'}, "{}: {} weights of {} vertices cached".format(obj.name, result['influences'], result['vertices']))
+        return {'FINISHED'}
+
+
+class Load_Weight_Cache_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.load_weight_cache"
+    bl_label = "Load Weight Cache"
+    bl_description = "Give every vertex of the selected meshes the cached weights of the nearest cached vertex, vertices without one get selected"
     bl_options = {'REGISTER', 'UNDO'}
 
     @classmethod
     def poll(cls, context):
-        parent_name = context.scene.armature_parent_bone_name
-        return len(parent_name) > 0 and context.object.mode == "EDIT" and context.object.type == "MESH"
+        return any(obj.type == 'MESH' for obj in context.selected_objects)
 
     def execute(self, context):
-        C = bpy.context 
-        D = bpy.data
-        O = bpy.ops
         scene = context.scene
+        directory = weight_cache_directory(self, scene)
+        if directory is None:
+            return {'CANCELLED'}
+        ensure_object_mode(context)
+
+        start = time.perf_counter()
+        for obj in [obj for obj in context.selected_objects if obj.type == 'MESH']:
+            cache = load_weight_cache(directory, obj)
+            if cache is None:
+                self.report({'WARNING'}, "{}: no weight cache in {}".format(obj.name, directory))
+                continue
+            result = remap_weights(obj, cache, scene.weight_transfer_distance)
+            if result['unmatched']:
+                self.report({'WARNING'}, "{}: {} vertices had no cached vertex within {:g} and are selected".format(
+                    obj.name, result['unmatched'], scene.weight_transfer_distance))
+            self.report({'INFO'}, "{}: weights of {} vertices restored".format(obj.name, result['matched']))
+
+        self.report({'INFO'}, "Weights transferred in {:.2f}s".format(time.perf_counter() - start))
+        return {'FINISHED'}
+
+
+def skinned_meshes(context):
+    #Selected meshes plus the meshes deformed by selected armatures
+    armatures = set(obj for obj in context.selected_objects if obj.type == 'ARMATURE')
+    meshes = [obj for obj in context.selected_objects if obj.type == 'MESH']
+    meshes += [obj for obj in context.scene.objects if obj.type == 'MESH' and obj not in meshes
+        and any(modifier.type == 'ARMATURE' and modifier.object in armatures for modifier in obj.modifiers)]
+    return meshes
+
+
+class Compact_Skin_Weights_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.compact_skin_weights"
+    bl_label = "Compact Skin Weights"
+    bl_description = ("Remove empty vertex groups, limit bone influences per vertex and renormalize them "
+        "on the selected meshes and the meshes of selected armatures, vertices without weights get selected")
+    bl_options = {'REGISTER', 'UNDO'}
 
-        armature_data = scene.armature_for_new_bone
-        parent_name = scene.armature_parent_bone_name
-        
-        arm_obj = next(filter(lambda o: o.type == 'ARMATURE' and o.data == armature_data, D.objects))
+    max_influences: bpy.props.IntProperty(name = "Max Influences", default = 4, min = 1, max = 12,
+        description = "Bone weights kept per vertex, the largest ones win")
+    min_weight: bpy.props.FloatProperty(name = "Min Weight", default = 0.0, min = 0.0, max = 1.0,
+        description = "Bone weights at or below this are removed")
 
-        selected_object = bpy.context.selected_objects[0]
+    @classmethod
+    def poll(cls, context):
+        return any(obj.type in ('MESH', 'ARMATURE') for obj in context.selected_objects)
 
-        #Need to have object mode so selected vertices would get updated
-        O.object.mode_set(mode='OBJECT', toggle=False)
+    def execute(self, context):
+        ensure_object_mode(context)
+
+        saved = 0
+        for obj in skinned_meshes(context):
+            armature_object = mesh_armature(obj, None)
+            deform_names = None
+            if armature_object is not None:
+                deform_names = set(bone.name for bone in armature_object.data.bones if bone.use_deform)
+
+            result = compact_weights(obj, deform_names, self.max_influences, self.min_weight)
+            saved += result['bytes_before'] - result['bytes_after']
+            self.report({'INFO'}, "{}: {} empty groups and {} weights removed, up to {} influences before, ~{:.1f} KB saved".format(
+                obj.name, result['removed_groups'], result['removed_influences'], result['max_influences'],
+                (result['bytes_before'] - result['bytes_after']) / 1024))
+            if result['unweighted']:
+                self.report({'WARNING'}, "{}: {} vertices have no bone weight and are selected".format(obj.name, result['unweighted']))
+
+        self.report({'INFO'}, "Skin data ~{:.1f} KB smaller".format(saved / 1024))
+        return {'FINISHED'}
 
-        selected_vertice_indexes = [v.index for v in selected_object.data.vertices if v.select]
 
-        C.view_layer.objects.active = arm_obj
-        arm_obj.select_set(state=True)
+class Generate_Collision_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.generate_collision"
+    bl_label = "Generate Collision"
+    bl_description = "Build simplified UCX_/UBX_/UCP_ collision proxies for every bone of the selected rig, parented to their bones"
+    bl_options = {'REGISTER', 'UNDO'}
 
-        O.object.mode_set(mode='EDIT', toggle=False)
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type in ('ARMATURE', 'MESH')
 
-        parent_bone = armature_data.edit_bones[parent_name]
+    def execute(self, context):
+        scene = context.scene
+        obj = context.active_object
+        armature_object = obj if obj.type == 'ARMATURE' else mesh_armature(obj, None)
+        if armature_object is None:
+            self.report({'ERROR'}, "Select a rig armature or one of its meshes")
+            return {'CANCELLED'}
+        ensure_object_mode(context)
+
+        start = time.perf_counter()
+        collision = build_collision_proxies(armature_object, bone_shapes(armature_object, scene.collision_shape),
+            scene.collision_vertex_budget)
+        report_collision(self, collision)
+        self.report({'INFO'}, "Collision generated in {:.2f}s".format(time.perf_counter() - start))
+        return {'FINISHED'}
 
-        new_bone_name = scene.new_bone_name
 
-        new_bone = armature_data.edit_bones.new(new_bone_name)
-        new_bone.head = scene.bone_head_location
-        new_bone.tail = scene.bone_tail_location
-        new_bone.parent = parent_bone
-        selected_object.vertex_groups.new(name = new_bone.name)
-        
-        if scene.set_vertext_groups_to_selected:
-            arm_obj.select_set(state=False)
-            selected_object.select_set(state=True)
-            C.view_layer.objects.active  = selected_object
-            O.object.mode_set(mode='OBJECT', toggle = True)
+class Bake_Test_Drive_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.bake_test_drive"
+    bl_label = "Bake Test Drive"
+    bl_description = "Key a test drive on the selected rig: wheels spin and steer, needles follow speed and revs"
+    bl_options = {'REGISTER', 'UNDO'}
 
-            for group in selected_object.vertex_groups:
-                selected_object.vertex_groups[group.name].add(selected_vertice_indexes, 1, 'SUBTRACT')
+    frame_count: bpy.props.IntProperty(name = "Frames", default = 250, min = 2, max = 100000,
+        description = "Length of the clip, from the scene start frame")
+    max_speed: bpy.props.FloatProperty(name = "Top Speed (km/h)", default = 100, min = 1,
+        description = "Speed reached after accelerating, wheels spin from it and their radius")
+    steering_angle: bpy.props.FloatProperty(name = "Steering", default = math.radians(25), min = 0, max = math.radians(60),
+        subtype = 'ANGLE', description = "Largest steering angle of the front wheels")
+    forward_axis: bpy.props.EnumProperty(name = "Forward", default = '-Y', description = "Direction the vehicle faces",
+        items = [('-Y', "-Y", "Facing Blender's front view"), ('+Y', "+Y", ""), ('+X', "+X", "Facing UE forward"), ('-X', "-X", "")])
 
-            selected_object.vertex_groups[new_bone.name].add(selected_vertice_indexes, 1, 'REPLACE')
-            selected_object.select_set(state=False)
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type in ('ARMATURE', 'MESH')
+
+    def execute(self, context):
+        scene = context.scene
+        obj = context.active_object
+        armature_object = obj if obj.type == 'ARMATURE' else mesh_armature(obj, None)
+        if armature_object is None:
+            self.report({'ERROR'}, "Select a rig armature or one of its meshes")
+            return {'CANCELLED'}
+        ensure_object_mode(context)
+
+        start = time.perf_counter()
+        result = bake_test_drive(scene, armature_object, self.frame_count, self.max_speed, self.steering_angle, self.forward_axis)
+        scene.frame_end = scene.frame_start + self.frame_count - 1
+
+        if not result['wheel_bones']:
+            self.report({'WARNING'}, "No wheel bones found, only needles and calipers were keyed")
+        elif not result['wheels']:
+            self.report({'WARNING'}, "No meshes found for the wheel bones, wheels only steer")
+        self.report({'INFO'}, "{} keys on {} curves baked in {:.0f} ms".format(result['keys'], result['fcurves'],
+            (time.perf_counter() - start) * 1000))
+        return {'FINISHED'}
 
-        if not scene.end_in_pose_mode:
-            arm_obj.select_set(state=False)
-            selected_object.select_set(state=True)
-            #Need to go into armature mode so it would get visually updated. Tweek around, maybe can find better solution
-            C.view_layer.objects.active = arm_obj
-            O.object.mode_set(mode='POSE', toggle = True)
 
-            C.view_layer.objects.active = selected_object
-            O.object.mode_set(mode='EDIT', toggle = True)
-        else:
-            C.view_layer.objects.active = arm_obj
-            O.object.mode_set(mode='POSE', toggle = True)
+class Generate_LODs_OT_Operator(bpy.types.Operator):
+    bl_idname = "view3d.generate_lods"
+    bl_label = "Generate LODs"
+    bl_description = "Build decimated LOD copies of every mesh of the selected rig, skinned to the same armature"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    ratios: bpy.props.StringProperty(name = "Ratios", default = "0.5, 0.25, 0.1",
+        description = "Comma separated decimate ratio of every LOD after LOD0")
+    triangle_budgets: bpy.props.StringProperty(name = "Triangle Budgets", default = "",
+        description = "Comma separated triangle count of the whole vehicle per LOD after LOD0, used instead of the ratios when set")
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type in ('ARMATURE', 'MESH')
 
+    def execute(self, context):
+        obj = context.active_object
+        armature_object = obj if obj.type == 'ARMATURE' else mesh_armature(obj, None)
+        if armature_object is None:
+            self.report({'ERROR'}, "Select a rig armature or one of its meshes")
+            return {'CANCELLED'}
+        try:
+            ratios = parse_levels(self.ratios)
+            triangle_budgets = parse_levels(self.triangle_budgets)
+        except ValueError as error:
+            self.report({'ERROR'}, "Can't read LOD levels: " + str(error))
+            return {'CANCELLED'}
+        ensure_object_mode(context)
+
+        start = time.perf_counter()
+        result = build_lods(context, armature_object, ratios, triangle_budgets)
+        for level in result['levels']:
+            self.report({'INFO'}, "LOD{}: {} triangles ({:.0%}) in {} meshes".format(level['level'], level['triangles'],
+                level['triangles'] / max(result['levels'][0]['triangles'], 1), level['objects']))
+        self.report({'INFO'}, "{} LODs built in {:.2f}s".format(len(result['levels']) - 1, time.perf_counter() - start))
         return {'FINISHED'}
 
 
@@ -464,6 +818,8 @@ class Add_Another_Wheel_OT_Operator(bpy.types.Operator):
     def execute(self, context):
         new = context.scene.multiple_wheels.add()
         new.wheel_name = "Wheel"
+        context.scene.wheel_list_index = len(context.scene.multiple_wheels) - 1
+        invalidate_rig_state()
 
         return {'FINISHED'}
 
@@ -478,6 +834,10 @@ class Remove_Chosen_Wheel_OT_Operator(bpy.types.Operator):
 
     def execute(self, context):
         # item = context.scene.multiple_wheels[len(context.scene.multiple_wheels)-1]
+        if not 0 <= self.id < len(context.scene.multiple_wheels):
+            return {'CANCELLED'}
         context.scene.multiple_wheels.remove(self.id)
+        context.scene.wheel_list_index = max(0, min(context.scene.wheel_list_index, len(context.scene.multiple_wheels) - 1))
+        invalidate_rig_state()
 
         return {'FINISHED'}
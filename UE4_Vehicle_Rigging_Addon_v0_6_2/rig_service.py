@@ -0,0 +1,389 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Warm worker service for rig jobs. Usage:
+#   blender --background --python rig_service.py -- --workers 4 --port 8765 --drop-dir jobs --recycle 25
+#Workers are background Blender processes with the add-on registered once, they take jobs one at a time
+#over stdin and answer on stdout, and are restarted after --recycle jobs so memory stays bounded.
+#Jobs come in as JSON lines on a localhost socket or as JSON files dropped into --drop-dir:
+#   {"file": "car.fbx", "options": {"export_fbx": true, "output_dir": "out"}}
+#Socket clients get every status change of their jobs back as JSON lines:
+#   {"job": 3, "file": "car.fbx", "status": "queued" | "running" | "done" | "failed", ...}
+#A {"command": "status"} line returns the worker and queue state. Files in --drop-dir are moved to
+#processing/ and then done/ with their result, status/ holds the latest status of each
+
+import argparse, json, os, queue, socketserver, subprocess, sys, threading, time
+
+if __name__ == "__main__" and not __package__:
+    #Started with --python, so re-import this file as part of the add-on package and run from there
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(addon_dir))
+    import importlib
+    service = importlib.import_module(os.path.basename(addon_dir) + ".rig_service")
+    sys.exit(service.main(service.blender_argv()))
+
+import bpy
+
+from . batch_cli import blender_argv, ensure_registered, reset_file, rig_file
+
+
+#Lines from workers starting with this carry JSON, everything else is Blender's own output
+MESSAGE_MARKER = "@@vehicle-rig "
+
+#Seconds a starting worker gets to register the add-on
+STARTUP_TIMEOUT = 120
+
+DROP_POLL_INTERVAL = 0.5
+
+
+def send_message(message):
+    sys.stdout.write(MESSAGE_MARKER + json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+def run_service_worker():
+    #Worker side: register once, then rig every job line from stdin until it closes
+    ensure_registered()
+    send_message({'ready': True})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        result = rig_file(job['file'], job['options'])
+        #Frees the job's data while idle, and nothing of it reaches the next job, whatever file type that loads
+        reset_file()
+        send_message({'job': job['id'], 'result': result})
+    return 0
+
+
+class WorkerProcess:
+    #One warm Blender process, driven by a single service thread
+
+    def __init__(self, index, blender, recycle_after):
+        self.index = index
+        self.blender = blender
+        self.recycle_after = recycle_after
+        self.process = None
+        self.lines = None
+        self.jobs_done = 0
+        self.restarts = -1
+        self.startup_time = 0.0
+
+    def command(self):
+        return [self.blender, '--background', '--factory-startup', '--python', os.path.abspath(__file__), '--', '--worker']
+
+    def start(self):
+        start = time.perf_counter()
+        self.process = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, bufsize=1)
+        #A reader thread turns worker output into messages, so waiting for one can time out
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read_output, args=(self.process, self.lines), daemon=True).start()
+        self.jobs_done = 0
+        self.restarts += 1
+        message = self.next_message(STARTUP_TIMEOUT)
+        if message is None or not message.get('ready'):
+            self.stop()
+            raise RuntimeError("Worker {} failed to start".format(self.index))
+        self.startup_time = time.perf_counter() - start
+
+    @staticmethod
+    def read_output(process, lines):
+        for line in process.stdout:
+            if line.startswith(MESSAGE_MARKER):
+                lines.put(json.loads(line[len(MESSAGE_MARKER):]))
+        #End of output, the process is gone
+        lines.put(None)
+
+    def next_message(self, timeout):
+        try:
+            return self.lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+
+    def run(self, job, timeout):
+        #Returns the worker's result, a failed result when the worker died or timed out
+        if self.process is None:
+            self.start()
+        try:
+            self.process.stdin.write(json.dumps({'id': job['id'], 'file': job['file'], 'options': job['options']}) + "\n")
+            self.process.stdin.flush()
+            message = self.next_message(timeout)
+        except OSError:
+            message = None
+
+        if message is None or message.get('job') != job['id']:
+            #Dead or stuck, the next job gets a fresh worker
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+            return {'file': job['file'], 'success': False, 'error': "Worker {} crashed or timed out".format(self.index),
+                'timings': {}}
+
+        self.jobs_done += 1
+        if self.jobs_done >= self.recycle_after:
+            #Restart right away, so the worker is warm again before the next job
+            self.stop()
+            self.start()
+        return message['result']
+
+    def state(self):
+        return {'worker': self.index, 'running': self.process is not None, 'jobs_since_start': self.jobs_done,
+            'restarts': self.restarts, 'startup_time': self.startup_time}
+
+
+class RigService:
+
+    def __init__(self, blender, worker_count, recycle_after, default_options, timeout=None):
+        self.default_options = default_options
+        self.timeout = timeout
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.workers = [WorkerProcess(index, blender, recycle_after) for index in range(worker_count)]
+        self.counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+
+    def start(self):
+        for worker in self.workers:
+            threading.Thread(target=self.work, args=(worker,), daemon=True).start()
+
+    def stop(self):
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.stop()
+
+    def submit(self, file, options=None, listener=None):
+        #listener gets every status event of the job, it is called from service threads
+        with self.lock:
+            self.next_id += 1
+            job_id = self.next_id
+        job_options = dict(self.default_options)
+        job_options.update(options or {})
+        job = {'id': job_id, 'file': os.path.abspath(file), 'options': job_options, 'listener': listener,
+            'submitted': time.perf_counter()}
+        self.set_status(job, 'queued')
+        self.jobs.put(job)
+        return job_id
+
+    def set_status(self, job, status, **fields):
+        with self.lock:
+            if 'status' in job:
+                self.counts[job['status']] -= 1
+            self.counts[status] += 1
+        job['status'] = status
+        if job['listener'] is not None:
+            event = {'job': job['id'], 'file': job['file'], 'status': status}
+            event.update(fields)
+            job['listener'](event)
+
+    def work(self, worker):
+        #Warm the worker before the first job comes in, a failed start is retried by the first job
+        try:
+            worker.start()
+        except RuntimeError as error:
+            print(error)
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            started = time.perf_counter()
+            self.set_status(job, 'running', worker=worker.index, queued_time=started - job['submitted'])
+            try:
+                result = worker.run(job, self.timeout)
+            except Exception as error:
+                result = {'file': job['file'], 'success': False, 'error': "{}: {}".format(type(error).__name__, error),
+                    'timings': {}}
+            result.setdefault('timings', {})
+            result['timings']['queued'] = started - job['submitted']
+            result['timings']['service'] = time.perf_counter() - started
+            self.set_status(job, 'done' if result['success'] else 'failed', worker=worker.index, result=result)
+
+    def state(self):
+        with self.lock:
+            counts = dict(self.counts)
+        return {'jobs': counts, 'workers': [worker.state() for worker in self.workers]}
+
+
+class JobRequestHandler(socketserver.StreamRequestHandler):
+    #One JSON line per job, events of the connection's jobs are written back as they happen
+
+    def handle(self):
+        write_lock = threading.Lock()
+        pending = [0]
+        all_done = threading.Condition()
+
+        def write(message):
+            with write_lock:
+                try:
+                    self.wfile.write((json.dumps(message) + "\n").encode('utf-8'))
+                    self.wfile.flush()
+                except OSError:
+                    pass
+
+        def listener(event):
+            write(event)
+            if event['status'] in ('done', 'failed'):
+                with all_done:
+                    pending[0] -= 1
+                    all_done.notify_all()
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as error:
+                write({'error': "Invalid JSON: {}".format(error)})
+                continue
+            if request.get('command') == 'status':
+                write(self.server.service.state())
+            elif 'file' in request:
+                with all_done:
+                    pending[0] += 1
+                self.server.service.submit(request['file'], request.get('options'), listener)
+            else:
+                write({'error': "Expected a job with 'file' or a command"})
+
+        #The client is done sending, stream the rest of its jobs before closing
+        with all_done:
+            all_done.wait_for(lambda: pending[0] == 0)
+
+
+class JobServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        socketserver.ThreadingTCPServer.__init__(self, address, JobRequestHandler)
+        self.service = service
+
+
+def watch_drop_dir(service, drop_dir, stop_event):
+    #Job files dropped into drop_dir go through processing/ to done/, status/ always has their latest event
+    folders = {name: os.path.join(drop_dir, name) for name in ('processing', 'done', 'status')}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    def file_listener(name, job_request):
+        def listener(event):
+            with open(os.path.join(folders['status'], name), 'w') as status_file:
+                json.dump(event, status_file, indent=2)
+            if event['status'] in ('done', 'failed'):
+                job_request['result'] = event['result']
+                with open(os.path.join(folders['done'], name), 'w') as done_file:
+                    json.dump(job_request, done_file, indent=2)
+                os.remove(os.path.join(folders['processing'], name))
+        return listener
+
+    while not stop_event.wait(DROP_POLL_INTERVAL):
+        for name in sorted(os.listdir(drop_dir)):
+            path = os.path.join(drop_dir, name)
+            if not name.endswith('.json') or not os.path.isfile(path):
+                continue
+            processing_path = os.path.join(folders['processing'], name)
+            try:
+                os.replace(path, processing_path)
+                with open(processing_path) as job_file:
+                    job_request = json.load(job_file)
+                #Relative paths are relative to the drop folder
+                file = os.path.join(drop_dir, job_request['file'])
+            except (OSError, ValueError, KeyError) as error:
+                print("Skipping job file {}: {}".format(name, error))
+                continue
+            service.submit(file, job_request.get('options'), file_listener(name, job_request))
+
+
+def submit_jobs(host, port, files, options):
+    #Client side: send jobs to a running service and print its events until every job finished
+    import socket
+    with socket.create_connection((host, port)) as connection:
+        for file in files:
+            connection.sendall((json.dumps({'file': os.path.abspath(file), 'options': options}) + "\n").encode('utf-8'))
+        connection.shutdown(socket.SHUT_WR)
+        failed = 0
+        for line in connection.makefile('r', encoding='utf-8'):
+            event = json.loads(line)
+            if event.get('status') in ('done', 'failed'):
+                result = event.pop('result')
+                failed += event['status'] == 'failed'
+                event.update({'error': result.get('error'), 'timings': result.get('timings')})
+            print(json.dumps(event))
+    return 0 if failed == 0 else 1
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='rig_service.py', description="Keep warm Blender workers for rig jobs")
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) // 2, 1), help="Number of warm worker processes")
+    parser.add_argument('--port', type=int, default=8765, help="Localhost port for job connections, 0 disables the socket")
+    parser.add_argument('--drop-dir', help="Folder watched for JSON job files")
+    parser.add_argument('--recycle', type=int, default=25, help="Jobs after which a worker is restarted")
+    parser.add_argument('--output-dir', help="Default directory for rigged files")
+    parser.add_argument('--export-fbx', action='store_true', help="Export an .fbx for every job by default")
+    parser.add_argument('--set-unit-scale', action='store_true', help="Set metric 0.01 unit scale before rigging")
+    parser.add_argument('--blender', help="Blender executable for workers, defaults to the running one")
+    parser.add_argument('--timeout', type=float, default=None, help="Seconds before a job's worker is killed")
+    parser.add_argument('--submit', nargs='+', metavar='FILE', help="Send files to a running service and print its events")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_service_worker()
+
+    default_options = {
+        'set_unit_scale': args.set_unit_scale,
+        'output_dir': os.path.abspath(args.output_dir) if args.output_dir else None,
+        'export_fbx': args.export_fbx,
+    }
+    if args.submit:
+        return submit_jobs('127.0.0.1', args.port, args.submit, {key: value for key, value in default_options.items() if value})
+
+    service = RigService(args.blender or bpy.app.binary_path, args.workers, args.recycle, default_options, args.timeout)
+    print("Starting {} workers".format(args.workers))
+    service.start()
+
+    stop_event = threading.Event()
+    if args.drop_dir:
+        drop_dir = os.path.abspath(args.drop_dir)
+        os.makedirs(drop_dir, exist_ok=True)
+        threading.Thread(target=watch_drop_dir, args=(service, drop_dir, stop_event), daemon=True).start()
+        print("Watching " + drop_dir)
+
+    server = None
+    try:
+        if args.port:
+            #Only local connections, jobs name files on this machine
+            server = JobServer(('127.0.0.1', args.port), service)
+            print("Listening on 127.0.0.1:{}".format(server.server_address[1]))
+            server.serve_forever()
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        if server is not None:
+            server.server_close()
+        service.stop()
+    return 0
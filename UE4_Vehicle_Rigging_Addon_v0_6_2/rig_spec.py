@@ -0,0 +1,150 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Rig planning on plain data. A rig spec is a JSON friendly dict:
+#   {"version": 1, "bone_length": 100,
+#    "bones": [{"name": "Root", "parent": null, "head": [x, y, z], "tail": [x, y, z], "matrix": [[...]] or null}, ...],
+#    "meshes": [{"object": "Wheel_FR", "bone": "FR", "mode": "SKIN" or "BONE", "pattern": "Wheel_FR(\\.\\d+)?$"}, ...]}
+#Nothing here imports bpy, so specs can be planned, cached and checked outside Blender
+
+import json, re
+
+
+SPEC_VERSION = 1
+
+#'SKIN' meshes get an armature modifier and vertex group, 'BONE' meshes are parented to their bone
+MESH_MODES = ('SKIN', 'BONE')
+
+
+def strip_name_suffix(name):
+    #Blender's ".001" duplicate suffix
+    return re.sub(r'\.\d{3,}$', '', name)
+
+
+def name_pattern(object_name):
+    #Matches the same name in trim variants, with or without prefixes and duplicate suffixes
+    return re.escape(strip_name_suffix(object_name)) + r'(\.\d+)?$'
+
+
+def matrix_translation(matrix):
+    return [matrix[0][3], matrix[1][3], matrix[2][3]]
+
+
+def plan_rig(inputs, bone_length):
+    #inputs are dicts with "bone", "object", "matrix" (4x4 world matrix rows) and optional "mode",
+    #the first one is the vehicle base. Parts asking for an existing bone name share that bone
+    base = inputs[0]
+    head = matrix_translation(base['matrix'])
+
+    #Root follows the full base matrix, including roll
+    y_axis = [base['matrix'][row][1] for row in range(3)]
+    y_length = sum(value * value for value in y_axis) ** 0.5 or 1.0
+    bones = [{
+        'name': 'Root',
+        'parent': None,
+        'head': head,
+        'tail': [h + value / y_length * bone_length for h, value in zip(head, y_axis)],
+        'matrix': [list(row) for row in base['matrix']],
+    }]
+    meshes = [{'object': base['object'], 'bone': 'Root', 'mode': base.get('mode', 'SKIN'), 'pattern': name_pattern(base['object'])}]
+
+    bone_names = set(['Root'])
+    for part in inputs[1:]:
+        if part['bone'] not in bone_names:
+            bone_names.add(part['bone'])
+            head = matrix_translation(part['matrix'])
+            #Tail goes along the mesh's local Y axis, scaled like the mesh
+            tail_offset = [part['matrix'][row][1] * bone_length for row in range(3)]
+            bones.append({
+                'name': part['bone'],
+                'parent': 'Root',
+                'head': head,
+                'tail': [h + offset for h, offset in zip(head, tail_offset)],
+                'matrix': None,
+            })
+        meshes.append({'object': part['object'], 'bone': part['bone'], 'mode': part.get('mode', 'SKIN'),
+            'pattern': name_pattern(part['object'])})
+
+    return {'version': SPEC_VERSION, 'bone_length': bone_length, 'bones': bones, 'meshes': meshes}
+
+
+def validate_rig_spec(spec):
+    if spec.get('version') != SPEC_VERSION:
+        raise ValueError("Unsupported rig spec version: " + str(spec.get('version')))
+
+    bone_names = set()
+    for bone in spec['bones']:
+        if bone['parent'] is not None and bone['parent'] not in bone_names:
+            raise ValueError("Bone '{}' is listed before its parent '{}'".format(bone['name'], bone['parent']))
+        bone_names.add(bone['name'])
+
+    for mesh in spec['meshes']:
+        if mesh['bone'] not in bone_names:
+            raise ValueError("Mesh '{}' uses unknown bone '{}'".format(mesh['object'], mesh['bone']))
+        if mesh['mode'] not in MESH_MODES:
+            raise ValueError("Mesh '{}' has unknown mode '{}'".format(mesh['object'], mesh['mode']))
+
+    if not spec['meshes'] or spec['meshes'][0]['bone'] != 'Root':
+        raise ValueError("First mesh of a rig spec has to be the vehicle base on Root")
+    return spec
+
+
+def save_rig_spec(spec, filepath):
+    with open(filepath, 'w') as spec_file:
+        json.dump(spec, spec_file, indent=2)
+
+
+def load_rig_spec(filepath):
+    with open(filepath) as spec_file:
+        return validate_rig_spec(json.load(spec_file))
+
+
+def template_bones(spec, bone_names):
+    #Bones of a spec that the given bones need: themselves, their parents and Root, in spec order.
+    #Bones of meshes that matched nothing are left out
+    parents = {bone['name']: bone['parent'] for bone in spec['bones']}
+    needed = set(['Root'])
+    for bone_name in bone_names:
+        if bone_name not in parents:
+            raise ValueError("Rig spec has no bone '{}'".format(bone_name))
+        while bone_name is not None and bone_name not in needed:
+            needed.add(bone_name)
+            bone_name = parents[bone_name]
+    return [bone for bone in spec['bones'] if bone['name'] in needed]
+
+
+def match_template(spec, object_names):
+    #Map every mesh entry of a spec to an object name, exact names first, then name patterns.
+    #Returns object names in mesh entry order, None where nothing matched
+    available = sorted(object_names)
+    used = set()
+    matches = [None] * len(spec['meshes'])
+
+    for index, mesh in enumerate(spec['meshes']):
+        if mesh['object'] in object_names and mesh['object'] not in used:
+            matches[index] = mesh['object']
+            used.add(mesh['object'])
+
+    for index, mesh in enumerate(spec['meshes']):
+        if matches[index] is not None:
+            continue
+        pattern = re.compile(mesh.get('pattern') or name_pattern(mesh['object']))
+        for name in available:
+            if name not in used and pattern.search(name):
+                matches[index] = name
+                used.add(name)
+                break
+
+    return matches
@@ -0,0 +1,116 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Scene upscaling for UE units done straight on object data. A uniform scale S commutes with every rotation
+#and scale, so S @ W == W' @ S where W' is W with its translation scaled. Scaling every data block once and
+#every object location (and parent inverse translation) by the same factor is the same as resizing
+#everything around the world origin and applying the scale, without unlinking shared data
+
+from mathutils import Matrix
+
+from . profiling import StageProfiler
+from . transforms import BAKEABLE_TYPES, SHAPE_KEY_TYPES, data_users, read_coordinates, unique_data_objects
+
+
+def scale_coordinates(collection, factor):
+    co = read_coordinates(collection)
+    co *= factor
+    collection.foreach_set('co', co.ravel())
+
+
+def scale_data(obj, factor):
+    #Returns the number of vertices scaled, 0 for data types going through the C transform
+    data = obj.data
+    if obj.type == 'MESH':
+        #Uniform scale leaves normals, custom ones included, as they are
+        scale_coordinates(data.vertices, factor)
+        if data.shape_keys is not None:
+            for key_block in data.shape_keys.key_blocks:
+                scale_coordinates(key_block.data, factor)
+        data.update()
+        return len(data.vertices)
+
+    matrix = Matrix.Scale(factor, 4)
+    if obj.type in SHAPE_KEY_TYPES:
+        data.transform(matrix, shape_keys=True)
+    else:
+        data.transform(matrix)
+    return 0
+
+
+def scaled_translation(matrix, factor):
+    matrix = matrix.copy()
+    matrix.translation = matrix.translation * factor
+    return matrix
+
+
+def localize_shared_data(objects, users):
+    #Data also used outside the scaled objects gets one copy, shared by all scaled users so they stay instanced.
+    #Returns the number of copies made
+    object_set = set(objects)
+    copies = 0
+    for obj in unique_data_objects(o for o in objects if o.type in BAKEABLE_TYPES):
+        data = obj.data
+        data_objects = users[data]
+        if all(user in object_set for user in data_objects):
+            continue
+        copy = data.copy()
+        scaled_users = [user for user in data_objects if user in object_set]
+        for user in scaled_users:
+            user.data = copy
+        users[data] = [user for user in data_objects if user not in object_set]
+        users[copy] = scaled_users
+        copies += 1
+    return copies
+
+
+def upscale_steps(objects, factor=100, profiler=None):
+    #Same as resizing objects around the world origin by factor and applying the scale, every data block
+    #is scaled once and nothing gets selected. Yields (progress, message) between chunks,
+    #returns {'objects': int, 'data': int, 'copied': int}
+    if profiler is None:
+        profiler = StageProfiler('upscale_objects')
+    objects = list(objects)
+    object_set = set(objects)
+
+    yield 0.0, "Checking shared data"
+
+    with profiler.stage('localize_shared_data') as counts:
+        users = data_users()
+        copied = localize_shared_data(objects, users)
+        counts['objects'] = copied
+
+    with profiler.stage('scale_transforms') as counts:
+        #World matrices of objects under unscaled parents are read before anything moves
+        outside_parent = [(obj, obj.matrix_world.copy()) for obj in objects if obj.parent is not None and obj.parent not in object_set]
+        for obj in objects:
+            if obj.parent is None or obj.parent in object_set:
+                #Location and parent inverse are both in the scaled parent's space
+                obj.location = obj.location * factor
+                obj.delta_location = obj.delta_location * factor
+                if obj.parent is not None:
+                    obj.matrix_parent_inverse = scaled_translation(obj.matrix_parent_inverse, factor)
+        for obj, matrix_world in outside_parent:
+            obj.matrix_world = scaled_translation(matrix_world, factor)
+        counts['objects'] = len(objects)
+
+    data_objects = unique_data_objects(obj for obj in objects if obj.type in BAKEABLE_TYPES)
+    for index, obj in enumerate(data_objects):
+        yield 0.1 + 0.9 * index / len(data_objects), "Scaling " + obj.data.name
+        with profiler.stage('scale_data') as counts:
+            counts['vertices'] = scale_data(obj, factor)
+            counts['objects'] = len(users.get(obj.data, ()))
+
+    return {'objects': len(objects), 'data': len(data_objects), 'copied': copied}
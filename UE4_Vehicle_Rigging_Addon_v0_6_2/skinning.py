@@ -0,0 +1,99 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Rigid auto-skinning of merged meshes: every loose part (connected component) follows the bone nearest to it
+
+import numpy as np
+from mathutils.kdtree import KDTree
+
+from . transforms import read_coordinates, world_space
+from . weights import assign_group_ids
+
+
+#Points per bone in the KD-tree, enough that the nearest point is on the nearest bone for parts near the bones
+BONE_SAMPLES = 9
+
+
+def connected_components(mesh):
+    #Union-find on the edge arrays: roots hook to the smaller root of every edge they share, then paths are
+    #compressed by pointer jumping, until no edge joins two roots. Returns a component id per vertex (0..n-1)
+    vertex_count = len(mesh.vertices)
+    edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges)
+    a, b = edges[0::2], edges[1::2]
+
+    parent = np.arange(vertex_count, dtype=np.int32)
+    while len(a):
+        root_a = parent[a]
+        root_b = parent[b]
+        joined = root_a != root_b
+        a, b = a[joined], b[joined]
+        root_a, root_b = root_a[joined], root_b[joined]
+        if not len(a):
+            break
+        #Always hooking higher roots to lower ones can't make cycles. A root on many edges takes the lowest
+        #root it touches, instead of whichever write lands last, so high degree vertices need one round
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    roots, component_ids = np.unique(parent, return_inverse=True)
+    return component_ids.astype(np.int32), len(roots)
+
+
+def bone_kd_tree(armature_object, bone_names):
+    #World space points along every bone, the tree index is the bone's position in bone_names
+    bones = armature_object.data.bones
+    matrix = armature_object.matrix_world
+    kd_tree = KDTree(len(bone_names) * BONE_SAMPLES)
+    for bone_index, bone_name in enumerate(bone_names):
+        bone = bones[bone_name]
+        head = matrix @ bone.head_local
+        tail = matrix @ bone.tail_local
+        for sample in range(BONE_SAMPLES):
+            kd_tree.insert(head.lerp(tail, sample / (BONE_SAMPLES - 1)), bone_index)
+    kd_tree.balance()
+    return kd_tree
+
+
+def skin_loose_parts(mesh_object, armature_object, bone_names=None):
+    #Every connected component gets weight 1 in the group of the bone nearest to its center, other weights
+    #of the mesh are cleared. bone_names defaults to all deform bones.
+    #Returns {'components': int, 'bones': {bone name: component count}}
+    if bone_names is None:
+        bone_names = [bone.name for bone in armature_object.data.bones if bone.use_deform]
+    mesh = mesh_object.data
+    if not bone_names or len(mesh.vertices) == 0:
+        return {'components': 0, 'bones': {}}
+
+    component_ids, component_count = connected_components(mesh)
+
+    #Component centers in world space from per component coordinate sums
+    co = read_coordinates(mesh.vertices).astype(np.float64)
+    counts = np.bincount(component_ids, minlength=component_count)
+    centers = np.column_stack([np.bincount(component_ids, weights=co[:, axis], minlength=component_count) for axis in range(3)])
+    centers /= counts[:, None]
+    centers = world_space(centers, mesh_object)
+
+    kd_tree = bone_kd_tree(armature_object, bone_names)
+    component_bones = np.array([kd_tree.find(center)[1] for center in centers], dtype=np.int32)
+
+    assign_group_ids(mesh_object, bone_names, component_bones[component_ids])
+
+    used = np.bincount(component_bones, minlength=len(bone_names))
+    return {'components': component_count, 'bones': {name: int(count) for name, count in zip(bone_names, used) if count}}
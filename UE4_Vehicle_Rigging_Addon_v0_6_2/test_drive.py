@@ -0,0 +1,186 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Test drive action for validating a rig in UE: wheels spin from a speed profile, front wheels and calipers
+#steer and the needles follow speed and engine revs. Every curve is one keyframe_points.add and one
+#foreach_set from numpy arrays, with a key on every frame
+
+import json, math
+
+import bpy
+import numpy as np
+
+from . collision import bone_point_clouds, rig_meshes
+from . detection import FORWARD_AXES
+from . rig_core import OPTIONAL_PART_BONES, RIG_FINGERPRINTS_KEY
+from . transforms import world_coordinates, world_space
+
+
+#Test drive action of an armature, one per rig so vehicles in one file keep their own
+TEST_DRIVE_ACTION = "{}_Test_Drive"
+
+#Needle sweeps from rest to full scale, and the simple gearbox driving the rev counter
+NEEDLE_SWEEP = math.radians(240)
+GEAR_COUNT = 5
+IDLE_REVS = 0.15
+
+#Enum value of 'LINEAR' for foreach_set on keyframe interpolation
+LINEAR_INTERPOLATION = 1
+
+
+def speed_profile(frame_count, max_speed, ramp=0.25):
+    #Speed per frame: smooth acceleration over the first ramp of the clip, cruising, braking over the last ramp
+    t = np.linspace(0, 1, frame_count)
+    accelerate = np.clip(t / ramp, 0, 1)
+    brake = np.clip((1 - t) / ramp, 0, 1)
+    smooth = lambda x: x * x * (3 - 2 * x)
+    return max_speed * smooth(np.minimum(accelerate, brake))
+
+
+def steering_profile(frame_count, fps, max_angle, period=4.0):
+    #Slalom, a full left-right cycle every period seconds
+    return max_angle * np.sin(2 * np.pi * np.arange(frame_count) / (fps * period))
+
+
+def rev_profile(speeds, max_speed):
+    #Revs climb through each gear and drop at the shift, idle when standing
+    gear_position = speeds / max(max_speed, 1e-9) * GEAR_COUNT
+    in_gear = np.where(gear_position >= GEAR_COUNT, 1.0, gear_position % 1)
+    return IDLE_REVS + (1 - IDLE_REVS) * np.where(speeds > 0, in_gear, 0)
+
+
+def bone_axis(armature_object, bone, direction):
+    #Local rotation axis (0, 1, 2) of the bone closest to a world direction, and the sign it points with
+    to_armature = np.array(armature_object.matrix_world.inverted().to_3x3(), dtype=np.float64)
+    local_axes = np.array(bone.matrix_local.to_3x3(), dtype=np.float64)
+    alignment = local_axes.T @ (to_armature @ direction)
+    index = int(np.argmax(np.abs(alignment)))
+    return index, 1.0 if alignment[index] >= 0 else -1.0
+
+
+def euler_order(first, last):
+    #Rotation order applying the first axis first and the last one last, so wheels spin before they steer
+    if first == last:
+        return 'XYZ'
+    middle = ({0, 1, 2} - {first, last}).pop()
+    return "XYZ"[first] + "XYZ"[middle] + "XYZ"[last]
+
+
+def wheel_bone_names(armature_object):
+    #Wheel bones are the rigged parts that aren't calipers or needles (RL, RR, FL, FR or the N-wheel names).
+    #Joined rigs lose their fingerprints, then every bone but those is taken for a wheel
+    bones = armature_object.data.bones
+    other_bones = {'Root'} | {bone_name for bone_name, slot in OPTIONAL_PART_BONES}
+    fingerprints = json.loads(armature_object.get(RIG_FINGERPRINTS_KEY, "{}"))
+    return [bone.name for bone in bones if bone.name not in other_bones and (not fingerprints or bone.name in fingerprints)]
+
+
+def part_points(armature_object, bone_names):
+    #World vertices per bone, from the objects the rig fingerprints name, else from the skin weights
+    fingerprints = json.loads(armature_object.get(RIG_FINGERPRINTS_KEY, "{}"))
+    points = {}
+    for bone_name in bone_names:
+        obj = bpy.data.objects.get(fingerprints.get(bone_name, [None, None])[1] or "")
+        if obj is not None and obj.type == 'MESH':
+            points[bone_name] = world_coordinates(obj)
+    missing = [bone_name for bone_name in bone_names if bone_name not in points]
+    if missing:
+        clouds = bone_point_clouds(armature_object, rig_meshes(armature_object))
+        points.update({bone_name: clouds[bone_name][0] for bone_name in missing if bone_name in clouds})
+    return points
+
+
+def wheel_radius(points, center, axle):
+    #Furthest vertex from the axle line through the bone head
+    offsets = points - center
+    return float(np.linalg.norm(offsets - np.outer(offsets @ axle, axle), axis=1).max())
+
+
+def write_fcurve(action, bone_name, index, frames, values):
+    fcurve = action.fcurves.new('pose.bones["{}"].rotation_euler'.format(bone_name), index=index, action_group=bone_name)
+    keys = fcurve.keyframe_points
+    keys.add(len(frames))
+    keys.foreach_set('co', np.column_stack([frames, values]).astype(np.float32).ravel())
+    keys.foreach_set('interpolation', np.full(len(frames), LINEAR_INTERPOLATION, dtype=np.int32))
+    fcurve.update()
+    return fcurve
+
+
+def bake_test_drive(scene, armature_object, frame_count=250, max_speed=100.0, steering_angle=math.radians(25), forward_axis='-Y'):
+    #max_speed in km/h. Replaces the armature's test drive action.
+    #Returns {'action': Action, 'fcurves': int, 'keys': int, 'wheel_bones': [bone name], 'wheels': {bone name: radius}}
+    bones = armature_object.data.bones
+    fps = scene.render.fps / scene.render.fps_base
+    frames = scene.frame_start + np.arange(frame_count, dtype=np.float64)
+
+    forward = np.array(FORWARD_AXES[forward_axis], dtype=np.float64)
+    up = np.array((0.0, 0.0, 1.0))
+    right = np.cross(forward, up)
+
+    #Speeds in m/s, scene distances in meters through the unit scale
+    speeds = speed_profile(frame_count, max_speed / 3.6)
+    distance = np.cumsum(speeds / fps)
+    unit_scale = scene.unit_settings.scale_length or 1.0
+
+    #Only this rig's own earlier test drive is replaced
+    action_name = TEST_DRIVE_ACTION.format(armature_object.name)
+    if armature_object.animation_data is None:
+        armature_object.animation_data_create()
+    action = armature_object.animation_data.action
+    if action is not None and action.name == action_name and action.users == 1:
+        bpy.data.actions.remove(action)
+    action = bpy.data.actions.new(action_name)
+    armature_object.animation_data.action = action
+
+    wheel_names = wheel_bone_names(armature_object)
+    caliper_names = [bone.name for bone in bones if 'caliper' in bone.name.lower()]
+    heads = dict(zip(bones.keys(), world_space([bone.head_local for bone in bones], armature_object)))
+
+    #Front parts are ahead of the middle of all wheels, or of the armature origin on rigs without wheels
+    middle = np.mean([heads[name] @ forward for name in wheel_names]) if wheel_names else np.array(armature_object.matrix_world.translation) @ forward
+    steering = steering_profile(frame_count, fps, steering_angle)
+    points = part_points(armature_object, wheel_names)
+
+    fcurves = 0
+    radii = {}
+    for bone_name in wheel_names + caliper_names:
+        bone = bones[bone_name]
+        spin_index, spin_sign = bone_axis(armature_object, bone, right)
+        steer_index, steer_sign = bone_axis(armature_object, bone, up)
+        front = heads[bone_name] @ forward > middle
+        armature_object.pose.bones[bone_name].rotation_mode = euler_order(spin_index, steer_index)
+
+        if bone_name in wheel_names and bone_name in points:
+            radius = wheel_radius(points[bone_name], heads[bone_name], right) * unit_scale
+            if radius > 0:
+                radii[bone_name] = radius
+                #Rolling forward turns the top of the wheel forward, a negative turn around the right axis
+                write_fcurve(action, bone_name, spin_index, frames, -spin_sign * distance / radius)
+                fcurves += 1
+        if front and steer_index != spin_index:
+            write_fcurve(action, bone_name, steer_index, frames, steer_sign * steering)
+            fcurves += 1
+
+    #Needles turn clockwise for the driver, which looks along forward
+    needles = (('Speedometer_Needle', speeds / max(speeds.max(), 1e-9)), ('Tachometer_Needle', rev_profile(speeds, speeds.max())))
+    for bone_name, fraction in needles:
+        if bone_name not in bones:
+            continue
+        index, sign = bone_axis(armature_object, bones[bone_name], forward)
+        armature_object.pose.bones[bone_name].rotation_mode = 'XYZ'
+        write_fcurve(action, bone_name, index, frames, sign * NEEDLE_SWEEP * fraction)
+        fcurves += 1
+
+    return {'action': action, 'fcurves': fcurves, 'keys': fcurves * frame_count, 'wheel_bones': wheel_names, 'wheels': radii}
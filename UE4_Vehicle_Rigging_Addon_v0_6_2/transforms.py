@@ -0,0 +1,187 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Vectorized replacements for origin_set and transform_apply working straight on object data
+
+import bpy
+import numpy as np
+from mathutils import Vector, Matrix
+
+
+def data_users():
+    #Map every object data block to the objects using it
+    users = {}
+    for obj in bpy.data.objects:
+        if obj.data is not None:
+            users.setdefault(obj.data, []).append(obj)
+    return users
+
+
+def unique_data_objects(objects):
+    #First object for every data block, so shared data is processed only once
+    unique = {}
+    for obj in objects:
+        if obj.data is not None and obj.data not in unique:
+            unique[obj.data] = obj
+    return list(unique.values())
+
+
+def rotation_scale(obj):
+    #Object's own rotation and scale, what transform_apply(rotation=True, scale=True) bakes
+    bake = obj.matrix_basis.copy()
+    bake.translation = (0, 0, 0)
+    return bake
+
+
+def read_coordinates(collection):
+    co = np.empty(len(collection) * 3, dtype=np.float32)
+    collection.foreach_get('co', co)
+    return co.reshape(-1, 3)
+
+
+def world_space(co, obj):
+    #(n, 3) coordinates local to obj in world space, as float64
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    return np.asarray(co, dtype=np.float64).reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def world_coordinates(obj):
+    return world_space(read_coordinates(obj.data.vertices), obj)
+
+
+def transform_coordinates(collection, center, matrix):
+    #One read, one vectorized (co - center) @ matrix.T and one write back
+    co = read_coordinates(collection)
+    co -= center
+    if matrix is not None:
+        co = co @ matrix.T
+    collection.foreach_set('co', np.ascontiguousarray(co, dtype=np.float32).ravel())
+
+
+#Object types whose data can take a baked transform, and the ones among them with shape keys
+BAKEABLE_TYPES = {'MESH', 'CURVE', 'SURFACE', 'FONT', 'LATTICE', 'ARMATURE', 'META'}
+SHAPE_KEY_TYPES = {'MESH', 'CURVE', 'SURFACE', 'LATTICE'}
+
+
+def transform_data(obj, matrix):
+    if obj.type in SHAPE_KEY_TYPES:
+        obj.data.transform(matrix, shape_keys=True)
+    else:
+        obj.data.transform(matrix)
+
+
+def move_keeping_children(obj, compensation):
+    #obj's world matrix becomes matrix_world @ compensation, object-parented children stay where they are.
+    #Setting matrix_world keeps it valid without waiting for a depsgraph update
+    obj.matrix_world = obj.matrix_world @ compensation
+    inverse = compensation.inverted_safe()
+    for child in obj.children:
+        if child.parent_type == 'OBJECT':
+            child.matrix_parent_inverse = inverse @ child.matrix_parent_inverse
+
+
+#Non mesh types recentered on their bounding box
+CENTERED_TYPES = {'CURVE', 'SURFACE', 'FONT'}
+
+
+def shared_bake_matrix(obj, data_objects, bake=True):
+    #Rotation and scale can only be baked into shared data if every user has the same one
+    bake_matrix = rotation_scale(obj) if bake else Matrix.Identity(4)
+    for user in data_objects:
+        other = rotation_scale(user)
+        if any(abs(a - b) > 1e-6 for row, other_row in zip(bake_matrix, other) for a, b in zip(row, other_row)):
+            return Matrix.Identity(4)
+    return bake_matrix
+
+
+def bounds_center(co):
+    return (co.min(axis=0) + co.max(axis=0)) / 2
+
+
+def bound_box_center(obj):
+    corners = [Vector(corner) for corner in obj.bound_box]
+    return Vector([(min(c[axis] for c in corners) + max(c[axis] for c in corners)) / 2 for axis in range(3)])
+
+
+def recenter_and_bake(objects, bake=True, recenter=True, users=None):
+    #Same as origin_set(type='ORIGIN_GEOMETRY', center='BOUNDS') followed by
+    #transform_apply(location=False, rotation=True, scale=True), done in a single pass per data block
+    if users is None:
+        users = data_users()
+    processed_vertex_count = 0
+
+    for obj in unique_data_objects(o for o in objects if o.type in BAKEABLE_TYPES):
+        data = obj.data
+        data_objects = users[data]
+
+        bake_matrix = shared_bake_matrix(obj, data_objects, bake)
+        baking = bake_matrix != Matrix.Identity(4)
+
+        if obj.type == 'MESH':
+            vertex_count = len(data.vertices)
+            if vertex_count == 0 or not (baking or recenter):
+                continue
+            co = read_coordinates(data.vertices)
+            if recenter:
+                center_array = bounds_center(co)
+            else:
+                center_array = np.zeros(3, dtype=np.float32)
+            center = Vector(center_array.tolist())
+
+            if baking and data.has_custom_normals:
+                #Custom normals have to rotate too, which only the C transform does
+                data.transform(bake_matrix @ Matrix.Translation(-center), shape_keys=True)
+            else:
+                matrix = np.array(bake_matrix.to_3x3(), dtype=np.float32) if baking else None
+                co -= center_array
+                if matrix is not None:
+                    co = co @ matrix.T
+                data.vertices.foreach_set('co', np.ascontiguousarray(co, dtype=np.float32).ravel())
+                if data.shape_keys is not None:
+                    for key_block in data.shape_keys.key_blocks:
+                        transform_coordinates(key_block.data, center_array, matrix)
+                data.update()
+            processed_vertex_count += vertex_count
+        else:
+            #Curves and other data keep the C transform, their points aren't a single coordinate array
+            center = Vector()
+            if recenter and obj.type in CENTERED_TYPES:
+                center = bound_box_center(obj)
+            if not baking and center.length_squared == 0:
+                continue
+            transform_data(obj, bake_matrix @ Matrix.Translation(-center))
+
+        #Move every object using this data so nothing changes visually
+        compensation = Matrix.Translation(center) @ bake_matrix.inverted_safe()
+        for user in data_objects:
+            move_keeping_children(user, compensation)
+
+    return processed_vertex_count
+
+
+def baked_world_matrix(obj, data_objects, bake=True, recenter=True):
+    #World matrix recenter_and_bake leaves obj with when data_objects share its data, without changing anything
+    if obj.type not in BAKEABLE_TYPES:
+        return obj.matrix_world.copy()
+    bake_matrix = shared_bake_matrix(obj, data_objects, bake)
+    center = Vector()
+    if obj.type == 'MESH':
+        if len(obj.data.vertices) == 0:
+            return obj.matrix_world.copy()
+        if recenter:
+            center = Vector(bounds_center(read_coordinates(obj.data.vertices)).tolist())
+    elif recenter and obj.type in CENTERED_TYPES:
+        center = bound_box_center(obj)
+    return obj.matrix_world @ Matrix.Translation(center) @ bake_matrix.inverted_safe()
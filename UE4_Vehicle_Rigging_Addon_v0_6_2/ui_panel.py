@@ -15,6 +15,40 @@
 
 import bpy
 
+from . panel_state import rig_state
+
+class UI_UL_Wheel_List(bpy.types.UIList):
+    show_missing_only: bpy.props.BoolProperty(name = "Missing Only", default = False,
+        description = "Only show wheels without a mesh")
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        row = layout.row(align = True)
+        row.prop(item, 'wheel_name', text = "", emboss = False, icon = 'ERROR' if item.wheel_mesh is None else 'MESH_CYLINDER')
+        row.prop(item, 'wheel_mesh', text = "")
+
+    def draw_filter(self, context, layout):
+        row = layout.row()
+        row.prop(self, 'filter_name', text = "")
+        row.prop(self, 'use_filter_sort_alpha', text = "", icon = 'SORTALPHA')
+        row.prop(self, 'show_missing_only', text = "", icon = 'ERROR')
+
+    def filter_items(self, context, data, propname):
+        #Empty lists mean every item in collection order, so vehicles with many wheels cost nothing here
+        #unless a filter or sort is set
+        if not self.filter_name and not self.use_filter_sort_alpha and not self.show_missing_only:
+            return [], []
+        wheels = getattr(data, propname)
+        helper = bpy.types.UI_UL_list
+        flags = helper.filter_items_by_name(self.filter_name, self.bitflag_filter_item, wheels, 'wheel_name') if self.filter_name else []
+        if self.show_missing_only:
+            if not flags:
+                flags = [self.bitflag_filter_item] * len(wheels)
+            for index, item in enumerate(wheels):
+                if item.wheel_mesh is not None:
+                    flags[index] = 0
+        order = helper.sort_items_by_name(wheels, 'wheel_name') if self.use_filter_sort_alpha else []
+        return flags, order
+
 class UI_PT_Rig_Panel(bpy.types.Panel):
     bl_idname = "UI_PT_Rig_Panel"
     bl_label = "UE4 Vehicle Base Rigging"
@@ -29,21 +63,24 @@ class UI_PT_Rig_Panel(bpy.types.Panel):
         
         layout.label(text = "Vehicle rigging", icon = 'OUTLINER_OB_ARMATURE')
 
+        row = layout.row()
+        row.operator('view3d.auto_detect_parts', text = "Auto Detect Parts")
+
         if scene.dynamic_wheel_count is True:
             row = layout.row()
             row.label(text = "Vehicle Base")
             row.prop(scene, 'vehicle_base', text = "")
 
+            state = rig_state(scene)
+            layout.label(text = "{} wheels, {} without mesh".format(state['wheels'], state['missing_wheels']),
+                icon = 'ERROR' if state['missing_wheels'] else 'CHECKMARK')
+
+            #The list only draws the visible rows, long wheel lists scroll instead of growing the panel
             row = layout.row()
-            row.operator('view3d.add_another_wheel', text = "Add Wheel")
-            #row.operator('view3d.remove_chosen_wheel', text = "Remove Wheel")
-            for index, item in enumerate(scene.multiple_wheels):
-                row = layout.row() 
-                row.prop(item, 'wheel_name', text = "")
-                row.prop(item, 'wheel_mesh', text = "")
-                scale_row = row.row()
-                scale_row.scale_x = 0.3
-                scale_row.operator('view3d.remove_chosen_wheel', text = "X").id = index
+            row.template_list("UI_UL_Wheel_List", "", scene, "multiple_wheels", scene, "wheel_list_index", rows = 4)
+            column = row.column(align = True)
+            column.operator('view3d.add_another_wheel', text = "", icon = 'ADD')
+            column.operator('view3d.remove_chosen_wheel', text = "", icon = 'REMOVE').id = scene.wheel_list_index
         
         else:
             row = layout.row()
@@ -91,12 +128,38 @@ class UI_PT_Rig_Panel(bpy.types.Panel):
         row = layout.row()
         row.prop(scene, 'dynamic_wheel_count')
 
+        row = layout.row()
+        row.prop(scene, 'keep_mesh_instances')
+
+        row = layout.row()
+        row.prop(scene, 'armature_cleanup')
+
+        row = layout.row()
+        row.prop(scene, 'join_rig_meshes')
+
+        row = layout.row()
+        row.prop(scene, 'rig_collision_proxies')
+
+        row = layout.row()
+        row.prop(scene, 'incremental_rig')
+
         row = layout.row()
         row.prop(scene, 'bone_length')
 
         row = layout.row()
         row.operator('view3d.rig_vehicle', text = "Rig Vehicle")
 
+        row = layout.row()
+        row.operator('view3d.save_rig_template', text = "Save Template")
+        row.operator('view3d.apply_rig_template', text = "Apply Template")
+
+        layout.separator()
+        layout.label(text = "Vehicle Collections", icon = 'OUTLINER_COLLECTION')
+
+        row = layout.row()
+        row.prop(scene, 'vehicles_collection', text = "")
+        row.operator('view3d.rig_vehicle_collections', text = "Rig All")
+
 class UI_PT_Scene_Setup_Panel(bpy.types.Panel):
     bl_idname = "UI_PT_Scene_Setup_Panel"
     bl_label = "UE4 Scene Setup"
@@ -114,6 +177,9 @@ class UI_PT_Scene_Setup_Panel(bpy.types.Panel):
         row = layout.row()
         row.operator('view3d.set_unit_scale', text = "Set Unit Scale")
 
+        row = layout.row()
+        row.prop(scene, 'upscale_vehicle_collection')
+
         row = layout.row()
         row.operator('view3d.upscale_objects', text = "Upscale Objects")
 
@@ -130,6 +196,9 @@ class UI_PT_Additional_Rigging_Panel(bpy.types.Panel):
 
         scene = context.scene
 
+        row = layout.row()
+        row.prop(scene, 'bone_pivot_mode')
+
         layout.label(text = "Bone head location")
 
         column = layout.column()
@@ -168,6 +237,52 @@ class UI_PT_Additional_Rigging_Panel(bpy.types.Panel):
             
             row = layout.row()
             row.operator('view3d.add_bone_to_armature', text = "Add Bone")
+            row.operator('view3d.queue_bone', text = "Queue Bone")
+
+            for index, item in enumerate(scene.pending_bones):
+                row = layout.row()
+                row.label(text = item.bone_name, icon = "BONE_DATA")
+                row.label(text = "{} verts".format(item.vertex_count))
+                scale_row = row.row()
+                scale_row.scale_x = 0.3
+                scale_row.operator('view3d.remove_pending_bone', text = "X").id = index
+
+            if len(scene.pending_bones) > 0:
+                row = layout.row()
+                row.operator('view3d.add_queued_bones', text = "Add {} Queued Bones".format(len(scene.pending_bones)))
+
+        row = layout.row()
+        row.operator('view3d.auto_skin_loose_parts', text = "Auto Skin Loose Parts")
+
+        layout.label(text = "Weight Cache", icon = "GROUP_VERTEX")
+
+        row = layout.row()
+        row.prop(scene, 'weight_cache_directory')
+
+        row = layout.row()
+        row.prop(scene, 'weight_transfer_distance')
+
+        row = layout.row()
+        row.operator('view3d.save_weight_cache', text = "Save Weights")
+        row.operator('view3d.load_weight_cache', text = "Load Weights")
+
+        row = layout.row()
+        row.operator('view3d.compact_skin_weights', text = "Compact Skin Weights")
+
+        layout.label(text = "Collision", icon = "MOD_PHYSICS")
+
+        row = layout.row()
+        row.prop(scene, 'collision_shape')
+        row.prop(scene, 'collision_vertex_budget')
+
+        row = layout.row()
+        row.operator('view3d.generate_collision', text = "Generate Collision")
+        row.operator('view3d.generate_lods', text = "Generate LODs")
+
+        layout.label(text = "Validation", icon = "ACTION")
+
+        row = layout.row()
+        row.operator('view3d.bake_test_drive', text = "Bake Test Drive")
 
         
 
@@ -0,0 +1,106 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Vertex weights kept across mesh revisions. A snapshot stores world positions and every (vertex, group, weight)
+#influence as numpy arrays in one .npz per mesh object. Loading maps each new vertex to the nearest cached
+#one within a distance
+
+import os, re
+
+import numpy as np
+from mathutils.kdtree import KDTree
+
+from . transforms import world_coordinates
+from . weights import add_influences, clear_vertex_groups, read_vertex_weights
+
+
+CACHE_EXTENSION = ".npz"
+
+
+def cache_path(directory, obj):
+    #Caches are keyed by object name, which survives re-importing where mesh data names often don't
+    return os.path.join(directory, re.sub(r'[^\w\-.]', '_', obj.name) + CACHE_EXTENSION)
+
+
+def save_weight_cache(obj, directory):
+    #Returns {'path': str, 'vertices': int, 'influences': int}
+    vertices, groups, weights = read_vertex_weights(obj.data)
+    path = cache_path(directory, obj)
+    os.makedirs(directory, exist_ok=True)
+    np.savez_compressed(path,
+        positions=world_coordinates(obj).astype(np.float32),
+        vertices=vertices, groups=groups, weights=weights,
+        group_names=np.array([group.name for group in obj.vertex_groups], dtype=np.str_))
+    return {'path': path, 'vertices': len(obj.data.vertices), 'influences': len(vertices)}
+
+
+def load_weight_cache(directory, obj):
+    #Cached arrays of obj as a dict, None when it has no cache
+    path = cache_path(directory, obj)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as cache:
+        return {key: cache[key] for key in cache.files}
+
+
+def nearest_within(source, target, max_distance):
+    #Index of the nearest source point for every target point, -1 where none is within max_distance.
+    #One KD-tree over the source points, its query time doesn't depend on how densely the points are packed
+    nearest = np.full(len(target), -1, dtype=np.int64)
+    if len(source) == 0 or len(target) == 0:
+        return nearest
+
+    kd_tree = KDTree(len(source))
+    for index, co in enumerate(source.tolist()):
+        kd_tree.insert(co, index)
+    kd_tree.balance()
+
+    for index, co in enumerate(target.tolist()):
+        found, source_index, distance = kd_tree.find(co)
+        if source_index is not None and distance <= max_distance:
+            nearest[index] = source_index
+    return nearest
+
+
+def remap_weights(obj, cache, max_distance):
+    #Replaces the weights of obj with the cached weights of the nearest cached vertex, unmatched vertices
+    #end up selected and unweighted. Returns {'matched': int, 'unmatched': int, 'influences': int}
+    mesh = obj.data
+    nearest = nearest_within(cache['positions'].astype(np.float64), world_coordinates(obj), max_distance)
+    matched = np.flatnonzero(nearest >= 0)
+
+    #Cached influences sorted by vertex, so a vertex's influences are one slice
+    by_vertex = np.argsort(cache['vertices'], kind='stable')
+    cached_vertices = cache['vertices'][by_vertex]
+    first = np.searchsorted(cached_vertices, nearest[matched], side='left')
+    counts = np.searchsorted(cached_vertices, nearest[matched], side='right') - first
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    sources = by_vertex[np.repeat(first, counts) + within]
+    targets = np.repeat(matched, counts).astype(np.int32)
+    groups = cache['groups'][sources]
+    weights = cache['weights'][sources]
+
+    vertex_groups = obj.vertex_groups
+    clear_vertex_groups(vertex_groups)
+    group_names = [str(name) for name in cache['group_names']]
+
+    add_influences(vertex_groups, group_names, targets, groups, weights)
+
+    #Vertices without a match are selected so they are easy to find and weight by hand
+    select = nearest < 0
+    mesh.vertices.foreach_set('select', select)
+    mesh.update()
+
+    return {'matched': len(matched), 'unmatched': int(np.count_nonzero(select)), 'influences': len(targets)}
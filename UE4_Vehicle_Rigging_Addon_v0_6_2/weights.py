@@ -0,0 +1,192 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+
+#What happens to vertex groups other than the assigned one:
+#'CLEAR' keeps them (empty), 'REMOVE' deletes them
+STALE_GROUP_MODES = ('CLEAR', 'REMOVE')
+
+
+def vertex_index_buffer(vertex_count, buffers):
+    #Vertex indices are always 0..n-1, so one int32 buffer per vertex count is shared by all meshes of that size
+    indices = buffers.get(vertex_count)
+    if indices is None:
+        indices = np.arange(vertex_count, dtype=np.int32)
+        buffers[vertex_count] = indices
+    return indices
+
+
+def clear_vertex_groups(vertex_groups, stale='CLEAR'):
+    #Clearing drops every weight of every group in one call instead of subtracting group by group
+    if stale == 'CLEAR':
+        group_names = vertex_groups.keys()
+        vertex_groups.clear()
+        for name in group_names:
+            vertex_groups.new(name=name)
+    else:
+        vertex_groups.clear()
+
+
+def read_vertex_weights(mesh):
+    #Every influence as (vertex, group index, weight) arrays. Vertex weights have no foreach_get,
+    #so this is one Python loop over the influences
+    influences = [(vertex.index, element.group, element.weight) for vertex in mesh.vertices for element in vertex.groups]
+    if not influences:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    vertices, groups, weights = zip(*influences)
+    return np.array(vertices, dtype=np.int32), np.array(groups, dtype=np.int32), np.array(weights, dtype=np.float32)
+
+
+def add_influences(vertex_groups, group_names, vertices, groups, weights):
+    #Adds (vertex, index into group_names, weight) influences, creating missing groups. add() takes one weight
+    #per call, so influences are batched by (group, weight), which is one call per group for rigid weights
+    if len(vertices) == 0:
+        return
+    weight_bits = np.ascontiguousarray(weights, dtype=np.float32).view(np.int32)
+    pairs, pair_ids = np.unique(np.column_stack([groups, weight_bits]), axis=0, return_inverse=True)
+    pair_ids = pair_ids.ravel()
+    pair_order = np.argsort(pair_ids, kind='stable')
+    bounds = np.searchsorted(pair_ids[pair_order], np.arange(len(pairs) + 1))
+    for index, (group_index, bits) in enumerate(pairs):
+        group_name = group_names[group_index]
+        group = vertex_groups.get(group_name)
+        if group is None:
+            group = vertex_groups.new(name=group_name)
+        weight = float(np.int32(bits).view(np.float32))
+        group.add(np.ascontiguousarray(vertices[pair_order[bounds[index]:bounds[index + 1]]], dtype=np.int32), weight, 'REPLACE')
+
+
+def assign_rigid_weights(assignments, stale='CLEAR'):
+    #assignments is an iterable of (mesh object, vertex group name) pairs,
+    #every vertex of the mesh gets weight 1 in its group and no weight anywhere else
+    if stale not in STALE_GROUP_MODES:
+        raise ValueError("Unknown stale vertex group mode: " + str(stale))
+
+    buffers = {}
+    weighted_vertex_count = 0
+
+    for mesh, group_name in assignments:
+        vertex_groups = mesh.vertex_groups
+        indices = vertex_index_buffer(len(mesh.data.vertices), buffers)
+
+        clear_vertex_groups(vertex_groups, stale)
+
+        group = vertex_groups.get(group_name)
+        if group is None:
+            group = vertex_groups.new(name=group_name)
+        group.add(indices, 1.0, 'REPLACE')
+
+        weighted_vertex_count += len(indices)
+
+    return weighted_vertex_count
+
+
+def assign_group_ids(mesh, group_names, group_ids, stale='CLEAR'):
+    #Rigid weights from one index into group_names per vertex, -1 leaves a vertex unweighted.
+    #Vertices are sorted by group once, so every group gets a single add() call. Returns the weighted count
+    if stale not in STALE_GROUP_MODES:
+        raise ValueError("Unknown stale vertex group mode: " + str(stale))
+
+    vertex_groups = mesh.vertex_groups
+    clear_vertex_groups(vertex_groups, stale)
+
+    order = np.argsort(group_ids, kind='stable').astype(np.int32)
+    bounds = np.searchsorted(group_ids[order], np.arange(len(group_names) + 1))
+    for index, group_name in enumerate(group_names):
+        indices = order[bounds[index]:bounds[index + 1]]
+        if len(indices) == 0:
+            continue
+        group = vertex_groups.get(group_name)
+        if group is None:
+            group = vertex_groups.new(name=group_name)
+        group.add(indices, 1.0, 'REPLACE')
+
+    return int(np.count_nonzero(group_ids >= 0))
+
+
+#Rough FBX cost of skin data: an int32 index and a float64 weight per influence, plus the Transform and
+#TransformLink 4x4 double matrices of the cluster every deform group becomes
+FBX_INFLUENCE_BYTES = 12
+FBX_CLUSTER_BYTES = 256
+
+
+def skin_data_size(influence_count, group_count):
+    return influence_count * FBX_INFLUENCE_BYTES + group_count * FBX_CLUSTER_BYTES
+
+
+def modifier_group_names(obj):
+    #Groups modifiers refer to by name, these stay even when empty
+    return {getattr(modifier, 'vertex_group', '') for modifier in obj.modifiers} - {''}
+
+
+def compact_weights(obj, deform_names=None, max_influences=4, min_weight=0.0):
+    #Drops deform weights at or below min_weight, keeps the max_influences largest per vertex and renormalizes
+    #them to sum to 1, then removes empty groups. Only groups in deform_names (default all) are influences,
+    #other groups keep their weights. Vertices left without a deform weight end up selected.
+    #Returns {'removed_groups', 'removed_influences', 'unweighted', 'max_influences', 'bytes_before', 'bytes_after'}
+    mesh = obj.data
+    vertex_groups = obj.vertex_groups
+    group_names = [group.name for group in vertex_groups]
+    vertex_count = len(mesh.vertices)
+    vertices, groups, weights = read_vertex_weights(mesh)
+
+    deform = np.array([deform_names is None or name in deform_names for name in group_names] or [False], dtype=bool)
+    is_deform = deform[groups]
+    deform_vertices, deform_groups, deform_weights = vertices[is_deform], groups[is_deform], weights[is_deform]
+
+    #Rank influences per vertex by weight, the light ones sort last so pruning doesn't disturb the ranks that matter
+    order = np.lexsort((-deform_weights, deform_vertices))
+    sorted_vertices = deform_vertices[order]
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.searchsorted(sorted_vertices, sorted_vertices, side='left')
+    keep = (deform_weights > min_weight) & (rank < max_influences)
+
+    kept_vertices, kept_groups, kept_weights = deform_vertices[keep], deform_groups[keep], deform_weights[keep]
+    totals = np.bincount(kept_vertices, weights=kept_weights, minlength=vertex_count)
+    normalized = (kept_weights / totals[kept_vertices]).astype(np.float32)
+
+    #Groups that lost an influence or had one renormalized are rewritten, one remove and a few adds each
+    rewritten = np.zeros(len(group_names), dtype=bool)
+    rewritten[deform_groups[~keep]] = True
+    rewritten[kept_groups[np.abs(normalized - kept_weights) > 1e-6]] = True
+    by_group = np.argsort(deform_groups, kind='stable')
+    bounds = np.searchsorted(deform_groups[by_group], np.arange(len(group_names) + 1))
+    for group_index in np.flatnonzero(rewritten):
+        vertex_groups[group_names[group_index]].remove(deform_vertices[by_group[bounds[group_index]:bounds[group_index + 1]]])
+    add_mask = rewritten[kept_groups]
+    add_influences(vertex_groups, group_names, kept_vertices[add_mask], kept_groups[add_mask], normalized[add_mask])
+
+    #Empty groups go last, by name since removing shifts group indices
+    weighted_groups = np.concatenate([kept_groups, groups[~is_deform][weights[~is_deform] > 0]])
+    used = np.bincount(weighted_groups, minlength=len(group_names)) > 0
+    protected = modifier_group_names(obj)
+    removed_groups = [name for name, is_used in zip(group_names, used) if not is_used and name not in protected]
+    for name in removed_groups:
+        vertex_groups.remove(vertex_groups[name])
+
+    #Vertices without any deform weight are selected to be found in edit mode
+    unweighted = np.bincount(kept_vertices, minlength=vertex_count) == 0
+    mesh.vertices.foreach_set('select', unweighted)
+    mesh.update()
+
+    deform_group_count = int(np.count_nonzero(deform[:len(group_names)]))
+    removed_deform = sum(1 for name in removed_groups if deform[group_names.index(name)])
+    return {'removed_groups': len(removed_groups), 'removed_influences': int(np.count_nonzero(~keep)),
+        'unweighted': int(np.count_nonzero(unweighted)),
+        'max_influences': int(np.bincount(deform_vertices).max()) if len(deform_vertices) else 0,
+        'bytes_before': skin_data_size(len(deform_vertices), deform_group_count),
+        'bytes_after': skin_data_size(len(kept_vertices), deform_group_count - removed_deform)}
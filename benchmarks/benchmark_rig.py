@@ -0,0 +1,356 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Benchmarks of the rigging operators on procedurally generated vehicles. Usage:
+#   python benchmarks/benchmark_rig.py --blender /path/to/blender --suite quick --output results.json
+#   blender --background --python benchmarks/benchmark_rig.py -- --suite full --output results.json --compare baseline.json
+#Every case runs in its own "blender --background --factory-startup" process, so peak memory is per case.
+#Memory is reported as the growth of the process peak during the operator, the vehicle build is not counted.
+#A case is one operator on one vehicle: base vertex count, wheel count (always through multiple_wheels),
+#number of distinct wheel meshes (0 gives every wheel its own mesh) and stale vertex groups per mesh
+
+import argparse, json, os, platform, subprocess, sys, tempfile, time
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "UE4_Vehicle_Rigging_Addon_v0_6_2")
+
+OPERATORS = ('rig_vehicle', 'upscale_objects', 'add_bone_to_armature')
+
+BASELINE_CASE = {'base_vertices': 100000, 'wheels': 4, 'shared_meshes': 0, 'vertex_groups': 0}
+
+#One axis varied at a time around the baseline case
+SUITES = {
+    'quick': {
+        'base_vertices': [10000, 100000],
+    },
+    'full': {
+        'base_vertices': [10000, 100000, 1000000, 5000000],
+        'wheels': [2, 4, 8, 16, 32],
+        'shared_meshes': [0, 1, 2],
+        'vertex_groups': [0, 8, 32],
+    },
+}
+
+WHEEL_VERTICES = 2000
+
+
+def script_argv():
+    #Under Blender script arguments come after "--", under plain Python they are all arguments
+    if '--' in sys.argv:
+        return sys.argv[sys.argv.index('--') + 1:]
+    if 'bpy' in sys.modules:
+        return []
+    return sys.argv[1:]
+
+
+def suite_cases(suite, operators):
+    cases = []
+    seen = set()
+    for axis, values in SUITES[suite].items():
+        for value in values:
+            for operator in operators:
+                case = dict(BASELINE_CASE, operator=operator)
+                case[axis] = value
+                key = case_key(case)
+                if key not in seen:
+                    seen.add(key)
+                    cases.append(case)
+    return cases
+
+
+def case_key(case):
+    return "{operator} verts={base_vertices} wheels={wheels} shared={shared_meshes} groups={vertex_groups}".format(**case)
+
+
+#Worker side, runs inside Blender
+
+def load_addon():
+    sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    import importlib
+    addon = importlib.import_module(os.path.basename(ADDON_DIR))
+    addon.register()
+    return addon
+
+
+def grid_mesh(name, vertex_count, shape):
+    #Quad grid with about vertex_count vertices, shape maps the (u, v) grid in [0, 1] to coordinates
+    import bpy
+    import numpy as np
+
+    side = max(2, int(round(vertex_count ** 0.5)))
+    u, v = np.meshgrid(np.linspace(0, 1, side, dtype=np.float32), np.linspace(0, 1, side, dtype=np.float32), indexing='ij')
+    co = shape(u.ravel(), v.ravel()).astype(np.float32)
+
+    corner = (np.arange(side - 1)[:, None] * side + np.arange(side - 1)[None, :]).ravel()
+    quads = np.column_stack([corner, corner + side, corner + side + 1, corner + 1]).astype(np.int32)
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set('co', co.ravel())
+    mesh.loops.add(quads.size)
+    mesh.loops.foreach_set('vertex_index', quads.ravel())
+    mesh.polygons.add(len(quads))
+    mesh.polygons.foreach_set('loop_start', np.arange(0, quads.size, 4, dtype=np.int32))
+    mesh.polygons.foreach_set('loop_total', np.full(len(quads), 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    return mesh
+
+
+def body_shape(u, v):
+    import numpy as np
+    #Rounded 180 x 450 x 140 cm shell
+    return np.column_stack([(u - 0.5) * 180, (v - 0.5) * 450, 30 + 110 * (1 - (2 * u - 1) ** 2) * (1 - (2 * v - 1) ** 4)])
+
+
+def wheel_shape(u, v):
+    import numpy as np
+    #35 cm radius tyre around the X axis
+    angle = u * 2 * np.pi
+    return np.column_stack([(v - 0.5) * 25, np.cos(angle) * 35, np.sin(angle) * 35])
+
+
+def add_stale_groups(obj, count):
+    indices = list(range(len(obj.data.vertices)))
+    for index in range(count):
+        obj.vertex_groups.new(name="Stale_{}".format(index)).add(indices, 0.5, 'REPLACE')
+
+
+def mesh_owners(objects):
+    #Vertex groups live on the mesh, one object per mesh is enough
+    owners = {}
+    for obj in objects:
+        owners.setdefault(obj.data, obj)
+    return list(owners.values())
+
+
+def build_vehicle(case):
+    import bpy
+
+    scene = bpy.context.scene
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    scene.unit_settings.system = 'METRIC'
+    scene.unit_settings.scale_length = 0.01
+
+    body = bpy.data.objects.new("Body", grid_mesh("Body", case['base_vertices'], body_shape))
+    scene.collection.objects.link(body)
+
+    mesh_count = case['shared_meshes'] or case['wheels']
+    wheel_meshes = [grid_mesh("Wheel_{}".format(index), WHEEL_VERTICES, wheel_shape) for index in range(mesh_count)]
+
+    scene.dynamic_wheel_count = True
+    scene.multiple_wheels.clear()
+    axles = (case['wheels'] + 1) // 2
+    wheels = []
+    for index in range(case['wheels']):
+        wheel = bpy.data.objects.new("Wheel_{}".format(index), wheel_meshes[index % mesh_count])
+        axle = index // 2
+        wheel.location = (90 if index % 2 == 0 else -90, -180 + 360 * axle / max(axles - 1, 1), 35)
+        scene.collection.objects.link(wheel)
+        wheels.append(wheel)
+
+        item = scene.multiple_wheels.add()
+        item.wheel_name = "Wheel_{}".format(index)
+        item.wheel_mesh = wheel
+
+    scene.vehicle_base = body
+    for obj in mesh_owners([body] + wheels):
+        add_stale_groups(obj, case['vertex_groups'])
+
+    bpy.context.view_layer.update()
+    return body, wheels
+
+
+def prepare_add_bone(body):
+    #Rig first, then select the doors side of the body in edit mode like a user adding a door bone
+    import bpy
+    import numpy as np
+
+    bpy.ops.view3d.rig_vehicle()
+    armature_object = body.parent
+
+    bpy.ops.object.mode_set(mode='OBJECT')
+    for obj in bpy.context.view_layer.objects:
+        obj.select_set(False)
+    bpy.context.view_layer.objects.active = body
+    body.select_set(True)
+
+    co = np.empty(len(body.data.vertices) * 3, dtype=np.float32)
+    body.data.vertices.foreach_get('co', co)
+    select = co.reshape(-1, 3)[:, 0] > 45
+    body.data.vertices.foreach_set('select', select)
+    bpy.ops.object.mode_set(mode='EDIT')
+
+    scene = bpy.context.scene
+    scene.armature_for_new_bone = armature_object.data
+    scene.armature_parent_bone_name = 'Root'
+    scene.new_bone_name = 'Door_L'
+    scene.bone_head_location = (90, 50, 80)
+    scene.bone_tail_location = (90, 150, 80)
+    return int(select.sum())
+
+
+def run_worker(case, result_path):
+    import bpy
+    addon = load_addon()
+    from importlib import import_module
+    profiling = import_module(addon.__name__ + ".profiling")
+
+    result = dict(case, key=case_key(case), success=False, error=None)
+    report_dir = tempfile.mkdtemp(prefix='vehicle_rig_bench_')
+
+    try:
+        start = time.perf_counter()
+        body, wheels = build_vehicle(case)
+        result['build_time'] = time.perf_counter() - start
+
+        if case['operator'] == 'add_bone_to_armature':
+            result['selected_vertices'] = prepare_add_bone(body)
+
+        #Reports only from the operator under test, not from the rig the add bone case is prepared with
+        os.environ[profiling.REPORT_DIR_ENV] = report_dir
+        result['memory_before'] = profiling.process_memory()
+        result['peak_memory_before'] = profiling.peak_process_memory()
+
+        operator = getattr(bpy.ops.view3d, case['operator'])
+        start = time.perf_counter()
+        status = operator()
+        result['time'] = time.perf_counter() - start
+
+        result['memory_after'] = profiling.process_memory()
+        result['peak_memory'] = profiling.peak_process_memory()
+        #The process peak includes building the vehicle, only how far the operator raised it is the operator's
+        result['peak_growth'] = result['peak_memory'] - result['peak_memory_before']
+        result['status'] = sorted(status)
+        result['success'] = 'FINISHED' in status
+
+        #Stage timings from the operator's own timing report, Add Bone To Armature writes none
+        reports = sorted(os.listdir(report_dir))
+        if reports:
+            with open(os.path.join(report_dir, reports[-1])) as report_file:
+                result['stages'] = json.load(report_file)['stages']
+    except Exception as error:
+        result['error'] = "{}: {}".format(type(error).__name__, error)
+
+    with open(result_path, 'w') as result_file:
+        json.dump(result, result_file, indent=2)
+    return 0 if result['success'] else 1
+
+
+#Driver side, plain Python or Blender
+
+def run_case(blender, case, result_path, timeout):
+    command = [blender, '--background', '--factory-startup', '--python', os.path.abspath(__file__),
+        '--', '--worker', json.dumps(case), '--result', result_path]
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=timeout)
+        output = process.stdout
+    except subprocess.TimeoutExpired:
+        output = "Timed out after {} seconds".format(timeout)
+
+    if os.path.exists(result_path):
+        with open(result_path) as result_file:
+            return json.load(result_file)
+    return dict(case, key=case_key(case), success=False, error=output[-2000:])
+
+
+def blender_version(blender):
+    try:
+        output = subprocess.run([blender, '--version'], stdout=subprocess.PIPE, universal_newlines=True, timeout=60).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return output.splitlines()[0] if output else None
+
+
+def addon_version():
+    #Read bl_info without importing bpy
+    import ast
+    with open(os.path.join(ADDON_DIR, "__init__.py")) as init_file:
+        module = ast.parse(init_file.read())
+    for node in module.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'bl_info':
+            return list(ast.literal_eval(node.value)['version'])
+    return None
+
+
+def compare(results, baseline):
+    #Time ratios and peak memory growth over setup against an earlier results file, matched on case keys.
+    #Growth can be zero when the operator stays below the setup peak, so it is compared in MB, not as a ratio
+    previous = {case['key']: case for case in baseline['cases'] if case.get('success')}
+    for case in results['cases']:
+        old = previous.get(case['key'])
+        if old is None or not case.get('success'):
+            continue
+        line = "{:<70} time x{:.2f}".format(case['key'], case['time'] / max(old['time'], 1e-9))
+        if 'peak_growth' in old:
+            line += "  peak growth {:+.1f} MB (was {:.1f} MB)".format((case['peak_growth'] - old['peak_growth']) / 2 ** 20,
+                old['peak_growth'] / 2 ** 20)
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='benchmark_rig.py', description="Benchmark the vehicle rigging operators")
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--operators', nargs='+', choices=OPERATORS, default=list(OPERATORS))
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per case, the fastest one is kept")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="Earlier results file to print ratios against")
+    parser.add_argument('--blender', help="Blender executable, defaults to the running one or 'blender'")
+    parser.add_argument('--timeout', type=float, default=None, help="Seconds before a case is killed")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(json.loads(args.worker), args.result)
+
+    blender = args.blender
+    if blender is None:
+        blender = sys.modules['bpy'].app.binary_path if 'bpy' in sys.modules else 'blender'
+
+    cases = []
+    with tempfile.TemporaryDirectory(prefix='vehicle_rig_bench_') as temp_dir:
+        for index, case in enumerate(suite_cases(args.suite, args.operators)):
+            runs = [run_case(blender, case, os.path.join(temp_dir, "{}_{}.json".format(index, run)), args.timeout)
+                for run in range(args.repeat)]
+            succeeded = [run for run in runs if run['success']]
+            best = min(succeeded, key=lambda run: run['time']) if succeeded else runs[-1]
+            cases.append(best)
+            if best['success']:
+                print("{:<70} {:8.3f}s  peak growth over setup {:7.1f} MB".format(best['key'], best['time'], best['peak_growth'] / 2 ** 20))
+            else:
+                print("{:<70} FAILED {}".format(best['key'], best['error']))
+
+    results = {
+        'addon_version': addon_version(),
+        'blender': blender_version(blender),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'suite': args.suite,
+        'cases': cases,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+    return 0 if all(case['success'] for case in cases) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(script_argv()))
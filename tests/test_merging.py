@@ -0,0 +1,83 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Joining rig meshes needs Blender, these tests are skipped elsewhere. Run them with
+#   blender --background --factory-startup --python-expr "import sys, unittest; sys.exit(not unittest.main(module=None, argv=['', 'discover', 'tests'], exit=False).result.wasSuccessful())"
+
+import importlib.util, os, unittest
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "UE4_Vehicle_Rigging_Addon_v0_6_2")
+
+
+def load_module(name):
+    module_spec = importlib.util.spec_from_file_location(name, os.path.join(ADDON_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    return module
+
+
+def two_face_object(name, x, materials, face_slots):
+    #Two triangles side by side, face_slots gives each one's material slot
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata([(x, 0, 0), (x + 1, 0, 0), (x, 1, 0), (x + 2, 0, 0), (x + 2, 1, 0)], [], [(0, 1, 2), (1, 3, 4)])
+    for material in materials:
+        mesh.materials.append(material)
+    mesh.polygons.foreach_set('material_index', face_slots)
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+
+def face_materials(obj):
+    mesh = obj.data
+    return [mesh.materials[polygon.material_index].name for polygon in mesh.polygons]
+
+
+@unittest.skipUnless(bpy, "needs Blender")
+class JoinRigMeshesTest(unittest.TestCase):
+
+    def setUp(self):
+        bpy.ops.wm.read_factory_settings(use_empty=True)
+        self.merging = load_module("merging")
+        self.paint = bpy.data.materials.new("Paint")
+        self.rubber = bpy.data.materials.new("Rubber")
+
+    def test_faces_keep_materials(self):
+        body = two_face_object("Body", 0, [self.paint, self.rubber], [0, 1])
+        #Same materials in the other slot order, and an unused slot
+        wheel = two_face_object("Wheel", 5, [self.rubber, self.paint, bpy.data.materials.new("Unused")], [0, 1])
+
+        result = self.merging.join_rig_meshes(bpy.context, body, [body, wheel])
+
+        self.assertEqual(face_materials(body), ["Paint", "Rubber", "Rubber", "Paint"])
+        self.assertEqual([material.name for material in body.data.materials], ["Paint", "Rubber"])
+        self.assertEqual(result['sections_before'], 4)
+        self.assertEqual(result['sections_after'], 2)
+        #Joining already shares slots of the same material, at least the unused one goes here
+        self.assertGreaterEqual(result['removed_slots'], 1)
+
+    def test_merge_without_removed_slots(self):
+        body = two_face_object("Body", 0, [self.paint, self.rubber], [1, 0])
+        self.assertEqual(self.merging.merge_material_slots(body.data), 0)
+        self.assertEqual(face_materials(body), ["Rubber", "Paint"])
+
+
+if __name__ == "__main__":
+    unittest.main()
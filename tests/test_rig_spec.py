@@ -0,0 +1,173 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Rig spec planning without Blender. Run with "python -m pytest tests" or "python -m unittest discover tests".
+#rig_spec is loaded from its file, importing the add-on package would need bpy
+
+import copy, importlib.util, os, tempfile, unittest
+
+RIG_SPEC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "UE4_Vehicle_Rigging_Addon_v0_6_2", "rig_spec.py")
+
+module_spec = importlib.util.spec_from_file_location("rig_spec", RIG_SPEC_PATH)
+rig_spec = importlib.util.module_from_spec(module_spec)
+module_spec.loader.exec_module(rig_spec)
+
+
+def translation(x, y, z):
+    return [[1, 0, 0, x], [0, 1, 0, y], [0, 0, 1, z], [0, 0, 0, 1]]
+
+
+def vehicle_inputs():
+    return [
+        {'bone': 'Root', 'object': "Body", 'matrix': translation(0, 0, 50)},
+        {'bone': 'RL', 'object': "Wheel_RL", 'matrix': translation(-90, 150, 35)},
+        {'bone': 'RR', 'object': "Wheel_RR", 'matrix': translation(90, 150, 35)},
+        {'bone': 'FL', 'object': "Wheel_FL", 'matrix': translation(-90, -150, 35)},
+        {'bone': 'FR', 'object': "Wheel_FR", 'matrix': translation(90, -150, 35)},
+        {'bone': 'Speedometer_Needle', 'object': "Needle", 'matrix': translation(30, -60, 110), 'mode': 'BONE'},
+    ]
+
+
+class PlanRigTest(unittest.TestCase):
+
+    def test_bones_and_meshes(self):
+        spec = rig_spec.plan_rig(vehicle_inputs(), 100)
+        self.assertEqual([bone['name'] for bone in spec['bones']], ['Root', 'RL', 'RR', 'FL', 'FR', 'Speedometer_Needle'])
+        self.assertEqual(spec['bones'][0]['head'], [0, 0, 50])
+        self.assertEqual(spec['bones'][0]['tail'], [0, 100, 50])
+        self.assertTrue(all(bone['parent'] == 'Root' for bone in spec['bones'][1:]))
+        self.assertEqual(spec['bones'][4]['head'], [90, -150, 35])
+        self.assertEqual(spec['bones'][4]['tail'], [90, -50, 35])
+        self.assertEqual([mesh['mode'] for mesh in spec['meshes']], ['SKIN'] * 5 + ['BONE'])
+
+    def test_shared_bone(self):
+        #A second part with an existing bone name gets no bone of its own
+        inputs = vehicle_inputs() + [{'bone': 'FR', 'object': "Rim_FR", 'matrix': translation(90, -150, 35)}]
+        spec = rig_spec.plan_rig(inputs, 100)
+        self.assertEqual(len(spec['bones']), 6)
+        self.assertEqual(spec['meshes'][-1]['bone'], 'FR')
+
+    def test_save_load_round_trip(self):
+        spec = rig_spec.plan_rig(vehicle_inputs(), 100)
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, "vehicle.json")
+            rig_spec.save_rig_spec(spec, filepath)
+            loaded = rig_spec.load_rig_spec(filepath)
+        self.assertEqual(loaded, spec)
+
+
+class ValidateRigSpecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = rig_spec.plan_rig(vehicle_inputs(), 100)
+
+    def assertInvalid(self, spec):
+        with self.assertRaises(ValueError):
+            rig_spec.validate_rig_spec(spec)
+
+    def test_valid(self):
+        self.assertIs(rig_spec.validate_rig_spec(self.spec), self.spec)
+
+    def test_version(self):
+        spec = copy.deepcopy(self.spec)
+        spec['version'] = rig_spec.SPEC_VERSION + 1
+        self.assertInvalid(spec)
+
+    def test_parent_order(self):
+        spec = copy.deepcopy(self.spec)
+        spec['bones'].reverse()
+        self.assertInvalid(spec)
+
+    def test_unknown_bone(self):
+        spec = copy.deepcopy(self.spec)
+        spec['meshes'][1]['bone'] = 'Door_L'
+        self.assertInvalid(spec)
+
+    def test_unknown_mode(self):
+        spec = copy.deepcopy(self.spec)
+        spec['meshes'][1]['mode'] = 'PARENT'
+        self.assertInvalid(spec)
+
+    def test_base_first(self):
+        spec = copy.deepcopy(self.spec)
+        spec['meshes'].reverse()
+        self.assertInvalid(spec)
+
+
+class NamePatternTest(unittest.TestCase):
+
+    def test_trim_variants(self):
+        pattern = rig_spec.name_pattern("Wheel_FR")
+        for name in ("Wheel_FR", "Wheel_FR.001", "Sport_Wheel_FR", "Sport_Wheel_FR.012"):
+            self.assertRegex(name, pattern)
+        for name in ("Wheel_FRONT", "Wheel_FR_Rim", "Wheel_FL.001"):
+            self.assertNotRegex(name, pattern)
+
+    def test_duplicate_suffix_stripped(self):
+        self.assertEqual(rig_spec.name_pattern("Wheel_FR.001"), rig_spec.name_pattern("Wheel_FR"))
+        self.assertEqual(rig_spec.strip_name_suffix("Body.12"), "Body.12")
+
+
+class TemplateBonesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = rig_spec.plan_rig(vehicle_inputs(), 100)
+
+    def test_matched_bones_only(self):
+        bones = rig_spec.template_bones(self.spec, ['FR', 'RL'])
+        self.assertEqual([bone['name'] for bone in bones], ['Root', 'RL', 'FR'])
+        self.assertIs(bones[2], self.spec['bones'][4])
+
+    def test_parents_kept(self):
+        spec = copy.deepcopy(self.spec)
+        spec['bones'].append({'name': 'Door_L', 'parent': 'FL', 'head': [0, 0, 0], 'tail': [0, 1, 0], 'matrix': None})
+        bones = rig_spec.template_bones(spec, ['Door_L'])
+        self.assertEqual([bone['name'] for bone in bones], ['Root', 'FL', 'Door_L'])
+
+    def test_unknown_bone(self):
+        with self.assertRaises(ValueError):
+            rig_spec.template_bones(self.spec, ['Door_R'])
+
+
+class MatchTemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = rig_spec.plan_rig(vehicle_inputs(), 100)
+
+    def test_exact_names(self):
+        names = ["Body", "Wheel_RL", "Wheel_RR", "Wheel_FL", "Wheel_FR", "Needle"]
+        self.assertEqual(rig_spec.match_template(self.spec, names), names)
+
+    def test_trim_variant(self):
+        names = ["Body.001", "Wheel_RL.001", "Wheel_RR.001", "Wheel_FL.001", "Wheel_FR.001", "Dash"]
+        self.assertEqual(rig_spec.match_template(self.spec, names), names[:5] + [None])
+
+    def test_exact_name_wins(self):
+        #The exact name is kept for its own entry and not taken by an earlier pattern match
+        names = ["Body", "Wheel_FR.001", "Wheel_FR"]
+        matches = rig_spec.match_template(self.spec, names)
+        self.assertEqual(matches[4], "Wheel_FR")
+        self.assertEqual(matches[1:4], [None, None, None])
+
+    def test_each_object_used_once(self):
+        spec = rig_spec.plan_rig(vehicle_inputs() + [{'bone': 'FR', 'object': "Wheel_FR", 'matrix': translation(0, 0, 0)}], 100)
+        matches = rig_spec.match_template(spec, ["Body", "Wheel_FR.001", "Wheel_FR.002"])
+        self.assertEqual(matches[4], "Wheel_FR.001")
+        self.assertEqual(matches[-1], "Wheel_FR.002")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (C) 2019 Arturs Ontuzans
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+#Weight cache vertex matching against a brute force nearest search. Needs Blender's mathutils, run it like
+#tests/test_merging.py
+
+import os, sys, unittest
+
+import numpy as np
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+def brute_force_nearest(source, target, max_distance):
+    distances = np.linalg.norm(target[:, None, :] - source[None, :, :], axis=2)
+    nearest = distances.argmin(axis=1)
+    nearest[distances.min(axis=1) > max_distance] = -1
+    return nearest
+
+
+@unittest.skipUnless(bpy, "needs Blender")
+class NearestWithinTest(unittest.TestCase):
+
+    def setUp(self):
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from UE4_Vehicle_Rigging_Addon_v0_6_2.weight_cache import nearest_within
+        self.nearest_within = nearest_within
+        self.random = np.random.default_rng(7)
+
+    def tearDown(self):
+        sys.path.pop(0)
+
+    def assertMatchesBruteForce(self, source, target, max_distance):
+        np.testing.assert_array_equal(self.nearest_within(source, target, max_distance),
+            brute_force_nearest(source, target, max_distance))
+
+    def test_random_clouds(self):
+        for max_distance in (0.01, 0.05, 0.5, 10.0):
+            self.assertMatchesBruteForce(self.random.random((2000, 3)), self.random.random((1500, 3)), max_distance)
+
+    def test_dense_cluster(self):
+        #Many points well inside max_distance of each other, as on a dense mesh with the default distance
+        source = self.random.normal(scale=0.01, size=(3000, 3))
+        target = source + self.random.normal(scale=0.001, size=source.shape)
+        self.assertMatchesBruteForce(source, target, 0.1)
+
+    def test_car_scale(self):
+        #Centimeter scene units, a revised mesh moved slightly
+        source = self.random.random((2000, 3)) * (180, 450, 140)
+        target = source[::2] + self.random.normal(scale=0.2, size=(1000, 3))
+        self.assertMatchesBruteForce(source, target, 0.5)
+
+    def test_empty(self):
+        points = self.random.random((10, 3))
+        self.assertEqual(list(self.nearest_within(points[:0], points, 1.0)), [-1] * 10)
+        self.assertEqual(len(self.nearest_within(points, points[:0], 1.0)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()